@@ -0,0 +1,16 @@
+# Credentials of the accounts created by the seeder, which the load driver uses. This module does
+# not import the app, so that the driver can configure it before importing it
+SEED_PASSWORD = 'benchmark_password'
+SEED_EXPO_TOKEN = 'ExponentPushToken[benchmark]'
+
+
+def user_email(i):
+    return f'user{i}@benchmark.com'
+
+
+def google_email(i):
+    return f'google{i}@benchmark.com'
+
+
+def admin_email(i):
+    return f'admin{i}@benchmark.com'
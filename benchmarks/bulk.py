@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import httpx
+from benchmarks.load import admin_headers, is_failed
+from benchmarks.accounts import SEED_PASSWORD, SEED_EXPO_TOKEN
+
+
+# Returns the emails of the accounts created by a run, which are new in every run so that it can be
+# repeated on the same database
+def bulk_emails(amount):
+    run_id = uuid.uuid4().hex[:8]
+    return [f'bulk{run_id}-{i}@benchmark.com' for i in range(amount)]
+
+
+def report(items, elapsed, errors):
+    return {
+        'items': items,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(items / elapsed, 2),
+    }
+
+
+# Sends a request per item with concurrency simultaneous clients and returns its report
+async def run_single(client, requests, concurrency):
+    pending = list(reversed(requests))
+    errors = 0
+
+    async def send_requests():
+        nonlocal errors
+        while pending:
+            method, url, kwargs = pending.pop()
+            response = await client.request(method, url, **kwargs)
+            errors += is_failed(response)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send_requests() for _ in range(concurrency)])
+    return report(len(requests), time.perf_counter() - start, errors)
+
+
+# Sends every item in a single request and returns its report, the errors are the items whose
+# result is an error
+async def run_batch(client, url, json_body, headers):
+    start = time.perf_counter()
+    response = await client.post(url, json=json_body, headers=headers)
+    elapsed = time.perf_counter() - start
+    results = response.json()['results']
+    errors = sum(1 for result in results if result['status'] == 'error')
+    return report(len(results), elapsed, errors)
+
+
+# Creates and blocks amount accounts with a request per account and then another amount accounts
+# with the batch endpoints, and reports the time that each one took
+async def run_comparison(client, amount, concurrency):
+    headers = await admin_headers(client)
+    single_emails = bulk_emails(amount)
+    batch_emails = bulk_emails(amount)
+
+    def new_user(email):
+        return {'email': email, 'password': SEED_PASSWORD, 'expo_token': SEED_EXPO_TOKEN}
+
+    create = {
+        'single': await run_single(client, [
+            ('POST', '/create/', {'json': new_user(email)}) for email in single_emails
+        ], concurrency),
+        'batch': await run_batch(client, '/create_batch', {
+            'users': [new_user(email) for email in batch_emails]
+        }, headers),
+    }
+    block = {
+        'single': await run_single(client, [
+            ('POST', '/change_blocked_status', {
+                'json': {'modified_user': email, 'is_blocked': True},
+                'headers': headers,
+            })
+            for email in single_emails
+        ], concurrency),
+        'batch': await run_batch(client, '/change_blocked_status_batch', {
+            'modified_users': batch_emails,
+            'is_blocked': True,
+        }, headers),
+    }
+    return {'amount': amount, 'concurrency': concurrency, 'create': create, 'block': block}
+
+
+# Runs the comparison against the server at base_url, or against the app in this process if it is
+# None
+async def run(amount, concurrency, base_url=None, database_url=None):
+    if base_url is None:
+        if database_url is not None:
+            os.environ['DATABASE_URL'] = database_url
+        # The app reads its settings when it is imported
+        from main import app
+        client = httpx.AsyncClient(app=app, base_url='http://benchmark', timeout=None)
+    else:
+        client = httpx.AsyncClient(base_url=base_url, timeout=None,
+                                   limits=httpx.Limits(max_connections=concurrency))
+    try:
+        return await run_comparison(client, amount, concurrency)
+    finally:
+        await client.aclose()
+
+
+# Usage: python -m benchmarks.bulk --amount 1000 --concurrency 16
+# The database has to be seeded first with python -m benchmarks.seed, which creates the admin
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compares the batch endpoints with a request per account')
+    parser.add_argument('--amount', type=int, default=500,
+                        help='amount of accounts created and blocked by each approach')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='simultaneous clients that send the requests per account')
+    parser.add_argument('--base-url', default=None,
+                        help='url of a running server, the app is run in this process if not set')
+    parser.add_argument('--database-url', default=None,
+                        help='database of the app run in this process, defaults to DATABASE_URL')
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args.amount, args.concurrency, args.base_url, args.database_url))
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
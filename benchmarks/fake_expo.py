@@ -0,0 +1,34 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Answers like Expo's push API with an ok ticket per message, so that the push notifications can be
+# benchmarked without sending them
+class FakeExpoHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        messages = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.received_messages += len(messages)
+        body = json.dumps({
+            'data': [{'status': 'ok', 'id': f'ticket-{i}'} for i in range(len(messages))]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+# Starts the fake server in a background thread and returns it, its url attribute is the url of
+# the push endpoint
+def start_fake_expo(host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), FakeExpoHandler)
+    server.lock = threading.Lock()
+    server.received_messages = 0
+    server.url = f'http://{host}:{server.server_port}/--/api/v2/push/send'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import time
+import argparse
+from utils.password_hasher import build_crypt_context, PBKDF2_ROUNDS, BCRYPT_ROUNDS
+
+
+BENCHMARK_PASSWORD = 'benchmark_password'
+
+
+# Returns how many hashes per second a single core computes with the received scheme and rounds
+def hashes_per_second(scheme, rounds, seconds):
+    context = build_crypt_context([scheme], pbkdf2_rounds=rounds, bcrypt_rounds=rounds)
+    hashes = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < seconds:
+        context.hash(BENCHMARK_PASSWORD)
+        hashes += 1
+        elapsed = time.perf_counter() - start
+    return hashes / elapsed
+
+
+# Reports the hashing throughput of every setting, so that the amount of hashing workers can be
+# sized against the expected logins per second
+# Usage: python -m benchmarks.hashing --scheme pbkdf2_sha256 --rounds 29000 100000
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the password hashing throughput')
+    parser.add_argument('--scheme', choices=['pbkdf2_sha256', 'bcrypt'], action='append')
+    parser.add_argument('--rounds', type=int, nargs='*', default=None,
+                        help='rounds to measure, defaults to the configured ones')
+    parser.add_argument('--seconds', type=float, default=2)
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    default_rounds = {'pbkdf2_sha256': PBKDF2_ROUNDS, 'bcrypt': BCRYPT_ROUNDS}
+    results = []
+    for scheme in args.scheme or default_rounds.keys():
+        for rounds in args.rounds or [default_rounds[scheme]]:
+            per_core = hashes_per_second(scheme, rounds, args.seconds)
+            results.append({
+                'scheme': scheme,
+                'rounds': rounds,
+                'hashes_per_second_per_core': round(per_core, 2),
+                'milliseconds_per_hash': round(1000 / per_core, 2),
+                'cores': cores,
+                'estimated_hashes_per_second': round(per_core * cores, 2),
+            })
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+from benchmarks.fake_expo import start_fake_expo
+from benchmarks.accounts import user_email, admin_email, SEED_PASSWORD, SEED_EXPO_TOKEN
+
+
+QUERY_COUNT_HEADER = 'x-db-query-count'
+REPORTED_PERCENTILES = (50, 95, 99)
+
+# Relative weight of every endpoint in each scenario
+SCENARIOS = {
+    'login': {'login': 1},
+    'metrics': {'users_metrics': 1},
+    'users_list': {'users_list': 1},
+    'send_message': {'send_message': 1},
+    'mixed': {'login': 6, 'users_metrics': 1, 'users_list': 1, 'send_message': 2},
+}
+
+
+# Returns the email of a random seeded user that is not blocked, the seeder blocks every 50th user
+def random_user_email(rng, users):
+    i = rng.randrange(users)
+    if i % 50 == 0:
+        i = (i + 1) % users
+    return user_email(i)
+
+
+def login_request(rng, users, _admin_headers):
+    return 'POST', '/login/', {'json': {
+        'email': random_user_email(rng, users),
+        'password': SEED_PASSWORD,
+        'expo_token': SEED_EXPO_TOKEN,
+    }}
+
+
+def users_metrics_request(_rng, _users, admin_headers):
+    return 'GET', '/users_metrics', {'headers': admin_headers}
+
+
+def users_list_request(rng, users, admin_headers):
+    return 'GET', '/users_list/true', {
+        'headers': admin_headers,
+        'params': {'limit': 100, 'cursor': random_user_email(rng, users)},
+    }
+
+
+def send_message_request(rng, users, _admin_headers):
+    return 'POST', '/send_message', {'json': {
+        'email': random_user_email(rng, users),
+        'user_receiver_email': random_user_email(rng, users),
+        'message_body': 'benchmark message',
+    }}
+
+
+ENDPOINT_REQUESTS = {
+    'login': login_request,
+    'users_metrics': users_metrics_request,
+    'users_list': users_list_request,
+    'send_message': send_message_request,
+}
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * percent // 100)]
+
+
+# Summarizes the results of an endpoint, which are tuples of latency in seconds, whether the request
+# failed and the amount of queries that the server reported
+def summarize(results, duration):
+    latencies = sorted(latency * 1000 for latency, _, _ in results)
+    queries = [queries for _, _, queries in results if queries is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, failed, _ in results if failed),
+        'requests_per_second': round(len(results) / duration, 2),
+        'latency_ms': {
+            **{f'p{percent}': round(percentile(latencies, percent), 3)
+               for percent in REPORTED_PERCENTILES if latencies},
+            'max': round(latencies[-1], 3) if latencies else None,
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+# The responses of the app have the status 200 even when the request fails, the failure is in the
+# status of their body
+def is_failed(response):
+    if response.status_code >= 400:
+        return True
+    if response.headers.get('content-type', '').startswith('application/json'):
+        body = response.json()
+        return isinstance(body, dict) and body.get('status') == 'error'
+    return False
+
+
+async def admin_headers(client):
+    response = await client.post('/admin_login/', json={
+        'email': admin_email(0),
+        'password': SEED_PASSWORD,
+    })
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+# Sends requests of the scenario with concurrency simultaneous clients during duration seconds and
+# returns the report of every endpoint
+async def run_scenario(client, scenario, concurrency, duration, users, seed=0):
+    headers = await admin_headers(client)
+    endpoints = list(SCENARIOS[scenario].keys())
+    weights = list(SCENARIOS[scenario].values())
+    results = {endpoint: [] for endpoint in endpoints}
+    deadline = time.perf_counter() + duration
+
+    async def send_requests(worker_id):
+        rng = random.Random(seed + worker_id)
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            method, url, kwargs = ENDPOINT_REQUESTS[endpoint](rng, users, headers)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                results[endpoint].append((time.perf_counter() - start, True, None))
+                continue
+            latency = time.perf_counter() - start
+            queries = response.headers.get(QUERY_COUNT_HEADER)
+            results[endpoint].append((latency, is_failed(response),
+                                      int(queries) if queries is not None else None))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send_requests(worker_id) for worker_id in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'duration_seconds': round(elapsed, 3),
+        'total': summarize([result for endpoint_results in results.values()
+                            for result in endpoint_results], elapsed),
+        'endpoints': {endpoint: summarize(endpoint_results, elapsed)
+                      for endpoint, endpoint_results in results.items()},
+    }
+
+
+# Runs the benchmark against the server at base_url, or against the app in this process if it is
+# None. The app in this process uses database_url and sends the push notifications to a fake Expo
+# server, a remote server has to be started with EXPO_PUSH_URL set to the fake server's url, which
+# is printed, and with QUERY_DEBUG_HEADERS=true so that the queries per request are reported
+async def run(scenario, concurrency, duration, users, base_url=None, database_url=None,
+              fake_expo_port=0):
+    fake_expo = start_fake_expo(port=fake_expo_port)
+    if base_url is None:
+        os.environ['EXPO_PUSH_URL'] = fake_expo.url
+        os.environ['QUERY_DEBUG_HEADERS'] = 'true'
+        if database_url is not None:
+            os.environ['DATABASE_URL'] = database_url
+        # The app reads its settings when it is imported
+        from main import app
+        client = httpx.AsyncClient(app=app, base_url='http://benchmark')
+    else:
+        print(f'Fake expo push url: {fake_expo.url}', file=sys.stderr)
+        client = httpx.AsyncClient(base_url=base_url, timeout=30,
+                                   limits=httpx.Limits(max_connections=concurrency))
+    try:
+        report = await run_scenario(client, scenario, concurrency, duration, users)
+    finally:
+        await client.aclose()
+        fake_expo.shutdown()
+    report['push_notifications_received'] = fake_expo.received_messages
+    return report
+
+
+# Usage: python -m benchmarks.load --scenario mixed --concurrency 32 --duration 30
+# The database has to be seeded first with python -m benchmarks.seed
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the throughput and latency of the app')
+    parser.add_argument('--scenario', choices=list(SCENARIOS.keys()), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=10000,
+                        help='amount of users that were seeded')
+    parser.add_argument('--base-url', default=None,
+                        help='url of a running server, the app is run in this process if not set')
+    parser.add_argument('--database-url', default=None,
+                        help='database of the app run in this process, defaults to DATABASE_URL')
+    parser.add_argument('--fake-expo-port', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args.scenario, args.concurrency, args.duration, args.users,
+                             args.base_url, args.database_url, args.fake_expo_port))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
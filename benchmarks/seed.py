@@ -0,0 +1,113 @@
+import sys
+import json
+import time
+import secrets
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert
+from database.database import Base, db_url
+from database_models.user import User
+from database_models.google import Google
+from database_models.admin import Admin
+from utils.password_hasher import crypt_context
+from benchmarks.accounts import user_email, google_email, admin_email, SEED_PASSWORD,\
+    SEED_EXPO_TOKEN
+
+
+# The registration and login dates are spread over the last days so that the metrics queries have
+# to filter them
+def account_dates(i, date_now):
+    registration_date = date_now - timedelta(minutes=(i * 7) % (3 * 24 * 60))
+    return registration_date, registration_date + timedelta(minutes=i % 60)
+
+
+def user_rows(amount, hashed_password, date_now):
+    for i in range(amount):
+        registration_date, last_login_date = account_dates(i, date_now)
+        yield {
+            'email': user_email(i),
+            'hashed_password': hashed_password,
+            'firebase_password': secrets.token_hex(25),
+            'is_blocked': i % 50 == 0,
+            'registration_date': registration_date,
+            'last_login_date': last_login_date,
+            'expo_token': SEED_EXPO_TOKEN,
+        }
+
+
+def google_rows(amount, date_now):
+    for i in range(amount):
+        registration_date, last_login_date = account_dates(i, date_now)
+        yield {
+            'email': google_email(i),
+            'firebase_password': secrets.token_hex(25),
+            'is_blocked': i % 50 == 0,
+            'registration_date': registration_date,
+            'last_login_date': last_login_date,
+            'expo_token': SEED_EXPO_TOKEN,
+        }
+
+
+def admin_rows(amount, hashed_password):
+    for i in range(amount):
+        yield {'email': admin_email(i), 'hashed_password': hashed_password, 'name': f'admin{i}'}
+
+
+# Inserts the rows in batches of batch_size rows, each one with a single executemany
+def bulk_insert(connection, model, rows, batch_size):
+    inserted_rows = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            connection.execute(insert(model.__table__), batch)
+            inserted_rows += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert(model.__table__), batch)
+        inserted_rows += len(batch)
+    return inserted_rows
+
+
+# Seeds the database with accounts whose password is SEED_PASSWORD. The password is hashed once and
+# its hash is shared by every account, so the seeding is not bound by the hashing cost. Returns the
+# amount of inserted rows per table and the seconds that it took
+def seed(database_url, users, google_accounts, admins, batch_size=5000):
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    hashed_password = crypt_context.hash(SEED_PASSWORD)
+    date_now = datetime.now()
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        inserted_rows = {
+            User.__tablename__: bulk_insert(connection, User,
+                                            user_rows(users, hashed_password, date_now),
+                                            batch_size),
+            Google.__tablename__: bulk_insert(connection, Google,
+                                              google_rows(google_accounts, date_now), batch_size),
+            Admin.__tablename__: bulk_insert(connection, Admin,
+                                             admin_rows(admins, hashed_password), batch_size),
+        }
+    engine.dispose()
+    return {'inserted_rows': inserted_rows, 'seconds': round(time.perf_counter() - start, 3)}
+
+
+# Usage: python -m benchmarks.seed --database-url sqlite:///./benchmark.db --users 100000
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seeds the database with benchmark accounts')
+    parser.add_argument('--database-url', default=db_url,
+                        help='defaults to the DATABASE_URL environment variable')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--google-accounts', type=int, default=10000)
+    parser.add_argument('--admins', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    result = seed(args.database_url, args.users, args.google_accounts, args.admins,
+                  args.batch_size)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,44 +3,91 @@ tags_metadata = [
     {
         "name": "login",
         "description": "Checks if the user is registered with a normal user account. If he is and the password is correct" +
-        "then it returns ok in status, otherwise it returns an error status and a message indicating the error (eg: user does not exist)",
+        "then it returns ok in status with an access_token and a refresh_token, otherwise it returns an error status and a message indicating the error (eg: user does not exist)",
     },
     {
         "name": "admin_login",
         "description": "Checks if the user is registered as an admin. If he is and the password is correct" +
-        "then it returns ok in status, otherwise it returns an error status and a message indicating the error",
+        "then it returns ok in status with an access_token and a refresh_token, otherwise it returns an error status and a message indicating the error",
     },
     {
         "name": "create",
         "description": "Tries to create a new normal user account, returns ok if it was created, error if the user already exists or any other error ocurrs",
     },
+    {
+        "name": "create_batch",
+        "description": "Creates many user accounts from a json list or a csv file with the email, password and expo_token columns, in a single " +
+        "transaction. Returns a result per user, with the firebase password of the created ones. Requires an admin access token in the Authorization header",
+    },
     {
         "name": "admin_create",
-        "description": "Tries to create a new admin account, returns ok if it was created, error if the user already exists or any other error ocurrs",
+        "description": "Tries to create a new admin account, returns ok if it was created, error if the user already exists or any other error ocurrs. " +
+        "Requires an admin access token in the Authorization header",
     },
     {
         "name": "users_list",
-        "description": "Returns a list containing the emails and blocking status of all the users from the platform",
+        "description": "Returns a page of the list containing the emails and blocking status of the users from the platform, sorted by email. " +
+        "The next page is requested sending the received next_cursor as cursor, which is null in the last page. The users can be filtered by " +
+        "is_blocked, account_type and email_prefix. If stream is true every matching user is sent as a json line while it is read from the database. " +
+        "Requires an admin access token in the Authorization header",
     },
     {
         "name": "oauth_login",
         "description": "Checks if the user has a google account, if it already has then it returns ok  and the message: {google account exists}, " + 
         "otherwise if the user did not have a google account it is created, answearing also with an ok status and message {user successfully registered}." + 
-        "If the user already has an account it returns an error status with the message {has normal account}",
+        "If the user already has an account it returns an error status with the message {has normal account}. The successful responses include an access_token and a refresh_token",
     },
     {
         "name": "change_blocked_status",
         "description": "Changes the account status of the received user based in the value received in is_blocked, if it is True then the user is blocked" + 
-        ", otherwise he is unblocked. Returns an ok status if the process was executed sucessfuly, otherwise it returns an error status with a message",
+        ", otherwise he is unblocked. Returns an ok status if the process was executed sucessfuly, otherwise it returns an error status with a message. " +
+        "Requires an admin access token in the Authorization header",
+    },
+    {
+        "name": "change_blocked_status_batch",
+        "description": "Changes the account status of the listed users with a single update per table, in a single transaction. Returns a result " +
+        "per user, which is an error if the user does not exist. Requires an admin access token in the Authorization header",
     },
     {
         "name": "users_metrics",
-        "description": "Changes the account status of the received user based in the value received in is_blocked, if it is True then the user is blocked" + 
-        ", otherwise he is unblocked. Returns an ok status if the process was executed sucessfuly, otherwise it returns an error status with a message",
+        "description": "Returns the amount of users, of blocked and non blocked users, and of normal and google users that registered in the last day " +
+        "and logged in in the last hour. Requires an admin access token in the Authorization header",
+    },
+    {
+        "name": "login_activity",
+        "description": "Returns the amount of logins and of users that logged in per hour or per day of the last periods, and per account table. " +
+        "The periods are updated in the background every minute. Requires an admin access token in the Authorization header",
+    },
+    {
+        "name": "refresh_token",
+        "description": "Receives a refresh token and returns a new access_token and refresh_token if the token is valid and the account still exists and is not blocked",
     },
     {
         "name": "send_message",
-        "description": "Sends an HTTP request to the endpoint that redirects it to the cellphone that has to receive the push notification, it returns" + 
-        "allways an ok status",
+        "description": "Queues the push notification for the cellphone of the receiver, which is sent to expo in batches in the background. It returns" + 
+        "an ok status and the message_id that identifies the push ticket, or an error if the receiver does not exist",
+    },
+    {
+        "name": "push_ticket",
+        "description": "Returns the ticket of a queued push notification, which has the status queued until expo answers with its ticket. " +
+        "The tickets are best-effort: they are only kept by the server worker that queued the message, the other workers answer that it does not exist",
+    },
+    {
+        "name": "broadcast_message",
+        "description": "Sends a push notification to the listed users, or to every user that is not blocked if no user is listed (only for admins), " +
+        "in a background job. Returns the id of the job and its progress. Requires an access token of the sender in the Authorization header, which has to be an admin one to send it to every user",
+    },
+    {
+        "name": "broadcast_job",
+        "description": "Returns the progress of a broadcast job: the amount of receivers, distinct expo tokens, and sent and failed notifications. The progress is stored in the database, so any server worker can report it, and it is kept for BROADCAST_JOBS_RETENTION_DAYS days",
+    },
+    {
+        "name": "metrics",
+        "description": "Returns the request counts, the request latency histograms per route and the time spent in database queries, " +
+        "password hashing and requests to external services, in the Prometheus text format",
+    },
+    {
+        "name": "database_pool_status",
+        "description": "Returns the amount of checked out, idle and overflow connections of the database connection pools",
     },
 ]
\ No newline at end of file
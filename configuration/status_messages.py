@@ -1,4 +1,6 @@
 import json
+import orjson
+from fastapi.responses import Response
 import configuration.file_names as file_names
 
 MESSAGE_NAME_FIELD = "message"
@@ -6,12 +8,22 @@ MESSAGE_NAME_FIELD = "message"
 class StatusMessages:
     def __init__(self):
         self.json_data = json.load(open(file_names.STATUS_MESSAGE_FILE_NAME))
+        # The messages are serialized once so that the replies that only have a status message do
+        # not serialize anything per request
+        self.serialized_messages = {
+            context: orjson.dumps(message) for context, message in self.json_data.items()
+        }
 
     #Returns a dictionary of the type {"status": str, "message": str} given the context in 
     #which the method is called, which is the name of the dictionary in the status json file
     def get_message(self, context: str):
         return self.json_data[context]
 
+    #Returns a json response whose body is the serialized message of the given context
+    def get_response(self, context: str, status_code: int = 200):
+        return Response(content=self.serialized_messages[context], status_code=status_code,
+                        media_type='application/json')
+
 
 
 public_status_messages = StatusMessages()
\ No newline at end of file
@@ -0,0 +1,240 @@
+from sqlalchemy import select, literal, null, union, union_all, exists, cast
+from passlib.pwd import genword
+import database_models.user as db_user
+import database_models.google as db_google
+from database.statements import update_rows, update_returning_all, UPSERT_INSERTS
+from models.account_type import AccountType
+
+
+ACCOUNT_MODELS = {
+    db_user.User.__tablename__: db_user.User,
+    db_google.Google.__tablename__: db_google.Google,
+}
+
+# Amount of rows of each multi-row INSERT, which keeps the amount of parameters of a statement
+# below the limit of sqlite
+BATCH_INSERT_SIZE = 100
+
+ACCOUNT_TYPE_MODELS = {
+    AccountType.normal: db_user.User,
+    AccountType.google: db_google.Google,
+}
+
+
+# Account of a user that can be registered either in the users table or in the Google table,
+# model is the database model of the table that owns it
+class Account:
+    def __init__(self, model, email, hashed_password, firebase_password, is_blocked, expo_token):
+        self.model = model
+        self.email = email
+        self.hashed_password = hashed_password
+        self.firebase_password = firebase_password
+        self.is_blocked = is_blocked
+        self.expo_token = expo_token
+
+    def is_google_account(self):
+        return self.model is db_google.Google
+
+
+# Selects the account with the received email from both tables in a single statement, google
+# accounts do not have a password so their hashed_password is null
+def account_statement(email):
+    users_statement = select(
+        literal(db_user.User.__tablename__).label('table_name'),
+        db_user.User.email,
+        db_user.User.hashed_password,
+        db_user.User.firebase_password,
+        db_user.User.is_blocked,
+        db_user.User.expo_token,
+    ).where(db_user.User.email == email)
+    google_statement = select(
+        literal(db_google.Google.__tablename__).label('table_name'),
+        db_google.Google.email,
+        null().label('hashed_password'),
+        db_google.Google.firebase_password,
+        db_google.Google.is_blocked,
+        db_google.Google.expo_token,
+    ).where(db_google.Google.email == email)
+    return union_all(users_statement, google_statement)
+
+
+# Returns the Account with the received email or None if it is not registered in any table
+async def find_account(db, email):
+    row = (await db.execute(account_statement(email))).first()
+    if row is None:
+        return None
+    return Account(
+        ACCOUNT_MODELS[row.table_name],
+        row.email,
+        row.hashed_password,
+        row.firebase_password,
+        row.is_blocked,
+        row.expo_token
+    )
+
+
+# Updates the columns of the account with the received email, values is a dictionary indexed by
+# column name. The users table is updated first and the Google table only if the email was not
+# found, so it takes a single statement for normal accounts. conditions receives the model and
+# returns extra where clauses that the account has to match to be updated. Returns the model of
+# the updated account or None if no account was updated
+async def update_account(db, email, values, conditions=lambda _model: ()):
+    for model in ACCOUNT_MODELS.values():
+        where = (model.email == email, *conditions(model))
+        if await update_rows(db, model, where, values) > 0:
+            return model
+    return None
+
+
+# Returns the name of the table of the registered accounts whose email is in emails, indexed by
+# email, reading both tables in a single statement
+async def find_account_tables(db, emails):
+    statement = union_all(*[
+        select(literal(model.__tablename__).label('table_name'), model.email)
+        .where(model.email.in_(emails))
+        for model in ACCOUNT_MODELS.values()
+    ])
+    return {row.email: row.table_name for row in (await db.execute(statement)).all()}
+
+
+# Updates the accounts whose email is in emails like update_account does, but with a single
+# UPDATE per table for every email. Returns the model of each updated account indexed by email
+async def update_accounts(db, emails, values, conditions=lambda _model: ()):
+    updated_accounts = {}
+    for model in ACCOUNT_MODELS.values():
+        where = (model.email.in_(emails), *conditions(model))
+        for row in await update_returning_all(db, model, where, values, (model.email,)):
+            updated_accounts[row.email] = model
+    return updated_accounts
+
+
+# Inserts the users with multi-row inserts of BATCH_INSERT_SIZE rows. rows are dictionaries
+# indexed by column name. The users whose email was registered after it was checked (eg: by a
+# concurrent request) are skipped instead of failing the whole batch. Returns the emails of the
+# inserted users, databases without INSERT ... RETURNING (eg: sqlite) tell them apart from the
+# skipped ones by their firebase password
+async def insert_users(db, rows):
+    user = db_user.User
+    insert = UPSERT_INSERTS[db.bind.dialect.name]
+    inserted_emails = set()
+    for i in range(0, len(rows), BATCH_INSERT_SIZE):
+        batch = rows[i:i + BATCH_INSERT_SIZE]
+        statement = insert(user).values(batch).on_conflict_do_nothing(index_elements=[user.email])
+        if db.bind.dialect.full_returning:
+            inserted_rows = (await db.execute(statement.returning(user.email))).all()
+            inserted_emails.update(row.email for row in inserted_rows)
+            continue
+        await db.execute(statement)
+        firebase_passwords = {row['email']: row['firebase_password'] for row in batch}
+        stored_rows = (await db.execute(
+            select(user.email, user.firebase_password)
+            .where(user.email.in_(list(firebase_passwords.keys())))
+        )).all()
+        inserted_emails.update(row.email for row in stored_rows
+                               if row.firebase_password == firebase_passwords[row.email])
+    return inserted_emails
+
+
+# Selects the email and blocked status of the accounts of both tables ordered by email, starting
+# after the cursor email. Each table is filtered, sorted and limited on its own so that the
+# pagination uses the primary key index instead of sorting every account. The filters that are
+# None are not applied
+def accounts_list_statement(cursor=None, limit=None, is_blocked=None, account_type=None,
+                            email_prefix=None):
+    statements = []
+    for model_account_type, model in ACCOUNT_TYPE_MODELS.items():
+        if (account_type is not None) and (account_type != model_account_type):
+            continue
+        statement = select(model.email, model.is_blocked)
+        if cursor is not None:
+            statement = statement.where(model.email > cursor)
+        if is_blocked is not None:
+            statement = statement.where(model.is_blocked == is_blocked)
+        if email_prefix:
+            statement = statement.where(model.email.startswith(email_prefix, autoescape=True))
+        statement = statement.order_by(model.email)
+        if limit is not None:
+            statement = statement.limit(limit)
+        # Wrapped in a subquery since sqlite does not allow ORDER BY and LIMIT in each part of
+        # a UNION
+        statement = statement.subquery()
+        statements.append(select(statement.c.email, statement.c.is_blocked))
+
+    accounts = union_all(*statements).subquery()
+    statement = select(accounts.c.email, accounts.c.is_blocked).order_by(accounts.c.email)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+# Selects the distinct expo tokens of the accounts of both tables that are not blocked, only of
+# the received emails if they are not None and only of the account type if it is not None
+def expo_tokens_statement(emails=None, account_type=None):
+    statements = []
+    for model_account_type, model in ACCOUNT_TYPE_MODELS.items():
+        if (account_type is not None) and (account_type != model_account_type):
+            continue
+        statement = select(model.expo_token).where(model.is_blocked.is_(False),
+                                                   model.expo_token.isnot(None))
+        if emails is not None:
+            statement = statement.where(model.email.in_(emails))
+        statements.append(statement)
+    return union(*statements)
+
+
+# Registers the google account, or logs it in if it is already registered and not blocked, with a
+# single INSERT ... ON CONFLICT (email) DO UPDATE statement, so concurrent first logins do not race
+# into integrity errors. The account is not inserted if the email belongs to a normal account
+def google_login_statement(dialect_name, email, firebase_password, expo_token, date_now):
+    google = db_google.Google
+    values = {
+        google.email: email,
+        google.firebase_password: firebase_password,
+        google.is_blocked: False,
+        google.registration_date: date_now,
+        google.last_login_date: date_now,
+        google.expo_token: expo_token,
+    }
+    # postgres can not infer the types of the parameters of a SELECT list, but sqlite would turn
+    # the dates into numbers if they were cast. The strings are cast without their length, since
+    # the cast would truncate them instead of failing like the insert does
+    if dialect_name == 'postgresql':
+        selected_values = [cast(literal(value), type(column.type)())
+                           for column, value in values.items()]
+    else:
+        selected_values = [literal(value, column.type) for column, value in values.items()]
+    statement = UPSERT_INSERTS[dialect_name](google).from_select(
+        list(values.keys()),
+        select(*selected_values).where(~exists().where(db_user.User.email == email))
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[google.email],
+        set_={
+            google.last_login_date.name: statement.excluded.last_login_date,
+            google.expo_token.name: statement.excluded.expo_token,
+        },
+        where=google.is_blocked.is_(False)
+    )
+
+
+# Logs in the google account with the received email, registering it if it does not exist.
+# Returns the email, the firebase password and whether the account was created, or None if the
+# account is blocked or the email belongs to a normal account. A new account gets the firebase
+# password generated here, which tells apart the inserted rows from the updated ones. Databases
+# without INSERT ... RETURNING (eg: sqlite) select the account after the upsert
+async def upsert_google_login(db, email, expo_token, date_now):
+    google = db_google.Google
+    firebase_password = genword(charset="hex", length=50)
+    statement = google_login_statement(db.bind.dialect.name, email, firebase_password,
+                                       expo_token, date_now)
+    columns = (google.email, google.firebase_password)
+    if db.bind.dialect.full_returning:
+        row = (await db.execute(statement.returning(*columns))).first()
+    else:
+        await db.execute(statement)
+        row = (await db.execute(
+            select(*columns).where(google.email == email, google.is_blocked.is_(False))
+        )).first()
+    if row is None:
+        return None
+    return row.email, row.firebase_password, row.firebase_password == firebase_password
@@ -0,0 +1,113 @@
+import asyncio
+from abc import ABC, abstractmethod
+from utils.logger import logger
+
+
+# Base of the writers that buffer rows in memory and write them in batches, every interval seconds
+# or as soon as max_size rows are buffered. Subclasses keep the buffered rows and implement
+# pending_size, take_pending, restore_pending and write, and can implement written, which is called
+# after a batch is committed. The writer is bound to the event loop in
+# which it is first used, and it is bound again if it is used from another loop (eg: in the tests)
+class BufferedWriter(ABC):
+    def __init__(self, interval, max_size, session_factory):
+        self.interval = interval
+        self.max_size = max_size
+        self.session_factory = session_factory
+        self.written_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.loop = None
+        self.worker = None
+        self.flush_lock = None
+        self.flush_requested = None
+
+    @abstractmethod
+    def pending_size(self):
+        pass
+
+    # Returns the buffered rows and empties the buffer
+    @abstractmethod
+    def take_pending(self):
+        pass
+
+    # Buffers again the rows of a batch that could not be written
+    @abstractmethod
+    def restore_pending(self, batch):
+        pass
+
+    @abstractmethod
+    async def write(self, db, batch):
+        pass
+
+    async def written(self, batch):
+        pass
+
+    # Must be called by the subclasses after buffering rows, it starts the periodic flushes and
+    # requests a flush if the buffer is full
+    def buffered(self):
+        self.bind()
+        if self.worker is None or self.worker.done():
+            self.worker = self.loop.create_task(self.__flush_periodically())
+        if self.pending_size() >= self.max_size:
+            self.flush_requested.set()
+
+    # Writes the buffered rows and returns how many were written, waiting for the flush in progress
+    # so that every row buffered before the call is written when it returns. If the write fails the
+    # rows are buffered again to be written by the next flush
+    async def flush(self):
+        self.bind()
+        async with self.flush_lock:
+            if self.pending_size() == 0:
+                return 0
+            batch = self.take_pending()
+            db = self.session_factory()
+            try:
+                await self.write(db, batch)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.warning(f"Error writing {len(batch)} buffered rows with "
+                               f"{type(self).__name__}: {e}")
+                self.restore_pending(batch)
+                self.failed_flushes += 1
+                return 0
+            finally:
+                await db.close()
+            self.written_rows += len(batch)
+            self.flushes += 1
+            await self.written(batch)
+            return len(batch)
+
+    def metrics(self):
+        return {
+            'pending': self.pending_size(),
+            'written_rows': self.written_rows,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+        }
+
+    # Stops the periodic flushes and writes the rows that are still buffered
+    async def close(self):
+        if self.worker is not None and self.loop is asyncio.get_running_loop():
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+        await self.flush()
+
+    def bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.worker = None
+        self.flush_lock = asyncio.Lock()
+        self.flush_requested = asyncio.Event()
+
+    async def __flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
@@ -1,31 +1,172 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 from time import sleep
 from utils.logger import logger
+from database.query_instrumentation import instrument_queries
+from database.threaded_session import ThreadedSession
+
 
-db_url = os.environ.get('DATABASE_URL', 'sqlite:///./test.db')
 # Some versions of sqlalchemy do not support postgres in the url, it has to be postgresql
-if db_url.find('postgresql') == -1:
-    db_url = db_url.replace('postgres', 'postgresql', 1)
-
-engine_args = {"check_same_thread": False} if 'sqlite' in db_url else {}
-
-has_connected = False
-while not has_connected:
-    try:
-        engine = create_engine(db_url, connect_args=engine_args)
-    except OperationalError:
-        logger.warning(f"Failed to connect to database with url {db_url}, attempting to reconnect")
-        sleep(1)
-    else:
-        has_connected = True
-
-session_args = {'bind': engine}
+def normalize_url(url):
+    if url.find('postgresql') == -1:
+        return url.replace('postgres', 'postgresql', 1)
+    return url
+
+
+db_url = normalize_url(os.environ.get('DATABASE_URL', 'sqlite:///./test.db'))
+# Optional url of a read replica of the database, which is used by the read only endpoints
+db_read_url = os.environ.get('DATABASE_READ_URL')
+if db_read_url:
+    db_read_url = normalize_url(db_read_url)
+
+# If it is false the handlers use the synchronous engine, running its queries in the threadpool
+use_async_database = os.environ.get('DATABASE_ASYNC', 'true').lower() == 'true'
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+# Returns the url of the database using the asynchronous driver of its dialect
+def get_async_url(url):
+    scheme, rest = url.split('://', 1)
+    dialect = scheme.split('+')[0]
+    return f'{ASYNC_DRIVERS[dialect]}://{rest}'
+
+
+def connect_arguments(url):
+    return {"check_same_thread": False} if 'sqlite' in url else {}
+
+
+# sqlite does not use a QueuePool, so the sizing settings only apply to the other databases. The
+# read replica has its own pool with the same settings
+def pool_arguments(url):
+    if 'sqlite' in url:
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+
+
+engine_args = connect_arguments(db_url)
+pool_args = pool_arguments(db_url)
+
+CONNECT_RETRY_DELAY = float(os.environ.get('DATABASE_CONNECT_RETRY_DELAY', 0.5))
+CONNECT_MAX_RETRY_DELAY = float(os.environ.get('DATABASE_CONNECT_MAX_RETRY_DELAY', 30))
+# 0 means that it retries until the database is available
+CONNECT_MAX_ATTEMPTS = int(os.environ.get('DATABASE_CONNECT_MAX_ATTEMPTS', 0))
+
+
+# Opens a connection to check that the database is reachable, since create_engine does not connect
+# until the first query. Retries with exponential backoff, raising the last error if the maximum
+# amount of attempts is reached
+def wait_for_database(engine_to_probe, retry_delay=CONNECT_RETRY_DELAY,
+                      max_retry_delay=CONNECT_MAX_RETRY_DELAY, max_attempts=CONNECT_MAX_ATTEMPTS):
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            with engine_to_probe.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+            return attempts
+        except OperationalError:
+            if max_attempts and attempts >= max_attempts:
+                raise
+            logger.warning(f"Failed to connect to database with url {engine_to_probe.url!r}, "
+                           f"attempting to reconnect in {retry_delay} seconds")
+            sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, max_retry_delay)
+
+
+# Returns the amount of connections of the engine's pool by state, pools that do not keep
+# connections (eg: the ones used for sqlite) only report their type
+def pool_status(engine_to_inspect):
+    pool = engine_to_inspect.pool
+    status = {'pool': type(pool).__name__}
+    if hasattr(pool, 'checkedout'):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(0, pool.overflow()),
+        })
+    return status
+
+
+engine = create_engine(db_url, connect_args=engine_args, **pool_args)
+instrument_queries(engine)
+wait_for_database(engine)
+
+session_args = {'bind': engine, 'expire_on_commit': False}
 if 'sqlite' in db_url:
     session_args['autoflush'] = False
 
 Session = sessionmaker(**session_args)
 Base = declarative_base()
+
+async_engine = None
+AsyncSessionMaker = None
+if use_async_database:
+    async_engine = create_async_engine(get_async_url(db_url), **pool_args)
+    instrument_queries(async_engine.sync_engine)
+    AsyncSessionMaker = sessionmaker(**{
+        **session_args,
+        'bind': async_engine,
+        'class_': AsyncSession,
+    })
+
+# The replica is not waited for when the app starts, the reads use the primary database while it
+# is not available
+read_engine = None
+ReadSession = None
+read_async_engine = None
+AsyncReadSessionMaker = None
+if db_read_url:
+    read_engine = create_engine(db_read_url, connect_args=connect_arguments(db_read_url),
+                                **pool_arguments(db_read_url))
+    instrument_queries(read_engine)
+    read_session_args = {**session_args, 'bind': read_engine}
+    ReadSession = sessionmaker(**read_session_args)
+    if use_async_database:
+        read_async_engine = create_async_engine(get_async_url(db_read_url),
+                                                **pool_arguments(db_read_url))
+        instrument_queries(read_async_engine.sync_engine)
+        AsyncReadSessionMaker = sessionmaker(**{
+            **read_session_args,
+            'bind': read_async_engine,
+            'class_': AsyncSession,
+        })
+
+
+# create_all only creates the indexes of the tables that it creates, so the indexes added to
+# existing tables have to be created separately
+def create_missing_indexes(engine_to_migrate):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine_to_migrate, checkfirst=True)
+
+
+# Returns a session with an awaitable interface, which is an AsyncSession unless the asynchronous
+# engine was disabled
+def new_session():
+    if use_async_database:
+        return AsyncSessionMaker()
+    return ThreadedSession(Session())
+
+
+# Returns a session of the read replica, or None if there is no replica
+def new_read_session():
+    if ReadSession is None:
+        return None
+    if use_async_database:
+        return AsyncReadSessionMaker()
+    return ThreadedSession(ReadSession())
@@ -0,0 +1,39 @@
+from sqlalchemy.exc import OperationalError, InterfaceError
+
+
+# SQLSTATE codes of the postgres errors that the handlers report to the client, see
+# https://www.postgresql.org/docs/current/errcodes-appendix.html
+NOT_NULL_VIOLATION = '23502'
+UNIQUE_VIOLATION = '23505'
+STRING_DATA_RIGHT_TRUNCATION = '22001'
+
+
+# Returns the SQLSTATE of the error raised by the driver, psycopg2 stores it in pgcode while asyncpg
+# stores it in sqlstate of the exception wrapped by sqlalchemy's adapter. Returns None if the
+# driver does not report it (eg: sqlite)
+def error_code(error):
+    original_error = getattr(error, 'orig', error)
+    for candidate in (original_error, original_error.__cause__):
+        code = getattr(candidate, 'pgcode', None) or getattr(candidate, 'sqlstate', None)
+        if code is not None:
+            return code
+    return None
+
+
+def is_not_null_violation(error):
+    return error_code(error) == NOT_NULL_VIOLATION
+
+
+def is_unique_violation(error):
+    return error_code(error) == UNIQUE_VIOLATION
+
+
+def is_string_data_right_truncation(error):
+    return error_code(error) == STRING_DATA_RIGHT_TRUNCATION
+
+
+# Returns whether the error was raised because the database could not be reached or the connection
+# was lost, so the statement can be retried on another database
+def is_connection_error(error):
+    return isinstance(error, (OperationalError, InterfaceError, OSError)) or\
+        getattr(error, 'connection_invalidated', False)
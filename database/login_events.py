@@ -0,0 +1,231 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, distinct, literal, DateTime
+from database.database import new_session
+from database.buffered_writer import BufferedWriter
+from database.statements import UPSERT_INSERTS
+from database_models.login_event import LoginEvent
+from database_models.login_rollup import HourlyLoginRollup, DailyLoginRollup
+from utils.logger import logger
+
+
+LOGIN_EVENTS = os.environ.get('LOGIN_EVENTS', 'true').lower() == 'true'
+LOGIN_EVENTS_FLUSH_INTERVAL = float(os.environ.get('LOGIN_EVENTS_FLUSH_INTERVAL', 1))
+# Amount of buffered events that triggers a flush, which is also the amount of rows per INSERT
+LOGIN_EVENTS_BATCH_SIZE = int(os.environ.get('LOGIN_EVENTS_BATCH_SIZE', 500))
+# The events are dropped while this amount of events is waiting to be written
+LOGIN_EVENTS_QUEUE_SIZE = int(os.environ.get('LOGIN_EVENTS_QUEUE_SIZE', 100000))
+
+LOGIN_ROLLUP_INTERVAL = float(os.environ.get('LOGIN_ROLLUP_INTERVAL', 60))
+# The events have to be kept for at least a day so that the daily rollups can be recomputed
+LOGIN_EVENTS_RETENTION = timedelta(days=float(os.environ.get('LOGIN_EVENTS_RETENTION_DAYS', 7)))
+HOURLY_ROLLUPS_RETENTION = timedelta(
+    days=float(os.environ.get('HOURLY_LOGIN_ROLLUPS_RETENTION_DAYS', 90)))
+DAILY_ROLLUPS_RETENTION = timedelta(
+    days=float(os.environ.get('DAILY_LOGIN_ROLLUPS_RETENTION_DAYS', 730)))
+
+ROLLUP_MODELS = (HourlyLoginRollup, DailyLoginRollup)
+# Key of the postgres advisory lock that the rollup workers of the server processes take, so that a
+# single one of them updates the rollups at a time
+ROLLUP_LOCK_KEY = 5371
+
+
+# Buffers the login events and inserts them in batches with multi row INSERT statements
+class LoginEventWriter(BufferedWriter):
+    def __init__(self, enabled=LOGIN_EVENTS, interval=LOGIN_EVENTS_FLUSH_INTERVAL,
+                 batch_size=LOGIN_EVENTS_BATCH_SIZE, max_queue_size=LOGIN_EVENTS_QUEUE_SIZE,
+                 session_factory=new_session):
+        super().__init__(interval, batch_size, session_factory)
+        self.enabled = enabled
+        self.max_queue_size = max_queue_size
+        self.pending = []
+        self.dropped_events = 0
+
+    # Buffers a login of the account with the received email, account_table is the name of the
+    # table in which it is registered
+    def add(self, account_table, email, date=None):
+        if not self.enabled:
+            return
+        if len(self.pending) >= self.max_queue_size:
+            self.dropped_events += 1
+            return
+        self.pending.append({
+            'email': email,
+            'account_table': account_table,
+            'date': date or datetime.now(),
+        })
+        self.buffered()
+
+    def pending_size(self):
+        return len(self.pending)
+
+    def take_pending(self):
+        pending, self.pending = self.pending, []
+        return pending
+
+    # The oldest events are dropped if the queue overflows
+    def restore_pending(self, batch):
+        self.pending[:0] = batch
+        overflow = len(self.pending) - self.max_queue_size
+        if overflow > 0:
+            del self.pending[:overflow]
+            self.dropped_events += overflow
+
+    async def write(self, db, batch):
+        for start in range(0, len(batch), self.max_size):
+            await db.execute(
+                insert(LoginEvent.__table__).values(batch[start:start + self.max_size])
+            )
+
+    def metrics(self):
+        return {**super().metrics(), 'dropped_events': self.dropped_events}
+
+
+def period_start(model, date):
+    if model.period >= timedelta(days=1):
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+# Inserts the rollup rows of the period that starts at start, one per account table, replacing
+# the ones that already exist. The events are only deleted after the periods that are recomputed,
+# so the new counts include every event that the replaced ones counted
+def rollup_statement(dialect_name, model, start):
+    statement = UPSERT_INSERTS[dialect_name](model.__table__).from_select(
+        ['period_start', 'account_table', 'logins', 'logged_users'],
+        select(
+            literal(start, DateTime()),
+            LoginEvent.account_table,
+            func.count(),
+            func.count(distinct(LoginEvent.email)),
+        ).where(LoginEvent.date >= start, LoginEvent.date < start + model.period)
+        .group_by(LoginEvent.account_table)
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[model.period_start, model.account_table],
+        set_={
+            'logins': statement.excluded.logins,
+            'logged_users': statement.excluded.logged_users,
+        }
+    )
+
+
+# Recomputes the rollups of the model from the period that contains since up to the one that
+# contains date_now. Returns the amount of updated periods
+async def update_rollups(db, model, since, date_now):
+    start = period_start(model, since)
+    updated_periods = 0
+    while start <= date_now:
+        await db.execute(rollup_statement(db.bind.dialect.name, model, start))
+        start += model.period
+        updated_periods += 1
+    return updated_periods
+
+
+# Takes the lock of the rollups until the end of the transaction, returns False if another process
+# holds it. The other databases are not locked, sqlite already serializes the writes
+async def try_lock_rollups(db):
+    if db.bind.dialect.name != 'postgresql':
+        return True
+    return (await db.execute(select(func.pg_try_advisory_xact_lock(ROLLUP_LOCK_KEY)))).scalar()
+
+
+# Deletes the events and rollups that are older than their retention
+async def prune_login_activity(db, date_now, events_retention=LOGIN_EVENTS_RETENTION,
+                               hourly_retention=HOURLY_ROLLUPS_RETENTION,
+                               daily_retention=DAILY_ROLLUPS_RETENTION):
+    deleted_rows = {}
+    for model, date_column, retention in (
+            (LoginEvent, LoginEvent.date, events_retention),
+            (HourlyLoginRollup, HourlyLoginRollup.period_start, hourly_retention),
+            (DailyLoginRollup, DailyLoginRollup.period_start, daily_retention)):
+        result = await db.execute(delete(model).where(date_column < date_now - retention)
+                                  .execution_options(synchronize_session=False))
+        deleted_rows[model.__tablename__] = result.rowcount
+    return deleted_rows
+
+
+# Selects the rollups of the model of the periods that started since the received date
+def login_activity_statement(model, since):
+    return select(model.period_start, model.account_table, model.logins, model.logged_users)\
+        .where(model.period_start >= since).order_by(model.period_start, model.account_table)
+
+
+# Keeps the rollups up to date in the background. Every interval seconds it writes the buffered
+# events, recomputes the rollups of the periods that received events since its last run and
+# deletes the rows that are older than their retention. The first run continues from the last
+# rollup in the database. Every server worker runs one, a run is skipped if the rollups are being
+# updated by another worker
+class LoginRollupWorker:
+    def __init__(self, event_writer, interval=LOGIN_ROLLUP_INTERVAL,
+                 session_factory=new_session):
+        self.event_writer = event_writer
+        self.interval = interval
+        self.session_factory = session_factory
+        self.rolled_until = {}
+        self.task = None
+        self.runs = 0
+        self.skipped_runs = 0
+        self.failed_runs = 0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.task.get_loop() is loop:
+            return
+        self.task = loop.create_task(self.__run_periodically())
+
+    async def close(self):
+        if self.task is not None and self.task.get_loop() is asyncio.get_running_loop():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def run(self, date_now=None):
+        date_now = date_now or datetime.now()
+        await self.event_writer.flush()
+        db = self.session_factory()
+        try:
+            if not await try_lock_rollups(db):
+                self.skipped_runs += 1
+                return
+            for model in ROLLUP_MODELS:
+                since = self.rolled_until.get(model)
+                if since is None:
+                    since = await self.__first_pending_date(db, model, date_now)
+                else:
+                    # The events of the last run that were still buffered belong to its period
+                    since -= timedelta(seconds=self.event_writer.interval)
+                await update_rollups(db, model, since, date_now)
+            await prune_login_activity(db, date_now)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        finally:
+            await db.close()
+        for model in ROLLUP_MODELS:
+            self.rolled_until[model] = date_now
+        self.runs += 1
+
+    # The date of the last rollup or of the oldest event if there are no rollups yet
+    async def __first_pending_date(self, db, model, date_now):
+        since = (await db.execute(select(func.max(model.period_start)))).scalar()
+        if since is None:
+            since = (await db.execute(select(func.min(LoginEvent.date)))).scalar()
+        if since is None:
+            return date_now
+        return max(since, date_now - LOGIN_EVENTS_RETENTION)
+
+    async def __run_periodically(self):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                self.failed_runs += 1
+                logger.warning(f"Error updating login rollups: {e}")
+            await asyncio.sleep(self.interval)
+
+
+login_event_writer = LoginEventWriter()
+login_rollup_worker = LoginRollupWorker(login_event_writer)
@@ -0,0 +1,82 @@
+import os
+from sqlalchemy import update, bindparam
+from database.database import new_session
+from database.buffered_writer import BufferedWriter
+
+
+LOGIN_WRITE_BEHIND = os.environ.get('LOGIN_WRITE_BEHIND', 'false').lower() == 'true'
+# Maximum seconds that a login takes to be written, which is the accuracy window of the last login
+# dates of the accounts
+LOGIN_WRITE_BEHIND_INTERVAL = float(os.environ.get('LOGIN_WRITE_BEHIND_INTERVAL', 5))
+# Amount of buffered accounts that triggers a flush before the interval ends
+LOGIN_WRITE_BEHIND_MAX_SIZE = int(os.environ.get('LOGIN_WRITE_BEHIND_MAX_SIZE', 1000))
+
+
+# Updates the login date and expo token of the accounts whose email matches the bound parameters,
+# so that it can be executed once with the parameters of many accounts
+def login_update_statement(model):
+    table = model.__table__
+    return update(table).where(table.c.email == bindparam('b_email')).values(
+        last_login_date=bindparam('b_last_login_date'),
+        expo_token=bindparam('b_expo_token')
+    )
+
+
+# Buffers the login dates and expo tokens in memory instead of updating them on every login. The
+# buffered logins are indexed by email, so only the last login of each account is written, with
+# one batched UPDATE per table. on_written is awaited with the emails of every written batch
+class LoginWriteBuffer(BufferedWriter):
+    def __init__(self, enabled=LOGIN_WRITE_BEHIND, interval=LOGIN_WRITE_BEHIND_INTERVAL,
+                 max_size=LOGIN_WRITE_BEHIND_MAX_SIZE, session_factory=new_session,
+                 on_written=None):
+        super().__init__(interval, max_size, session_factory)
+        self.enabled = enabled
+        self.on_written = on_written
+        self.pending = {}
+        self.buffered_logins = 0
+
+    # Buffers the login of the account with the received email, which is registered in the
+    # table of the model, replacing its previous buffered login
+    def add(self, model, email, login_date, expo_token):
+        self.pending[email] = (model, login_date, expo_token)
+        self.buffered_logins += 1
+        self.buffered()
+
+    # Drops the buffered login of the account, waiting for the flush in progress, so that a later
+    # update of its expo token (eg: when it logs out) is not overwritten by it
+    async def discard(self, email):
+        if not self.pending and self.flush_lock is None:
+            return
+        self.bind()
+        async with self.flush_lock:
+            self.pending.pop(email, None)
+
+    def pending_size(self):
+        return len(self.pending)
+
+    def take_pending(self):
+        pending, self.pending = self.pending, {}
+        return pending
+
+    # The accounts that logged in again since the flush started keep their newer login
+    def restore_pending(self, batch):
+        for email, login in batch.items():
+            self.pending.setdefault(email, login)
+
+    async def write(self, db, batch):
+        for model in {model for model, _, _ in batch.values()}:
+            await db.execute(login_update_statement(model), [
+                {'b_email': email, 'b_last_login_date': login_date, 'b_expo_token': expo_token}
+                for email, (login_model, login_date, expo_token) in batch.items()
+                if login_model is model
+            ])
+
+    async def written(self, batch):
+        if self.on_written is not None:
+            await self.on_written(list(batch.keys()))
+
+    def metrics(self):
+        return {**super().metrics(), 'buffered_logins': self.buffered_logins}
+
+
+login_write_buffer = LoginWriteBuffer()
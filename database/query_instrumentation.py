@@ -0,0 +1,39 @@
+import os
+from time import perf_counter
+from sqlalchemy import event
+from utils.logger import logger
+from utils.request_metrics import observe_db_query
+
+
+# Queries that take at least this amount of seconds are logged, 0 disables the log
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.5))
+REDACTED_VALUE = '<redacted>'
+
+
+# Replaces the values of the parameters of a statement, which may have emails, password hashes or
+# tokens, keeping their names and types. The parameters of an executemany are only counted
+def redact_parameters(parameters, executemany=False):
+    if executemany:
+        return f'<{len(parameters)} parameter sets>'
+    if isinstance(parameters, dict):
+        return {name: f'{REDACTED_VALUE}:{type(value).__name__}'
+                for name, value in parameters.items()}
+    return [f'{REDACTED_VALUE}:{type(value).__name__}' for value in parameters or ()]
+
+
+# Records the amount and time of the queries of the engine in the request metrics, and logs the
+# slow ones. The start times are kept in the connection, since the events of a query run in the
+# thread of its connection
+def instrument_queries(engine_to_instrument, slow_query_seconds=SLOW_QUERY_SECONDS):
+    @event.listens_for(engine_to_instrument, 'before_cursor_execute')
+    def before_cursor_execute(connection, _cursor, _statement, _parameters, _context,
+                              _executemany):
+        connection.info.setdefault('query_start_times', []).append(perf_counter())
+
+    @event.listens_for(engine_to_instrument, 'after_cursor_execute')
+    def after_cursor_execute(connection, _cursor, statement, parameters, _context, executemany):
+        seconds = perf_counter() - connection.info['query_start_times'].pop()
+        observe_db_query(seconds)
+        if slow_query_seconds and seconds >= slow_query_seconds:
+            logger.warning(f"Slow query took {seconds:.3f} seconds: {statement} with parameters "
+                           f"{redact_parameters(parameters, executemany)}")
@@ -0,0 +1,149 @@
+import os
+import time
+from sqlalchemy import text
+from utils.logger import logger
+from utils.request_metrics import metrics_registry
+from database.database import db_read_url, new_session, new_read_session
+from database.errors import is_connection_error
+
+
+# Maximum seconds that the replica can be behind the primary database to be used for reads
+DATABASE_READ_MAX_LAG = float(os.environ.get('DATABASE_READ_MAX_LAG', 5))
+# Seconds between the checks of the availability and the lag of the replica
+DATABASE_READ_CHECK_INTERVAL = float(os.environ.get('DATABASE_READ_CHECK_INTERVAL', 5))
+
+# The lag is 0 when every received change was replayed, otherwise the replay timestamp of an idle
+# primary would look like lag
+POSTGRES_LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+read_replica_fallbacks = metrics_registry.counter(
+    'database_read_replica_fallbacks_total',
+    'Read only sessions that used the primary database because the replica was not usable')
+
+
+# Returns the seconds that the database is behind its primary, or None if the dialect can not
+# report it. The query fails if the database is not reachable
+async def replication_lag(db):
+    if db.bind.dialect.name == 'postgresql':
+        return float((await db.execute(POSTGRES_LAG_QUERY)).scalar() or 0)
+    await db.execute(text('SELECT 1'))
+    return None
+
+
+# Session of the replica that retries the statements that fail to reach it on the primary database,
+# which the session keeps using afterwards. The replica is marked as unavailable until its next
+# check. The statements are read only, so running them again is safe
+class ReplicaSession:
+    def __init__(self, replica, session):
+        self.replica = replica
+        self.session = session
+        self.on_primary = False
+
+    @property
+    def bind(self):
+        return self.session.bind
+
+    def get_bind(self):
+        return self.session.get_bind()
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await self.__run('execute', statement, params, **kwargs)
+
+    async def stream(self, statement, params=None, **kwargs):
+        return await self.__run('stream', statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await self.__run('scalar', statement, params, **kwargs)
+
+    async def close(self):
+        await self.session.close()
+
+    async def __run(self, method, *args, **kwargs):
+        try:
+            return await getattr(self.session, method)(*args, **kwargs)
+        except Exception as e:
+            if self.on_primary or not is_connection_error(e):
+                raise
+            logger.warning(f"Error reading from the read replica, retrying on the primary "
+                           f"database: {e}")
+        self.replica.mark_unavailable()
+        try:
+            await self.session.close()
+        except Exception as e:
+            logger.warning(f"Error closing the session of the read replica: {e}")
+        self.session = self.replica.primary_session()
+        self.on_primary = True
+        return await getattr(self.session, method)(*args, **kwargs)
+
+
+# Routes the read only queries to the replica while it is reachable and its lag is below max_lag,
+# otherwise to the primary database. The replica is checked at most once every check_interval
+# seconds by the request that finds the last check expired, the requests that arrive while it runs
+# use the primary database. A statement that fails to reach the replica marks it as unavailable
+# until the next check and is retried on the primary. Without a read_session_factory every read
+# uses the primary
+class ReadReplica:
+    def __init__(self, read_session_factory=None, session_factory=new_session,
+                 max_lag=DATABASE_READ_MAX_LAG, check_interval=DATABASE_READ_CHECK_INTERVAL):
+        self.read_session_factory = read_session_factory
+        self.session_factory = session_factory
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.available = False
+        self.checking = False
+        self.lag = None
+        self.next_check = 0
+        self.fallbacks = 0
+
+    # Returns a session of the replica if it can be used, otherwise a session of the primary
+    async def session(self):
+        if self.read_session_factory is None:
+            return self.session_factory()
+        if self.checking:
+            return self.primary_session()
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.check_interval
+            self.checking = True
+            try:
+                self.available = await self.__check()
+            finally:
+                self.checking = False
+        if self.available:
+            return ReplicaSession(self, self.read_session_factory())
+        return self.primary_session()
+
+    # Returns a session of the primary database for a read that can not use the replica
+    def primary_session(self):
+        self.fallbacks += 1
+        read_replica_fallbacks.inc()
+        return self.session_factory()
+
+    def mark_unavailable(self):
+        self.available = False
+
+    def status(self):
+        return {'available': self.available, 'lag': self.lag, 'fallbacks': self.fallbacks}
+
+    async def __check(self):
+        db = self.read_session_factory()
+        try:
+            self.lag = await replication_lag(db)
+        except Exception as e:
+            logger.warning(f"Read replica is not available, reading from the primary database: {e}")
+            self.lag = None
+            return False
+        finally:
+            await db.close()
+        if (self.lag is not None) and (self.lag > self.max_lag):
+            logger.warning(f"Read replica is {self.lag:.1f} seconds behind, reading from the "
+                           f"primary database")
+            return False
+        return True
+
+
+read_replica = ReadReplica(new_read_session if db_read_url else None)
@@ -0,0 +1,31 @@
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+# Inserts of the dialects that support INSERT ... ON CONFLICT
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+# Updates the rows of the model that match the where clauses and returns the received columns of
+# every updated row. Databases without UPDATE ... RETURNING (eg: sqlite) select the rows before
+# updating them, since the update can change the columns of the where clauses
+async def update_returning_all(db, model, where, values, columns):
+    statement = update(model).where(*where).values(values)\
+        .execution_options(synchronize_session=False)
+    if db.bind.dialect.full_returning:
+        return (await db.execute(statement.returning(*columns))).all()
+    rows = (await db.execute(select(*columns).where(*where))).all()
+    if rows:
+        await db.execute(statement)
+    return rows
+
+
+# Updates the rows of the model that match the where clauses and returns the amount of updated rows
+async def update_rows(db, model, where, values):
+    result = await db.execute(
+        update(model).where(*where).values(values).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,62 @@
+from starlette.concurrency import run_in_threadpool
+
+
+# Wraps a synchronous Session exposing the same awaitable interface that AsyncSession has, so that
+# the handlers can use both of them. Every database round-trip is executed in the threadpool to
+# avoid blocking the event loop
+class ThreadedSession:
+    def __init__(self, session):
+        self.session = session
+        self.bind = session.bind
+
+    def get_bind(self):
+        return self.session.get_bind()
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    def add_all(self, instances):
+        self.session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.session.execute, statement, params, **kwargs)
+
+    # Executes the statement with a server side cursor, whose rows are fetched in partitions
+    async def stream(self, statement, params=None, **kwargs):
+        result = await run_in_threadpool(
+            self.session.execute,
+            statement.execution_options(stream_results=True),
+            params,
+            **kwargs
+        )
+        return ThreadedStreamResult(result)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.session.scalar, statement, params, **kwargs)
+
+    async def flush(self):
+        await run_in_threadpool(self.session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
+
+# Result of ThreadedSession.stream, which has the partitions method of AsyncResult
+class ThreadedStreamResult:
+    def __init__(self, result):
+        self.result = result
+
+    # The cursor is closed when its last row is read, or with the session if the iteration is
+    # interrupted
+    async def partitions(self, size):
+        while True:
+            rows = await run_in_threadpool(self.result.fetchmany, size)
+            if not rows:
+                break
+            yield rows
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, literal, union_all, distinct
+import database_models.user as db_user
+import database_models.google as db_google
+from database_models.login_event import LoginEvent
+from database.login_events import LOGIN_EVENTS
+
+
+REGISTRATION_WINDOW = timedelta(days=1)
+LOGIN_WINDOW = timedelta(hours=1)
+
+REGISTERED_ACTIVITY = 'registered'
+LOGGED_ACTIVITY = 'logged'
+
+
+# Counts the accounts of the model, the blocked ones and the ones registered in the last day. The
+# date condition is a comparison against a constant so that it can use the index of the column
+def account_counts_statement(model, date_now):
+    return select(
+        literal(model.__tablename__).label('table_name'),
+        func.count().label('accounts'),
+        func.count(case((model.is_blocked.is_(True), 1))).label('blocked'),
+        func.count(case((model.registration_date > date_now - REGISTRATION_WINDOW, 1)))
+        .label('registered'),
+    )
+
+
+# Counts the accounts of each table that logged in in the last hour. The login events, unlike the
+# last login date of the accounts, keep every login, but they are not written if they are disabled.
+# The rollups are not used since the window slides instead of starting at the start of an hour
+def logged_accounts_statement(date_now, from_login_events=LOGIN_EVENTS):
+    if not from_login_events:
+        return union_all(*[
+            select(literal(model.__tablename__).label('table_name'), func.count().label('logged'))
+            .where(model.last_login_date > date_now - LOGIN_WINDOW)
+            for model in (db_user.User, db_google.Google)
+        ])
+    return select(
+        LoginEvent.account_table.label('table_name'),
+        func.count(distinct(LoginEvent.email)).label('logged'),
+    ).where(LoginEvent.date > date_now - LOGIN_WINDOW).group_by(LoginEvent.account_table)
+
+
+# Computes the users metrics in the database, returning the same fields that the /users_metrics
+# endpoint answers
+async def compute_users_metrics(db, date_now=None, from_login_events=LOGIN_EVENTS):
+    if date_now is None:
+        date_now = datetime.now()
+    rows = (await db.execute(union_all(
+        account_counts_statement(db_user.User, date_now),
+        account_counts_statement(db_google.Google, date_now),
+    ))).all()
+    logged = dict((await db.execute(
+        logged_accounts_statement(date_now, from_login_events)
+    )).all())
+    counts = {row.table_name: row for row in rows}
+    users_counts = counts[db_user.User.__tablename__]
+    google_counts = counts[db_google.Google.__tablename__]
+
+    users_amount = users_counts.accounts + google_counts.accounts
+    blocked_users = users_counts.blocked + google_counts.blocked
+    return {
+        "users_amount": users_amount,
+        "blocked_users": blocked_users,
+        "non_blocked_users": users_amount - blocked_users,
+        "last_registered_users": users_counts.registered,
+        "last_logged_users": logged.get(db_user.User.__tablename__, 0),
+        "last_registered_google_users": google_counts.registered,
+        "last_logged_google_users": logged.get(db_google.Google.__tablename__, 0)
+    }
+
+
+# Selects the registration dates of the last day of the accounts of both tables and the date of
+# the last login of the last hour of every account, which are range scans over the indexes of the
+# date columns. The logins are read from the last login date of the accounts if the login events
+# are disabled
+def recent_activity_statement(date_now, from_login_events=LOGIN_EVENTS):
+    statements = []
+    for model in (db_user.User, db_google.Google):
+        statements.append(select(
+            literal(model.__tablename__).label('table_name'),
+            literal(REGISTERED_ACTIVITY).label('activity'),
+            model.registration_date.label('date'),
+        ).where(model.registration_date > date_now - REGISTRATION_WINDOW))
+        if not from_login_events:
+            statements.append(select(
+                literal(model.__tablename__).label('table_name'),
+                literal(LOGGED_ACTIVITY).label('activity'),
+                model.last_login_date.label('date'),
+            ).where(model.last_login_date > date_now - LOGIN_WINDOW))
+    if not from_login_events:
+        return union_all(*statements)
+    statements.append(select(
+        LoginEvent.account_table.label('table_name'),
+        literal(LOGGED_ACTIVITY).label('activity'),
+        func.max(LoginEvent.date).label('date'),
+    ).where(LoginEvent.date > date_now - LOGIN_WINDOW)
+        .group_by(LoginEvent.account_table, LoginEvent.email))
+    return union_all(*statements)
+
+
+# Returns the amount of accounts and of blocked accounts indexed by table name, and the rows of
+# recent_activity_statement
+async def fetch_users_activity(db, date_now, from_login_events=LOGIN_EVENTS):
+    counts = (await db.execute(union_all(
+        account_counts_statement(db_user.User, date_now),
+        account_counts_statement(db_google.Google, date_now),
+    ))).all()
+    activity = (await db.execute(
+        recent_activity_statement(date_now, from_login_events)
+    )).all()
+    totals = {row.table_name: {'accounts': row.accounts, 'blocked': row.blocked} for row in counts}
+    return totals, activity
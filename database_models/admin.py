@@ -1,6 +1,6 @@
 from sqlalchemy import Column, String
 from sqlalchemy.ext.declarative import declarative_base
-from passlib.hash import pbkdf2_sha256
+from utils.password_hasher import crypt_context
 import database_models.database_shared_constants as database_shared_constants
 from database.database import Base
 
@@ -18,15 +18,19 @@ class Admin(Base):
     hashed_password = Column(String(database_shared_constants.CONST_HASH_LENGTH), nullable = False)
     name = Column(String(database_shared_constants.CONST_NAME_LENGTH), nullable = False)
 
-    def __init__(self, email, password, name):
+    # If hashed_password is received the password is not hashed again, which allows the hash to be
+    # computed outside of the event loop
+    def __init__(self, email, password, name, hashed_password=None):
         self.email = None
         self.name = None
         self.hashed_password = None
         if (email != ""):
             self.email = email
 
-        if (password != ""):
-            self.hashed_password = pbkdf2_sha256.hash(password)
+        if (hashed_password is not None):
+            self.hashed_password = hashed_password
+        elif (password != ""):
+            self.hashed_password = crypt_context.hash(password)
 
         if (name != ""):
             self.name = name
\ No newline at end of file
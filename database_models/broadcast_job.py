@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, DateTime, Integer
+from database.database import Base
+
+
+JOB_ID_LENGTH = 32
+JOB_STATUS_LENGTH = 20
+
+
+# Progress of a broadcast, which is stored so that any server worker can report it. receivers is
+# the amount of listed emails, or None if the broadcast is sent to every account that matches a
+# filter, and tokens the amount of distinct expo tokens that were found
+class BroadcastJob(Base):
+    __tablename__ = "broadcast_jobs"
+
+    job_id = Column(String(JOB_ID_LENGTH), primary_key = True)
+    status = Column(String(JOB_STATUS_LENGTH), nullable = False)
+    receivers = Column(Integer(), nullable = True)
+    tokens = Column(Integer(), nullable = False)
+    sent = Column(Integer(), nullable = False)
+    failed = Column(Integer(), nullable = False)
+    created_at = Column(DateTime(), nullable = False, index = True)
+    finished_at = Column(DateTime(), nullable = True)
@@ -2,4 +2,5 @@ CONST_EMAIL_LENGTH = 100
 CONST_HASH_LENGTH = 250
 CONST_NAME_LENGTH = 40
 CONST_FIREBASE_PASSWORD_LENGTH = 60
-EXPO_TOKEN_LENGTH = 1000
\ No newline at end of file
+EXPO_TOKEN_LENGTH = 1000
+CONST_TABLE_NAME_LENGTH = 20
\ No newline at end of file
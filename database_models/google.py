@@ -1,5 +1,4 @@
 from sqlalchemy import Column, String, Boolean, DateTime
-from passlib.hash import pbkdf2_sha256
 import database_models.database_shared_constants as database_shared_constants
 from database.database import Base
 from passlib.pwd import genword
@@ -16,9 +15,9 @@ class Google(Base):
 
     email = Column(String(database_shared_constants.CONST_EMAIL_LENGTH), primary_key = True)
     firebase_password = Column(String(database_shared_constants.CONST_HASH_LENGTH), nullable = False)
-    is_blocked = Column(Boolean(), nullable = False)
-    registration_date = Column(DateTime(), nullable = False)
-    last_login_date = Column(DateTime(), nullable = False)
+    is_blocked = Column(Boolean(), nullable = False, index = True)
+    registration_date = Column(DateTime(), nullable = False, index = True)
+    last_login_date = Column(DateTime(), nullable = False, index = True)
     expo_token = Column(String(database_shared_constants.EXPO_TOKEN_LENGTH), nullable = True)
 
     def __init__(self, email, is_blocked, expo_token):
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger
+import database_models.database_shared_constants as database_shared_constants
+from database.database import Base
+
+
+class LoginEvent(Base):
+    __tablename__ = "login_events"
+
+    # sqlite only autoincrements INTEGER primary keys
+    id = Column(BigInteger().with_variant(Integer(), 'sqlite'), primary_key = True)
+    email = Column(String(database_shared_constants.CONST_EMAIL_LENGTH), nullable = False)
+    account_table = Column(String(database_shared_constants.CONST_TABLE_NAME_LENGTH),
+                           nullable = False)
+    date = Column(DateTime(), nullable = False, index = True)
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from sqlalchemy import Column, String, DateTime, Integer
+import database_models.database_shared_constants as database_shared_constants
+from database.database import Base
+
+
+# Amount of logins and of accounts that logged in during a period, per account table
+class LoginRollupColumns:
+    period_start = Column(DateTime(), primary_key = True)
+    account_table = Column(String(database_shared_constants.CONST_TABLE_NAME_LENGTH),
+                           primary_key = True)
+    logins = Column(Integer(), nullable = False)
+    logged_users = Column(Integer(), nullable = False)
+
+
+class HourlyLoginRollup(LoginRollupColumns, Base):
+    __tablename__ = "hourly_login_rollups"
+    period = timedelta(hours=1)
+
+
+class DailyLoginRollup(LoginRollupColumns, Base):
+    __tablename__ = "daily_login_rollups"
+    period = timedelta(days=1)
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, String, Boolean, DateTime
-from passlib.hash import pbkdf2_sha256
+from utils.password_hasher import crypt_context
 import database_models.database_shared_constants as database_shared_constants
 from database.database import Base
 from passlib.pwd import genword
@@ -17,12 +17,14 @@ class User(Base):
     email = Column(String(database_shared_constants.CONST_EMAIL_LENGTH), primary_key = True)
     hashed_password = Column(String(database_shared_constants.CONST_HASH_LENGTH), nullable = False)
     firebase_password = Column(String(database_shared_constants.CONST_HASH_LENGTH), nullable = False)
-    is_blocked = Column(Boolean(), nullable = False)
-    registration_date = Column(DateTime(), nullable = False)
-    last_login_date = Column(DateTime(), nullable = False)
+    is_blocked = Column(Boolean(), nullable = False, index = True)
+    registration_date = Column(DateTime(), nullable = False, index = True)
+    last_login_date = Column(DateTime(), nullable = False, index = True)
     expo_token = Column(String(database_shared_constants.EXPO_TOKEN_LENGTH), nullable = True)
 
-    def __init__(self, email, password, is_blocked, expo_token):
+    # If hashed_password is received the password is not hashed again, which allows the hash to be
+    # computed outside of the event loop
+    def __init__(self, email, password, is_blocked, expo_token, hashed_password=None):
         self.email = None
         self.hashed_password = None
         self.is_blocked = None
@@ -34,8 +36,10 @@ class User(Base):
         if (email != ""):
             self.email = email
 
-        if (password != ""):
-            self.hashed_password = pbkdf2_sha256.hash(password)
+        if (hashed_password is not None):
+            self.hashed_password = hashed_password
+        elif (password != ""):
+            self.hashed_password = crypt_context.hash(password)
 
         if (expo_token != ""):
             self.expo_token = expo_token
@@ -1,48 +1,116 @@
+import io
+import csv
+import orjson
 import uvicorn
-from fastapi import FastAPI, Request, Depends, HTTPException
-from sqlalchemy import exc
-from sqlalchemy.orm import Session
+from itertools import islice
+from typing import Optional
+from fastapi import FastAPI, APIRouter, Request, Depends, HTTPException, Query, File, UploadFile
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database_models.user import User as DbUser
-from database.database import Base, Session, engine
+from database.database import Base, Session, engine, async_engine, new_session, pool_status,\
+    create_missing_indexes, read_engine, read_async_engine
+from database.read_replica import read_replica
 from models.user import User, fake_users_db
 from models.login_data import Login
 from models.registration_data import RegistrationData
 from models.admin_registration_data import AdminRegistrationData
 from models.send_message_data import SendMessage
+from models.broadcast_message_data import BroadcastMessage
 from models.admin_login_data import AdminLogin
 from models.google_login_data import GoogleLogin
 from models.block_user_data import BlockUserData
+from models.batch_block_user_data import BatchBlockUserData
+from models.batch_registration_data import BatchRegistrationData
+from models.batch_size import BATCH_MAX_ITEMS
 from models.logout_data import Logout
+from models.account_type import AccountType
+from models.refresh_token_data import RefreshTokenData
+from models.login_period import LoginPeriod
 from sqlalchemy.exc import DataError
 import database_models.user as db_user
 import database_models.admin as db_admin
 import database_models.google as db_google
-from passlib.hash import pbkdf2_sha256
+import database_models.login_rollup as db_login_rollup
+import database_models.database_shared_constants as database_shared_constants
 import os
 import configuration.status_messages as status_messages
-from psycopg2.errors import NotNullViolation, UniqueViolation, StringDataRightTruncation
+from database.accounts import find_account, update_account, accounts_list_statement,\
+    upsert_google_login, find_account_tables, update_accounts, insert_users
+from database.statements import update_rows
+from database.login_write_buffer import login_write_buffer
+from database.login_events import login_event_writer, login_rollup_worker,\
+    login_activity_statement
+from database.errors import is_not_null_violation, is_unique_violation,\
+    is_string_data_right_truncation
 from server_exceptions.unexpected_error import UnexpectedErrorException
-from fastapi.responses import JSONResponse
+from server_exceptions.hashing_queue_full import HashingQueueFullException
+from server_exceptions.push_queue_full import PushQueueFullException
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
 from datetime import datetime
 from utils.logger import logger
+from utils.password_hasher import password_hasher
+from utils.expo_push_client import push_client
+from utils.push_broadcaster import push_broadcaster
+from utils.users_metrics_cache import users_metrics_cache
+from utils.account_cache import account_cache
+from utils.request_metrics import metrics_registry, RequestMetricsMiddleware
+from utils.multiprocess_metrics import multiprocess_metrics
+from utils.loop_monitor import loop_lag_monitor, LOOP_MONITOR
+from utils.tokens import create_tokens, decode_token, ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE,\
+    ADMIN_ROLE, USER_ROLE
 from config_files.fastapi_metadata import tags_metadata
-import requests
 
-Base.metadata.create_all(engine)
+USERS_LIST_DEFAULT_LIMIT = 100
+USERS_LIST_MAX_LIMIT = 1000
+USERS_LIST_STREAM_PARTITION_SIZE = 500
 
+LOGIN_ACTIVITY_DEFAULT_PERIODS = 24
+LOGIN_ACTIVITY_MAX_PERIODS = 24 * 90
 
+LOGIN_ROLLUP_MODELS = {
+    LoginPeriod.hour: db_login_rollup.HourlyLoginRollup,
+    LoginPeriod.day: db_login_rollup.DailyLoginRollup,
+}
 
+router = APIRouter()
+bearer_scheme = HTTPBearer(auto_error=False)
 
-app = FastAPI(openapi_tags=tags_metadata)
 
+async def get_db():
+    db = new_session()
+    try:
+        yield db
+    finally:
+        await db.close()
 
-def get_db():
-    db = Session()
+
+# Session for the read only endpoints, which uses the read replica when it is available and up to
+# date, and the primary database otherwise
+async def get_read_db():
+    db = await read_replica.session()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+# Returns the claims of the access token received in the Authorization header, or None if there
+# is no valid token. The token is verified without accessing the database
+async def get_token_claims(
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
+    if credentials is None:
+        return None
+    return decode_token(credentials.credentials, ACCESS_TOKEN_TYPE)
+
+
+# Returns the claims of the access token if it belongs to an admin, otherwise it returns None
+async def get_admin_claims(claims: Optional[dict] = Depends(get_token_claims)):
+    if (claims is None) or (claims['role'] != ADMIN_ROLE):
+        return None
+    return claims
 
 
 def generate_first_admin():
@@ -55,26 +123,80 @@ def generate_first_admin():
         return True
     except exc.IntegrityError as e:
         db.rollback()
-        if isinstance(e.orig, UniqueViolation):
+        if is_unique_violation(e):
             return True
         else:
             return False
     except Exception:
         db.rollback()
         return False
+    finally:
+        db.close()
+
+
+# One time tasks that prepare the database for the app. The production server runs them once before
+# forking its workers, the pooled connections are closed so that the workers do not share them
+def prepare_database():
+    Base.metadata.create_all(engine)
+    create_missing_indexes(engine)
+    if not generate_first_admin():
+        logger.error("Error generating first admin user")
+    engine.dispose()
 
 
-@app.exception_handler(UnexpectedErrorException)
 async def invalid_credentials_exception_handler(_request: Request,
                                                 _exc: UnexpectedErrorException):
-    message = status_messages.public_status_messages.get_message('unexpected_error')
-    return JSONResponse(
-        status_code=420,
-        content=message
-    )
+    return status_messages.public_status_messages.get_response('unexpected_error', 420)
+
+
+async def server_busy_exception_handler(_request: Request, _exc: Exception):
+    return status_messages.public_status_messages.get_response('server_busy', 503)
+
+
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+
+async def shutdown_push_client():
+    await push_broadcaster.close()
+    await push_client.close()
+
+
+async def start_login_rollups():
+    login_rollup_worker.start()
+
+
+async def start_metrics_writer():
+    multiprocess_metrics.start()
+
+
+async def stop_metrics_writer():
+    await multiprocess_metrics.close()
+
+
+async def start_loop_monitor():
+    if LOOP_MONITOR:
+        loop_lag_monitor.start()
+
+
+async def stop_loop_monitor():
+    await loop_lag_monitor.close()
+
+
+async def flush_login_write_buffer():
+    await login_write_buffer.close()
+
 
+async def flush_login_events():
+    await login_rollup_worker.close()
+    await login_event_writer.close()
 
-@app.get('/users/{username}')
+
+def flush_logs():
+    logger.close()
+
+
+@router.get('/users/{username}')
 async def read_user(username: str):
     user_dict = fake_users_db[username]
     if not user_dict:
@@ -83,89 +205,133 @@ async def read_user(username: str):
     return user
 
 
-@app.get('/')
+@router.get('/')
 async def home():
     logger.info("Received GET request at /")
-    return status_messages.public_status_messages.get_message('hello_users')
+    return status_messages.public_status_messages.get_response('hello_users')
 
 
-@app.get('/pong')
+@router.get('/pong')
 async def pong():
     logger.info("Received GET request at /pong")
-    return status_messages.public_status_messages.get_message('pong')
+    return status_messages.public_status_messages.get_response('pong')
 
 
-@app.post('/login/', tags = ['login'])
-async def login(login_data: Login, db: Session = Depends(get_db)):
+@router.post('/login/', tags = ['login'])
+async def login(login_data: Login, db: AsyncSession = Depends(get_db)):
     logger.info(f"Received POST request at /login with body: {login_data}")
-    aux_user = db.query(DbUser).filter(DbUser.email == login_data.email).first()
-    if (aux_user is None) or\
-       (not pbkdf2_sha256.verify(login_data.password, aux_user.hashed_password)):
+    aux_user = (await db.execute(
+        select(DbUser.hashed_password, DbUser.is_blocked, DbUser.firebase_password,
+               DbUser.expo_token)
+        .where(DbUser.email == login_data.email)
+    )).first()
+    is_valid, new_hash = False, None
+    if aux_user is not None:
+        is_valid, new_hash = await password_hasher.verify_and_update(login_data.password,
+                                                                     aux_user.hashed_password)
+    if (aux_user is None) or (not is_valid):
         logger.info(
             "Error authenticating the user: user doesn't exist or password is incorrect"
         )
-        return status_messages.public_status_messages.get_message('failed_login')
+        return status_messages.public_status_messages.get_response('failed_login')
     elif aux_user.is_blocked:
         logger.info("Error authenticating the user: user is blocked")
-        return status_messages.public_status_messages.get_message('user_is_blocked')
+        return status_messages.public_status_messages.get_response('user_is_blocked')
+    # The hashes made with an outdated scheme or cost are replaced right away, so only the logins
+    # that do not update the hash are buffered
+    elif login_write_buffer.enabled and (new_hash is None):
+        login_write_buffer.add(DbUser, login_data.email, datetime.now(), login_data.expo_token)
     else:
-        db.query(DbUser).filter(DbUser.email == login_data.email).update({
-                DbUser.last_login_date: datetime.now(),
-                DbUser.expo_token: login_data.expo_token
-            })
-        db.commit()
-        return {
-            **status_messages.public_status_messages.get_message('successful_login'),
-            'firebase_password': aux_user.firebase_password,
-            }
+        values = {
+            DbUser.last_login_date: datetime.now(),
+            DbUser.expo_token: login_data.expo_token
+        }
+        if new_hash is not None:
+            values[DbUser.hashed_password] = new_hash
+        # The update only succeeds if the user was not blocked after reading it
+        updated_rows = await update_rows(
+            db,
+            DbUser,
+            (DbUser.email == login_data.email, DbUser.is_blocked.is_(False)),
+            values)
+        await db.commit()
+        if updated_rows == 0:
+            logger.info("Error authenticating the user: user was blocked")
+            return status_messages.public_status_messages.get_response('user_is_blocked')
+    if aux_user.expo_token != login_data.expo_token:
+        await account_cache.invalidate(login_data.email)
+    login_event_writer.add(DbUser.__tablename__, login_data.email)
+    users_metrics_cache.record_login(DbUser.__tablename__)
+    return {
+        **status_messages.public_status_messages.get_message('successful_login'),
+        'firebase_password': aux_user.firebase_password,
+        **create_tokens(login_data.email, USER_ROLE)
+        }
 
 
-@app.post('/admin_login/', tags = ['admin_login'])
-async def admin_login(admin_login_data: AdminLogin, db: Session = Depends(get_db)):
+@router.post('/admin_login/', tags = ['admin_login'])
+async def admin_login(admin_login_data: AdminLogin, db: AsyncSession = Depends(get_db)):
     logger.info("Received POST request at /admin_login/")
-    aux_admin = db.query(db_admin.Admin)\
-        .filter(db_admin.Admin.email == admin_login_data.email).first()
-    if (aux_admin is None) or \
-       (not pbkdf2_sha256.verify(admin_login_data.password, aux_admin.hashed_password)):
+    aux_admin = (await db.execute(
+        select(db_admin.Admin).where(db_admin.Admin.email == admin_login_data.email)
+    )).scalars().first()
+    is_valid, new_hash = False, None
+    if aux_admin is not None:
+        is_valid, new_hash = await password_hasher.verify_and_update(admin_login_data.password,
+                                                                     aux_admin.hashed_password)
+    if (aux_admin is None) or (not is_valid):
         logger.info("Error authenticating admin: admin doesn't exist or password is incorrect")
-        return status_messages.public_status_messages.get_message('failed_login')
+        return status_messages.public_status_messages.get_response('failed_login')
     else:
-        return status_messages.public_status_messages.get_message('successful_login')
+        if new_hash is not None:
+            aux_admin.hashed_password = new_hash
+            await db.commit()
+        return {
+            **status_messages.public_status_messages.get_message('successful_login'),
+            **create_tokens(aux_admin.email, ADMIN_ROLE)
+            }
 
 
-@app.post('/create/', tags = ['create'])
-async def create(user_data: RegistrationData, db: Session = Depends(get_db)):
+@router.post('/create/', tags = ['create'])
+async def create(user_data: RegistrationData, db: AsyncSession = Depends(get_db)):
     logger.info("Received POST request at /create/")
     # https://www.psycopg.org/docs/errors.html
-    aux_user = DbUser(user_data.email, user_data.password, False, user_data.expo_token)
-    google_account = db.query(db_google.Google)\
-        .filter(db_google.Google.email == user_data.email).first()
+    account = await find_account(db, user_data.email)
 
-    if google_account is not None:
+    if (account is not None) and account.is_google_account():
         return status_messages.public_status_messages.get_message('has_google_account'),
 
+    hashed_password = None
+    if user_data.password != "":
+        hashed_password = await password_hasher.hash(user_data.password)
+    aux_user = DbUser(user_data.email, user_data.password, False, user_data.expo_token,
+                      hashed_password=hashed_password)
+
     try:
         db.add(aux_user)
-        db.commit()
+        await db.commit()
+        # A new account counts as a login, since its last login date is its registration date
+        login_event_writer.add(DbUser.__tablename__, aux_user.email, aux_user.last_login_date)
+        users_metrics_cache.record_registration(DbUser.__tablename__)
         return {
             **status_messages.public_status_messages.get_message('successful_registration'),
             'email': aux_user.email,
             'firebase_password': aux_user.firebase_password
         }
     except exc.IntegrityError as e:
-        db.rollback()
-        if isinstance(e.orig, NotNullViolation):
+        await db.rollback()
+        if is_not_null_violation(e):
             logger.info("Error creating user: null value received")
-            return status_messages.public_status_messages.get_message('null_value')
-        elif isinstance(e.orig, UniqueViolation):
+            return status_messages.public_status_messages.get_response('null_value')
+        elif is_unique_violation(e):
             logger.info("Error creating user: user already exists")
-            return status_messages.public_status_messages.get_message('existing_user')
+            return status_messages.public_status_messages.get_response('existing_user')
         else:
             logger.warning("Error creating user: unexpected IntegrityError")
             raise UnexpectedErrorException
     except DataError as e:
-        db.rollback()
-        if isinstance(e.orig, StringDataRightTruncation):
+        await db.rollback()
+        if is_string_data_right_truncation(e):
             logger.info("Error creating user: wrong input size")
             return {
                 **status_messages.public_status_messages.get_message('wrong_size_input'),
@@ -174,38 +340,155 @@ async def create(user_data: RegistrationData, db: Session = Depends(get_db)):
             logger.warning("Error creating user: unexpected DataError")
             raise UnexpectedErrorException
     except Exception:
-        db.rollback()
+        await db.rollback()
         logger.warning("Error creating user: unexpected Exception")
         raise UnexpectedErrorException
 
 
-@app.post('/admin_create/', tags = ['admin_create'])
-async def create_admin(admin_data: AdminRegistrationData, db: Session = Depends(get_db)):
+# Returns the result of an item of a batch, which has the status message of the context
+def batch_item_result(email, context, **fields):
+    return {
+        'email': email,
+        **status_messages.public_status_messages.get_message(context),
+        **fields
+        }
+
+
+# Creates the users that are not registered and returns a result per user, in the same order.
+# The registered emails are read with a single statement, the passwords are hashed in parallel and
+# the users are inserted with multi-row inserts, in a single transaction
+async def create_users(users, db):
+    results = [None] * len(users)
+    # Index of the first user of the batch with each email
+    new_users_indexes = {}
+    for i, user_data in enumerate(users):
+        if (user_data.email == "") or (user_data.password == ""):
+            results[i] = batch_item_result(user_data.email, 'null_value')
+        elif (len(user_data.email) > database_shared_constants.CONST_EMAIL_LENGTH) or\
+                (len(user_data.expo_token) > database_shared_constants.EXPO_TOKEN_LENGTH):
+            results[i] = batch_item_result(user_data.email, 'wrong_size_input',
+                                           input_sizes=db_user.data_size)
+        elif user_data.email in new_users_indexes:
+            results[i] = batch_item_result(user_data.email, 'existing_user')
+        else:
+            new_users_indexes[user_data.email] = i
+
+    if new_users_indexes:
+        registered_accounts = await find_account_tables(db, list(new_users_indexes.keys()))
+        # Ends the transaction so that no connection is held while the passwords are hashed
+        await db.commit()
+        for email, table_name in registered_accounts.items():
+            context = 'has_google_account' if table_name == db_google.Google.__tablename__\
+                else 'existing_user'
+            results[new_users_indexes.pop(email)] = batch_item_result(email, context)
+
+    indexes = list(new_users_indexes.values())
+    hashed_passwords = await password_hasher.hash_many([users[i].password for i in indexes])
+    new_users = [
+        DbUser(users[i].email, users[i].password, False, users[i].expo_token,
+               hashed_password=hashed_password)
+        for i, hashed_password in zip(indexes, hashed_passwords)
+    ]
+    try:
+        inserted_emails = await insert_users(db, [
+            {column.key: getattr(new_user, column.key) for column in DbUser.__table__.columns}
+            for new_user in new_users
+        ])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"Error creating users batch: unexpected Exception: {e}")
+        raise UnexpectedErrorException
+
+    for i, new_user in zip(indexes, new_users):
+        if new_user.email not in inserted_emails:
+            results[i] = batch_item_result(new_user.email, 'existing_user')
+            continue
+        login_event_writer.add(DbUser.__tablename__, new_user.email, new_user.last_login_date)
+        users_metrics_cache.record_registration(DbUser.__tablename__)
+        results[i] = batch_item_result(new_user.email, 'successful_registration',
+                                       firebase_password=new_user.firebase_password)
+    return {
+        **status_messages.public_status_messages.get_message('batch_processed'),
+        'created': len(inserted_emails),
+        'results': results
+        }
+
+
+@router.post('/create_batch', tags = ['create_batch'])
+async def create_batch(batch_data: BatchRegistrationData,
+                       admin: Optional[dict] = Depends(get_admin_claims),
+                       db: AsyncSession = Depends(get_db)):
+    logger.info(f"Received POST request at /create_batch with {len(batch_data.users)} users")
+    if admin is None:
+        logger.info("Error creating users batch: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+    return await create_users(batch_data.users, db)
+
+
+# The csv file must have a header with the email, password and expo_token columns
+@router.post('/create_batch_csv', tags = ['create_batch'])
+async def create_batch_csv(file: UploadFile = File(...),
+                           admin: Optional[dict] = Depends(get_admin_claims),
+                           db: AsyncSession = Depends(get_db)):
+    logger.info(f"Received POST request at /create_batch_csv with file {file.filename}")
+    if admin is None:
+        logger.info("Error creating users batch: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+    try:
+        reader = csv.DictReader(io.StringIO((await file.read()).decode('utf-8-sig')))
+        if not {'email', 'password', 'expo_token'}.issubset(reader.fieldnames or ()):
+            raise ValueError('missing columns')
+        rows = list(islice(reader, BATCH_MAX_ITEMS + 1))
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        logger.info(f"Error creating users batch: invalid csv file: {e}")
+        return status_messages.public_status_messages.get_response('invalid_csv')
+    if len(rows) > BATCH_MAX_ITEMS:
+        logger.info("Error creating users batch: too many users")
+        return status_messages.public_status_messages.get_response('batch_too_large')
+    return await create_users([
+        RegistrationData(email=row['email'] or "", password=row['password'] or "",
+                         expo_token=row['expo_token'] or "")
+        for row in rows
+    ], db)
+
+
+@router.post('/admin_create/', tags = ['admin_create'])
+async def create_admin(admin_data: AdminRegistrationData,
+                       admin: Optional[dict] = Depends(get_admin_claims),
+                       db: AsyncSession = Depends(get_db)):
     logger.info("Received POST request at /admin_create/")
-    aux_admin = db_admin.Admin(admin_data.email, admin_data.password, admin_data.name)
+    if admin is None:
+        logger.info("Error creating admin: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+    hashed_password = None
+    if admin_data.password != "":
+        hashed_password = await password_hasher.hash(admin_data.password)
+    aux_admin = db_admin.Admin(admin_data.email, admin_data.password, admin_data.name,
+                               hashed_password=hashed_password)
 
     try:
         db.add(aux_admin)
-        db.commit()
+        await db.commit()
         return {
             **status_messages.public_status_messages.get_message('successful_registration'),
             'email': aux_admin.email,
             'name': aux_admin.name
             }
     except exc.IntegrityError as e:
-        db.rollback()
-        if isinstance(e.orig, NotNullViolation):
+        await db.rollback()
+        if is_not_null_violation(e):
             logger.info("Error creating admin: null value received")
-            return status_messages.public_status_messages.get_message('null_value')
-        elif isinstance(e.orig, UniqueViolation):
+            return status_messages.public_status_messages.get_response('null_value')
+        elif is_unique_violation(e):
             logger.info("Error creating admin: admin already exists")
-            return status_messages.public_status_messages.get_message('existing_user')
+            return status_messages.public_status_messages.get_response('existing_user')
         else:
             logger.warning("Error creating admin: unexpected IntegrityError")
             raise UnexpectedErrorException
     except DataError as e:
-        db.rollback()
-        if isinstance(e.orig, StringDataRightTruncation):
+        await db.rollback()
+        if is_string_data_right_truncation(e):
             logger.info("Error creating admin: wrong input size")
             return {
                 **status_messages.public_status_messages.get_message('wrong_size_input'),
@@ -214,197 +497,303 @@ async def create_admin(admin_data: AdminRegistrationData, db: Session = Depends(
             logger.warning("Error creating admin: unexpected DataError")
             raise UnexpectedErrorException
     except Exception:
-        db.rollback()
+        await db.rollback()
         logger.warning("Error creating admin: unexpected Exception")
         raise UnexpectedErrorException
 
 
-@app.get('/users_list/{is_admin}', tags = ['users_list'])
-async def users_list(is_admin: str, db: Session = Depends(get_db)):
-    logger.info(f"Received POST request at /users_list/{is_admin}")
-    if is_admin != "true":
-        logger.info("Error getting users list: user is not an admin")
-        return status_messages.public_status_messages.get_message('not_admin')
+# Writes a json line per user as the rows are read from the database cursor
+async def stream_users_list(db: AsyncSession, statement):
+    result = await db.stream(statement)
+    async for users in result.partitions(USERS_LIST_STREAM_PARTITION_SIZE):
+        yield b''.join(
+            orjson.dumps({"email": user.email, "is_blocked": user.is_blocked}) + b'\n'
+            for user in users
+        )
 
-    users_query = db.query(DbUser.email, DbUser.is_blocked).all()
-    google_users_query = db.query(db_google.Google.email, db_google.Google.is_blocked).all()
-    users_list = []
 
-    for user in users_query:
-        users_list.append({"email": user[0], "is_blocked": user[1]})
-    for user in google_users_query:
-        users_list.append({"email": user[0], "is_blocked": user[1]})
+@router.get('/users_list/{is_admin}', tags = ['users_list'])
+async def users_list(is_admin: str,
+                     cursor: Optional[str] = None,
+                     limit: Optional[int] = Query(None, ge=1, le=USERS_LIST_MAX_LIMIT),
+                     is_blocked: Optional[bool] = None,
+                     account_type: Optional[AccountType] = None,
+                     email_prefix: Optional[str] = None,
+                     stream: bool = False,
+                     admin: Optional[dict] = Depends(get_admin_claims),
+                     db: AsyncSession = Depends(get_read_db)):
+    logger.info(f"Received POST request at /users_list/{is_admin}")
+    if (is_admin != "true") or (admin is None):
+        logger.info("Error getting users list: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+
+    if stream:
+        statement = accounts_list_statement(cursor, limit, is_blocked, account_type, email_prefix)
+        return StreamingResponse(stream_users_list(db, statement),
+                                 media_type='application/x-ndjson')
+
+    if limit is None:
+        limit = USERS_LIST_DEFAULT_LIMIT
+    # An extra user is read to know if there is another page
+    users = (await db.execute(
+        accounts_list_statement(cursor, limit + 1, is_blocked, account_type, email_prefix)
+    )).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = users[-1].email
 
     return {
         **status_messages.public_status_messages.get_message('successful_get_users'),
-        "users": users_list
+        "users": [{"email": user.email, "is_blocked": user.is_blocked} for user in users],
+        "next_cursor": next_cursor
         }
 
 
-@app.post('/oauth_login', tags = ['oauth_login'])
-async def oauth_login(google_data: GoogleLogin, db: Session = Depends(get_db)):
+@router.post('/oauth_login', tags = ['oauth_login'])
+async def oauth_login(google_data: GoogleLogin, db: AsyncSession = Depends(get_db)):
     logger.info("Received POST request at /oauth_login")
-    aux_account = db.query(db_user.User).filter(db_user.User.email == google_data.email).first()
-    if aux_account is not None:
-        logger.info("Error authenticating google user: user already has an account")
-        return {**status_messages.public_status_messages.get_message('has_normal_account')}
-    google_account = db.query(db_google.Google)\
-        .filter(db_google.Google.email == google_data.email).first()
-
-    if google_account is None:
-        google_account = db_google.Google(google_data.email, False, google_data.expo_token)
-        try:
-            db.add(google_account)
-            db.commit()
+    if login_write_buffer.enabled:
+        # The logins of existing accounts are buffered, so they only have to be read
+        logged_account = (await db.execute(
+            select(db_google.Google.email, db_google.Google.firebase_password,
+                   db_google.Google.expo_token).where(
+                db_google.Google.email == google_data.email,
+                db_google.Google.is_blocked.is_(False))
+        )).first()
+        if logged_account is not None:
+            login_write_buffer.add(db_google.Google, google_data.email, datetime.now(),
+                                   google_data.expo_token)
+            if logged_account.expo_token != google_data.expo_token:
+                await account_cache.invalidate(google_data.email)
+            login_event_writer.add(db_google.Google.__tablename__, logged_account.email)
+            users_metrics_cache.record_login(db_google.Google.__tablename__)
             return {
-                **status_messages.public_status_messages.get_message('successful_registration'),
-                'email': google_account.email,
-                'firebase_password': google_account.firebase_password,
-                'created': True
+                **status_messages.public_status_messages.get_message('google_existing_account'),
+                'email': logged_account.email,
+                'firebase_password': logged_account.firebase_password,
+                'created': False,
+                **create_tokens(logged_account.email, USER_ROLE)
                 }
-        except exc.IntegrityError as e:
-            db.rollback()
-            if isinstance(e.orig, NotNullViolation):
-                logger.info("Error creating google user: null value received")
-                return status_messages.public_status_messages.get_message('null_value')
-            else:
-                logger.warning(f"Error creating google user: unexpected IntegrityError {e}")
-                raise UnexpectedErrorException
-        except DataError as e:
-            db.rollback()
-            if isinstance(e.orig, StringDataRightTruncation):
-                logger.info("Error creating google user: wrong input size")
-                return {
-                    **status_messages.public_status_messages.get_message('wrong_size_input'),
-                    'input_sizes': db_google.data_size}
-            else:
-                logger.warning(f"Error creating google user: unexpected DataError {e}")
-                raise UnexpectedErrorException
-        except Exception as e:
-            db.rollback()
-            logger.warning(f"Error creating google user: unexpected Exception: {e}")
+
+    # Existing accounts that are not blocked and new accounts, which are the most common cases,
+    # are logged in or registered with a single statement
+    date_now = datetime.now()
+    try:
+        logged_account = await upsert_google_login(
+            db,
+            google_data.email if google_data.email != "" else None,
+            google_data.expo_token if google_data.expo_token != "" else None,
+            date_now)
+        await db.commit()
+    except exc.IntegrityError as e:
+        await db.rollback()
+        if is_not_null_violation(e):
+            logger.info("Error authenticating google user: null value received")
+            return status_messages.public_status_messages.get_response('null_value')
+        else:
+            logger.warning(f"Error authenticating google user: unexpected IntegrityError {e}")
             raise UnexpectedErrorException
+    except DataError as e:
+        await db.rollback()
+        if is_string_data_right_truncation(e):
+            logger.info("Error authenticating google user: wrong input size")
+            return {
+                **status_messages.public_status_messages.get_message('wrong_size_input'),
+                'input_sizes': db_google.data_size}
+        else:
+            logger.warning(f"Error authenticating google user: unexpected DataError {e}")
+            raise UnexpectedErrorException
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"Error authenticating google user: unexpected Exception: {e}")
+        raise UnexpectedErrorException
+
+    if logged_account is None:
+        account = await find_account(db, google_data.email)
+        if (account is not None) and (not account.is_google_account()):
+            logger.info("Error authenticating google user: user already has an account")
+            return status_messages.public_status_messages.get_response('has_normal_account')
+        logger.info("Error authenticating the user: user is blocked")
+        return status_messages.public_status_messages.get_response('user_is_blocked')
+
+    email, firebase_password, created = logged_account
+    # The upsert does not return the previous expo token, so it is compared with the cached one
+    await account_cache.invalidate_if_changed(
+        email, google_data.expo_token if google_data.expo_token != "" else None)
+    login_event_writer.add(db_google.Google.__tablename__, email, date_now)
+    if created:
+        users_metrics_cache.record_registration(db_google.Google.__tablename__)
+        message = status_messages.public_status_messages.get_message('successful_registration')
     else:
-        if google_account.is_blocked:
-            logger.info("Error authenticating the user: user is blocked")
-            return status_messages.public_status_messages.get_message('user_is_blocked')
-        db.query(db_google.Google).filter(db_google.Google.email == google_data.email).update({
-                db_google.Google.last_login_date: datetime.now(),
-                db_google.Google.expo_token: google_data.expo_token
-            })
-        db.commit()
-        return {
-            **status_messages.public_status_messages.get_message('google_existing_account'),
-            'email': google_account.email,
-            'firebase_password': google_account.firebase_password,
-            'created': False
-            }
+        users_metrics_cache.record_login(db_google.Google.__tablename__)
+        message = status_messages.public_status_messages.get_message('google_existing_account')
+    return {
+        **message,
+        'email': email,
+        'firebase_password': firebase_password,
+        'created': created,
+        **create_tokens(email, USER_ROLE)
+        }
 
 
-@app.post('/change_blocked_status', tags = ['change_blocked_status'])
-async def block_user(block_data: BlockUserData, db: Session = Depends(get_db)):
+@router.post('/change_blocked_status', tags = ['change_blocked_status'])
+async def block_user(block_data: BlockUserData,
+                     admin: Optional[dict] = Depends(get_admin_claims),
+                     db: AsyncSession = Depends(get_db)):
     logger.info(f"Received POST request at /change_blocked_status with body: {block_data}")
+    if admin is None:
+        logger.info("Error changing user block status: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
     try:
-        aux_account = db.query(db_user.User)\
-            .filter(db_user.User.email == block_data.modified_user).first()
-        google_aux_account = db.query(db_google.Google)\
-            .filter(db_google.Google.email == block_data.modified_user).first()
-        if aux_account is not None:
-            db.query(db_user.User).filter(db_user.User.email == block_data.modified_user).update({
-                db_user.User.is_blocked: block_data.is_blocked
-            })
-            db.commit()
-            return status_messages.public_status_messages.get_message('user_updated')
-        elif google_aux_account is not None:
-            db.query(db_google.Google)\
-                .filter(db_google.Google.email == block_data.modified_user).update({
-                    db_google.Google.is_blocked: block_data.is_blocked
-                })
-            db.commit()
-            return status_messages.public_status_messages.get_message('user_updated')
+        # Only accounts whose status changes are updated, so that the blocked users counter is
+        # not modified if the account already had the received status
+        updated_model = await update_account(
+            db,
+            block_data.modified_user,
+            {'is_blocked': block_data.is_blocked},
+            lambda model: (model.is_blocked != block_data.is_blocked,)
+        )
+        if updated_model is not None:
+            await db.commit()
+            await account_cache.invalidate(block_data.modified_user)
+            users_metrics_cache.record_block_change(updated_model.__tablename__,
+                                                    block_data.is_blocked)
+            return status_messages.public_status_messages.get_response('user_updated')
+        elif await find_account(db, block_data.modified_user) is not None:
+            return status_messages.public_status_messages.get_response('user_updated')
         else:
             logger.info("Error changing user block status: user does not exist")
-            return status_messages.public_status_messages.get_message('user_does_not_exist')
+            return status_messages.public_status_messages.get_response('user_does_not_exist')
     except exc.IntegrityError as e:
-        db.rollback()
-        if isinstance(e.orig, NotNullViolation):
+        await db.rollback()
+        if is_not_null_violation(e):
             logger.info("Error changing user block status: null value received")
-            return status_messages.public_status_messages.get_message('null_value')
+            return status_messages.public_status_messages.get_response('null_value')
         else:
             logger.info(f"Error changing user block status: unexpected IntegrityError: {e}")
             raise UnexpectedErrorException
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.info(f"Error changing user block status: unexpected Exception: {e}")
         raise UnexpectedErrorException
 
 
-@app.get('/users_metrics', tags = ['users_metrics'])
-async def users_metrics(db: Session = Depends(get_db)):
-    logger.info("Received GET request at /users_metrics")
-    users_query = db.query(
-        DbUser.registration_date,
-        DbUser.last_login_date,
-        DbUser.is_blocked
-    ).all()
-    google_users_query = db.query(
-        db_google.Google.registration_date,
-        db_google.Google.last_login_date,
-        db_google.Google.is_blocked
-    ).all()
+# Changes the blocked status of every listed user with a single UPDATE per table, in a single
+# transaction, and returns a result per distinct email
+@router.post('/change_blocked_status_batch', tags = ['change_blocked_status_batch'])
+async def block_users(block_data: BatchBlockUserData,
+                      admin: Optional[dict] = Depends(get_admin_claims),
+                      db: AsyncSession = Depends(get_db)):
+    logger.info(f"Received POST request at /change_blocked_status_batch for "
+                f"{len(block_data.modified_users)} users")
+    if admin is None:
+        logger.info("Error changing users block status: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+    emails = list(dict.fromkeys(block_data.modified_users))
+    try:
+        # Like in block_user, only the accounts whose status changes are updated
+        updated_accounts = await update_accounts(
+            db,
+            emails,
+            {'is_blocked': block_data.is_blocked},
+            lambda model: (model.is_blocked != block_data.is_blocked,)
+        )
+        not_updated_emails = [email for email in emails if email not in updated_accounts]
+        registered_accounts = {}
+        if not_updated_emails:
+            registered_accounts = await find_account_tables(db, not_updated_emails)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"Error changing users block status: unexpected Exception: {e}")
+        raise UnexpectedErrorException
 
-    date_now = datetime.now()
-    users_logged_last_hour = 0
-    google_users_logged_last_hour = 0
-    users_registered_last_day = 0
-    google_users_registered_last_day = 0
-    blocked_users = 0
-    for user in users_query:
-        # If the user registered in the last day
-        if (date_now - user[0]).total_seconds() < (24 * 3600):
-            users_registered_last_day += 1
-        # If the user logged in in the last hour
-        if (date_now - user[1]).total_seconds() < 3600:
-            users_logged_last_hour += 1
-        # If the user is blocked
-        if user[2]:
-            blocked_users += 1
-    for user in google_users_query:
-        # If the user registered in the last day
-        if (date_now - user[0]).total_seconds() < (24 * 3600):
-            google_users_registered_last_day += 1
-        # If the user logged in in the last hour
-        if (date_now - user[1]).total_seconds() < 3600:
-            google_users_logged_last_hour += 1
-        # If the user is blocked
-        if user[2]:
-            blocked_users += 1
-
-    users_amount = len(users_query) + len(google_users_query)
+    for email, model in updated_accounts.items():
+        await account_cache.invalidate(email)
+        users_metrics_cache.record_block_change(model.__tablename__, block_data.is_blocked)
+    return {
+        **status_messages.public_status_messages.get_message('batch_processed'),
+        'updated': len(updated_accounts),
+        'results': [
+            batch_item_result(email, 'user_updated'
+                              if (email in updated_accounts) or (email in registered_accounts)
+                              else 'user_does_not_exist')
+            for email in emails
+        ]
+        }
+
+
+@router.get('/users_metrics', tags = ['users_metrics'])
+async def users_metrics(admin: Optional[dict] = Depends(get_admin_claims),
+                        db: AsyncSession = Depends(get_read_db)):
+    logger.info("Received GET request at /users_metrics")
+    if admin is None:
+        logger.info("Error getting users metrics: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
     return {
         **status_messages.public_status_messages.get_message('got_metrics'),
-        "users_amount": users_amount,
-        "blocked_users": blocked_users,
-        "non_blocked_users": users_amount - blocked_users,
-        "last_registered_users": users_registered_last_day,
-        "last_logged_users": users_logged_last_hour,
-        "last_registered_google_users": google_users_registered_last_day,
-        "last_logged_google_users": google_users_logged_last_hour
+        **await users_metrics_cache.get(db)
+        }
+
+
+@router.get('/login_activity', tags = ['login_activity'])
+async def login_activity(period: LoginPeriod = LoginPeriod.hour,
+                         periods: int = Query(LOGIN_ACTIVITY_DEFAULT_PERIODS, ge=1,
+                                              le=LOGIN_ACTIVITY_MAX_PERIODS),
+                         admin: Optional[dict] = Depends(get_admin_claims),
+                         db: AsyncSession = Depends(get_read_db)):
+    logger.info(f"Received GET request at /login_activity with period {period}")
+    if admin is None:
+        logger.info("Error getting login activity: user is not an admin")
+        return status_messages.public_status_messages.get_response('not_admin')
+    model = LOGIN_ROLLUP_MODELS[period]
+    since = datetime.now() - model.period * periods
+    rows = (await db.execute(login_activity_statement(model, since))).all()
+    return {
+        **status_messages.public_status_messages.get_message('got_login_activity'),
+        'login_activity': [dict(row._mapping) for row in rows]
+        }
+
+
+@router.post('/refresh_token', tags = ['refresh_token'])
+async def refresh_token(refresh_data: RefreshTokenData, db: AsyncSession = Depends(get_db)):
+    logger.info("Received POST request at /refresh_token")
+    claims = decode_token(refresh_data.refresh_token, REFRESH_TOKEN_TYPE)
+    if claims is None:
+        logger.info("Error refreshing token: invalid refresh token")
+        return status_messages.public_status_messages.get_response('invalid_token')
+
+    # The account is read so that deleted admins and blocked users can not get new tokens
+    if claims['role'] == ADMIN_ROLE:
+        account = (await db.execute(
+            select(db_admin.Admin.email).where(db_admin.Admin.email == claims['sub'])
+        )).first()
+    else:
+        account = await account_cache.find(db, claims['sub'])
+    if account is None:
+        logger.info("Error refreshing token: user does not exist")
+        return status_messages.public_status_messages.get_response('user_does_not_exist')
+    if (claims['role'] != ADMIN_ROLE) and account.is_blocked:
+        logger.info("Error refreshing token: user is blocked")
+        return status_messages.public_status_messages.get_response('user_is_blocked')
+
+    return {
+        **status_messages.public_status_messages.get_message('refreshed_token'),
+        **create_tokens(claims['sub'], claims['role'])
         }
 
 
-@app.post('/send_message', tags = ['send_message'])
-async def send_message(message_data: SendMessage, db: Session = Depends(get_db)):
+# The receiver is read from the primary database, since the account cache must not be filled with
+# an account from a replica that did not replay its last change yet
+@router.post('/send_message', tags = ['send_message'])
+async def send_message(message_data: SendMessage, db: AsyncSession = Depends(get_db)):
     logger.info(f"Received POST request at /send_message with body: {message_data}")
-    aux_account = db.query(db_user.User)\
-        .filter(db_user.User.email == message_data.user_receiver_email).first()
-    if aux_account is None:
-        aux_account = db.query(db_google.Google)\
-            .filter(db_google.Google.email == message_data.user_receiver_email).first()
+    aux_account = await account_cache.find(db, message_data.user_receiver_email)
 
     if aux_account is None:
         logger.info("Error sending private message: sendee user does not exist")
-        return status_messages.public_status_messages.get_message('user_does_not_exist')
+        return status_messages.public_status_messages.get_response('user_does_not_exist')
 
     if aux_account.expo_token is None:
         return {"status": "ok", "message": ""}
@@ -415,51 +804,170 @@ async def send_message(message_data: SendMessage, db: Session = Depends(get_db))
         "title": f'Message by {message_data.email}',
         "body": message_data.message_body,
     }
-    print(aux_account.expo_token)
-    message_response = requests.post('https://exp.host/--/api/v2/push/send', json=message_json)
-    print(message_response)
-    print(message_response.json())
-    logger.info(f"Expo messaging response status code: {message_response.status_code}")
-    if message_response.status_code != 200:
-        logger.warning("Error sending private message: expo API response is not 200 OK")
-        raise UnexpectedErrorException
+    message_id = push_client.enqueue(message_json)
+    return {"status": "ok", "message": "", "message_id": message_id}
+
+
+# The tokens of the receivers are resolved and the messages are sent in a background job, so the
+# response only has the id of the job and its initial progress. Any logged user can send it to
+# the listed receivers in their own name, only admins can send it to every user
+@router.post('/broadcast_message', tags = ['broadcast_message'])
+async def broadcast_message(message_data: BroadcastMessage,
+                            claims: Optional[dict] = Depends(get_token_claims),
+                            admin: Optional[dict] = Depends(get_admin_claims)):
+    receivers = message_data.user_receiver_emails
+    logger.info(f"Received POST request at /broadcast_message from {message_data.email} to "
+                f"{len(receivers) if receivers is not None else 'every'} users")
+    if claims is None:
+        logger.info("Error broadcasting message: invalid access token")
+        return status_messages.public_status_messages.get_response('invalid_token')
+    if message_data.email != claims['sub']:
+        logger.info(f"Error broadcasting message: the access token belongs to {claims['sub']}")
+        return status_messages.public_status_messages.get_response('sender_is_not_token_owner',
+                                                                   403)
+    if (receivers is None) and (admin is None):
+        logger.info("Error broadcasting message: only admins can send a message to every user")
+        return status_messages.public_status_messages.get_response('not_admin')
+    job = await push_broadcaster.start(
+        {
+            "sound": 'default',
+            "title": f'Message by {message_data.email}',
+            "body": message_data.message_body,
+        },
+        receivers,
+        message_data.account_type
+    )
+    return {
+        **status_messages.public_status_messages.get_message('broadcast_started'),
+        **job
+        }
 
-    message_response_json = message_response.json()
-    logger.info(f"Expo messaging response body: {message_response_json}")
-    return {"status": "ok", "message": ""}
+
+# The progress is read from the primary database, since the job is updated while it is sent
+@router.get('/broadcast_job/{job_id}', tags = ['broadcast_job'])
+async def broadcast_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    logger.info(f"Received GET request at /broadcast_job/{job_id}")
+    job = await push_broadcaster.get_job(db, job_id)
+    if job is None:
+        logger.info("Error getting broadcast job: job does not exist")
+        return status_messages.public_status_messages.get_response('broadcast_job_does_not_exist')
+    return {
+        **status_messages.public_status_messages.get_message('got_broadcast_job'),
+        **job
+        }
 
 
-@app.post('/log_out')
-async def log_out(logout_data: Logout, db: Session = Depends(get_db)):
+@router.get('/push_ticket/{message_id}', tags = ['push_ticket'])
+async def push_ticket(message_id: str):
+    logger.info(f"Received GET request at /push_ticket/{message_id}")
+    ticket = push_client.get_ticket(message_id)
+    if ticket is None:
+        logger.info("Error getting push ticket: message does not exist")
+        return status_messages.public_status_messages.get_response('message_does_not_exist')
+    return {
+        **status_messages.public_status_messages.get_message('got_push_ticket'),
+        'ticket': ticket
+        }
+
+
+@router.post('/log_out')
+async def log_out(logout_data: Logout, db: AsyncSession = Depends(get_db)):
     logger.info(f"Received POST request at /log_out with body: {logout_data}")
-    is_normal_user = True
-    aux_account = db.query(db_user.User).filter(db_user.User.email == logout_data.email).first()
-    if aux_account is None:
-        is_normal_user = False
-        aux_account = db.query(db_google.Google).filter(db_google.Google.email == logout_data.email).first()
+    # Otherwise a buffered login would restore the expo token when it is written
+    await login_write_buffer.discard(logout_data.email)
+    updated_model = await update_account(db, logout_data.email, {'expo_token': None})
 
-    if aux_account is None:
+    if updated_model is None:
         logger.info("Error logging out: sendee user does not exist")
-        return status_messages.public_status_messages.get_message('user_does_not_exist')
+        return status_messages.public_status_messages.get_response('user_does_not_exist')
+
+    await db.commit()
+    await account_cache.invalidate(logout_data.email)
+
+    return status_messages.public_status_messages.get_response('successful_logout')
+
+
+# The cached accounts are read again once their buffered logins, which can change their expo token,
+# are written
+login_write_buffer.on_written = account_cache.invalidate_many
+
+metrics_registry.gauge('password_hashing_in_flight',
+                       'Password hashing operations that are running or waiting for a worker',
+                       lambda: password_hasher.in_flight)
+metrics_registry.gauge('password_hashing_queue_depth',
+                       'Password hashing operations that are waiting for a worker',
+                       password_hasher.queue_depth)
+metrics_registry.gauge('push_notifications_queued',
+                       'Push notifications that are waiting to be sent to expo',
+                       lambda: push_client.metrics()['queued'])
+metrics_registry.gauge('push_broadcasts_running', 'Broadcast jobs that are still running',
+                       push_broadcaster.running_jobs)
+metrics_registry.gauge('login_events_pending', 'Login events that are waiting to be written',
+                       login_event_writer.pending_size)
+metrics_registry.gauge('account_cache_size', 'Accounts in the account cache',
+                       account_cache.backend.size)
+metrics_registry.gauge('database_connections_checked_out',
+                       'Connections of the database pools that are in use',
+                       lambda: sum(status.get('checked_out', 0)
+                                   for status in database_pools_status().values()))
+metrics_registry.gauge('database_read_replica_available',
+                       'Whether the read only queries are sent to the read replica',
+                       lambda: int(read_replica.available))
+
+
+# With several server workers the metrics are the ones of every worker added up
+@router.get('/metrics', tags = ['metrics'])
+async def metrics():
+    return Response(content=multiprocess_metrics.render(),
+                    media_type=metrics_registry.CONTENT_TYPE)
+
+
+def database_pools_status():
+    pools = {'sync': pool_status(engine)}
+    if async_engine is not None:
+        pools['async'] = pool_status(async_engine.sync_engine)
+    if read_engine is not None:
+        pools['read_sync'] = pool_status(read_engine)
+    if read_async_engine is not None:
+        pools['read_async'] = pool_status(read_async_engine.sync_engine)
+    return pools
+
+
+@router.get('/database_pool_status', tags = ['database_pool_status'])
+async def database_pool_status():
+    logger.info("Received GET request at /database_pool_status")
+    pools = database_pools_status()
+    logger.info(f"Database pool status: {pools}")
+    return {
+        **status_messages.public_status_messages.get_message('got_pool_status'),
+        'pools': pools
+        }
 
-    if is_normal_user:
-        db.query(DbUser).filter(DbUser.email == logout_data.email).update({
-                DbUser.expo_token: None
-            })
-        db.commit()
-    else:
-        db.query(db_google.Google).filter(db_google.Google.email == logout_data.email).update({
-                DbUser.expo_token: None
-            })
-        db.commit()
-    
-    return status_messages.public_status_messages.get_message('successful_logout')
+
+# Builds the app with the routes of this module. Every worker of the production server builds its
+# own app, after the database was prepared by prepare_database
+def create_app():
+    new_app = FastAPI(openapi_tags=tags_metadata,
+                      default_response_class=ORJSONResponse)
+    new_app.add_middleware(RequestMetricsMiddleware)
+    new_app.include_router(router)
+    new_app.add_exception_handler(UnexpectedErrorException,
+                                  invalid_credentials_exception_handler)
+    new_app.add_exception_handler(HashingQueueFullException, server_busy_exception_handler)
+    new_app.add_exception_handler(PushQueueFullException, server_busy_exception_handler)
+    for handler in (start_login_rollups, start_loop_monitor, start_metrics_writer):
+        new_app.add_event_handler('startup', handler)
+    for handler in (shutdown_password_hasher, shutdown_push_client, stop_loop_monitor,
+                    flush_login_write_buffer, flush_login_events, stop_metrics_writer, flush_logs):
+        new_app.add_event_handler('shutdown', handler)
+    return new_app
 
 
+app = create_app()
 
 
+# Development server, the production server is started with server.py
 if __name__ == '__main__':
-    if not generate_first_admin():
-        logger.error("Error generating first admin user")
+    prepare_database()
     # Base.metadata.drop_all(engine)
     uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT')))
@@ -0,0 +1,5 @@
+from enum import Enum
+
+class AccountType(str, Enum):
+    normal = 'normal'
+    google = 'google'
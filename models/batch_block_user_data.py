@@ -0,0 +1,6 @@
+from pydantic import BaseModel, conlist
+from models.batch_size import BATCH_MAX_ITEMS
+
+class BatchBlockUserData(BaseModel):
+    modified_users: conlist(str, min_items=1, max_items=BATCH_MAX_ITEMS)
+    is_blocked: bool
@@ -0,0 +1,6 @@
+from pydantic import BaseModel, conlist
+from models.registration_data import RegistrationData
+from models.batch_size import BATCH_MAX_ITEMS
+
+class BatchRegistrationData(BaseModel):
+    users: conlist(RegistrationData, min_items=1, max_items=BATCH_MAX_ITEMS)
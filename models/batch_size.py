@@ -0,0 +1,4 @@
+import os
+
+# Maximum amount of items of the batch endpoints
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
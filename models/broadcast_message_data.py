@@ -0,0 +1,16 @@
+import os
+from typing import Optional
+from pydantic import BaseModel, conlist
+from models.account_type import AccountType
+
+# Maximum amount of receivers of a broadcast that lists them
+BROADCAST_MAX_RECEIVERS = int(os.environ.get('BROADCAST_MAX_RECEIVERS', 10000))
+
+ReceiverEmails = conlist(str, min_items=1, max_items=BROADCAST_MAX_RECEIVERS)
+
+class BroadcastMessage(BaseModel):
+    email: str
+    message_body: str
+    # If it is not set the message is sent to every account that is not blocked
+    user_receiver_emails: Optional[ReceiverEmails] = None
+    account_type: Optional[AccountType] = None
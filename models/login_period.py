@@ -0,0 +1,5 @@
+from enum import Enum
+
+class LoginPeriod(str, Enum):
+    hour = 'hour'
+    day = 'day'
@@ -0,0 +1,4 @@
+from pydantic import BaseModel
+
+class RefreshTokenData(BaseModel):
+    refresh_token: str
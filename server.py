@@ -0,0 +1,86 @@
+import os
+import tempfile
+import multiprocessing
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+
+PORT = int(os.environ.get('PORT', 8001))
+# Defaults to one worker per core, the password hashing of every worker already uses its own threads
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Seconds that an idle connection is kept open waiting for the next request
+KEEP_ALIVE = int(os.environ.get('KEEP_ALIVE', 5))
+# Amount of connections that can wait to be accepted
+BACKLOG = int(os.environ.get('BACKLOG', 2048))
+# Seconds that the workers have to finish the requests in progress and run the shutdown handlers
+# (which flush the buffered writes) before they are killed
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Seconds that a worker can be unresponsive before it is restarted
+WORKER_TIMEOUT = int(os.environ.get('WORKER_TIMEOUT', 60))
+
+
+# Uvicorn worker that requires uvloop and httptools instead of falling back to the pure python
+# implementations when they are not installed
+class UvloopWorker(UvicornWorker):
+    CONFIG_KWARGS = {'loop': 'uvloop', 'http': 'httptools'}
+
+
+# Runs the workers with gunicorn. Every worker imports main and builds its own app, so that no
+# connections, threads or event loops are shared between processes
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import create_app
+        return create_app()
+
+
+# Prepares the database and removes the metrics that the workers of a previous run wrote
+def prepare_database():
+    from main import prepare_database as prepare_app_database
+    from utils.multiprocess_metrics import clear_metrics_directory, PROMETHEUS_MULTIPROC_DIR
+    prepare_app_database()
+    clear_metrics_directory(PROMETHEUS_MULTIPROC_DIR)
+
+
+# Prepares the database once, before the workers are forked. It runs in a spawned process so that
+# the master does not import the app, whose connections and threads must not be inherited by the
+# workers. The server runs a single worker if JWT_SECRET_KEY is not set, since every worker would
+# sign the tokens with its own random key and reject the tokens of the others. The workers write
+# their metrics in PROMETHEUS_MULTIPROC_DIR, which defaults to a new temporary directory, and
+# inherit the environment of the master when they are forked
+def on_starting(server):
+    if server.num_workers > 1 and not os.environ.get('JWT_SECRET_KEY'):
+        server.log.warning(f"JWT_SECRET_KEY is not set, running 1 worker instead of "
+                           f"{server.num_workers}")
+        server.num_workers = 1
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='metrics_')
+    process = multiprocessing.get_context('spawn').Process(target=prepare_database)
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f'Database preparation failed with exit code {process.exitcode}')
+
+
+def server_options():
+    return {
+        'bind': f'0.0.0.0:{PORT}',
+        'workers': WEB_CONCURRENCY,
+        'worker_class': UvloopWorker,
+        'keepalive': KEEP_ALIVE,
+        'backlog': BACKLOG,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'timeout': WORKER_TIMEOUT,
+        'on_starting': on_starting,
+    }
+
+
+if __name__ == '__main__':
+    Server(server_options()).run()
@@ -0,0 +1,2 @@
+class PushQueueFullException(Exception):
+    pass
@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import patch
+from utils.account_cache import AccountCache, LocalAccountCacheBackend, CachedAccount
+from database.accounts import Account
+from database_models.user import User
+from database_models.google import Google
+
+
+def account(model, email, is_blocked=False, expo_token='expo12345token'):
+    return Account(model, email, None, 'firebase_password', is_blocked, expo_token)
+
+
+def test_local_backend_evicts_the_least_recently_used_account():
+    backend = LocalAccountCacheBackend(max_size=2, ttl=60)
+
+    async def fill():
+        await backend.set('a@mail.com', CachedAccount('users', False, None))
+        await backend.set('b@mail.com', CachedAccount('users', False, None))
+        await backend.get('a@mail.com')
+        await backend.set('c@mail.com', CachedAccount('users', False, None))
+        return [await backend.get(email) is not None
+                for email in ('a@mail.com', 'b@mail.com', 'c@mail.com')]
+
+    assert asyncio.run(fill()) == [True, False, True]
+    assert backend.evictions == 1
+
+
+def test_local_backend_expires_accounts_after_the_ttl():
+    backend = LocalAccountCacheBackend(max_size=2, ttl=60)
+
+    async def read_later():
+        with patch('utils.account_cache.time.monotonic', return_value=0):
+            await backend.set('a@mail.com', CachedAccount('users', False, None))
+        with patch('utils.account_cache.time.monotonic', return_value=59):
+            cached = await backend.get('a@mail.com')
+        with patch('utils.account_cache.time.monotonic', return_value=60):
+            expired = await backend.get('a@mail.com')
+        return cached, expired
+
+    assert asyncio.run(read_later()) == (CachedAccount('users', False, None), None)
+    assert backend.size() == 0
+
+
+def test_account_cache_reads_the_database_on_misses_only():
+    cache = AccountCache(max_size=10, ttl=60)
+    accounts = {'test@gmail.com': account(Google, 'test@gmail.com')}
+
+    async def lookups():
+        with patch('utils.account_cache.find_account',
+                   side_effect=lambda _db, email: accounts.get(email)) as find:
+            results = [
+                await cache.find(None, 'test@gmail.com'),
+                await cache.find(None, 'test@gmail.com'),
+                await cache.find(None, 'missing@mail.com'),
+                await cache.find(None, 'missing@mail.com'),
+            ]
+            return results, find.call_count
+
+    results, database_reads = asyncio.run(lookups())
+    assert results == [CachedAccount('Google', False, 'expo12345token')] * 2 + [None, None]
+    # Accounts that do not exist are not cached
+    assert database_reads == 3
+    assert cache.metrics() == {'size': 1, 'hits': 1, 'misses': 3, 'evictions': 0}
+
+
+def test_account_cache_is_not_filled_by_lookups_older_than_an_invalidation():
+    cache = AccountCache(max_size=10, ttl=60)
+
+    async def find_blocked_during_lookup(_db, email):
+        # The account is blocked and invalidated while it is being read
+        await cache.invalidate(email)
+        return account(User, email)
+
+    async def lookups():
+        with patch('utils.account_cache.find_account', side_effect=find_blocked_during_lookup):
+            await cache.find(None, 'test@mail.com')
+        return await cache.backend.get('test@mail.com')
+
+    assert asyncio.run(lookups()) is None
+
+
+def test_account_cache_is_filled_by_lookups_running_while_other_accounts_are_invalidated():
+    cache = AccountCache(max_size=10, ttl=60)
+
+    async def find_while_other_account_is_invalidated(_db, email):
+        await cache.invalidate('other@mail.com')
+        return account(User, email)
+
+    async def lookups():
+        with patch('utils.account_cache.find_account',
+                   side_effect=find_while_other_account_is_invalidated):
+            await cache.find(None, 'test@mail.com')
+        return await cache.backend.get('test@mail.com')
+
+    assert asyncio.run(lookups()) == CachedAccount('users', False, 'expo12345token')
+    assert cache.running_lookups == {}
+
+
+def test_account_cache_only_invalidates_logins_that_changed_the_account():
+    cache = AccountCache(max_size=10, ttl=60)
+
+    async def logins():
+        await cache.backend.set('test@gmail.com', CachedAccount('Google', False, 'token'))
+        await cache.invalidate_if_changed('test@gmail.com', 'token')
+        kept = await cache.backend.get('test@gmail.com')
+        await cache.invalidate_if_changed('test@gmail.com', 'new_token')
+        return kept, await cache.backend.get('test@gmail.com')
+
+    assert asyncio.run(logins()) == (CachedAccount('Google', False, 'token'), None)
+
+
+def test_account_cache_can_be_disabled():
+    cache = AccountCache(max_size=0, ttl=60)
+
+    async def lookups():
+        with patch('utils.account_cache.find_account',
+                   side_effect=lambda _db, email: account(User, email)) as find:
+            await cache.find(None, 'test@mail.com')
+            await cache.find(None, 'test@mail.com')
+            return find.call_count
+
+    assert asyncio.run(lookups()) == 2
+    assert cache.backend.size() == 0
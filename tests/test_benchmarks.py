@@ -0,0 +1,43 @@
+from sqlalchemy import create_engine, select, func
+
+from benchmarks.seed import seed
+from benchmarks.load import summarize, percentile
+from benchmarks.bulk import bulk_emails, report
+from database_models.user import User
+from database_models.google import Google
+
+
+def test_seed_inserts_the_accounts_in_batches(tmp_path):
+    database_url = f'sqlite:///{tmp_path}/benchmark.db'
+
+    result = seed(database_url, users=25, google_accounts=10, admins=1, batch_size=10)
+
+    assert result['inserted_rows'] == {'users': 25, 'Google': 10, 'admins': 1}
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(User)).scalar() == 25
+        assert connection.execute(
+            select(func.count()).select_from(Google).where(Google.is_blocked.is_(True))
+        ).scalar() == 1
+
+
+def test_results_are_summarized_with_percentiles():
+    results = [(i / 1000, i == 100, 2) for i in range(1, 101)]
+
+    summary = summarize(results, duration=2)
+
+    assert summary['requests'] == 100
+    assert summary['errors'] == 1
+    assert summary['requests_per_second'] == 50
+    assert summary['latency_ms'] == {'p50': 51, 'p95': 96, 'p99': 100, 'max': 100}
+    assert summary['queries_per_request'] == 2
+    assert percentile([], 50) is None
+
+
+def test_bulk_runs_use_new_emails_and_report_items_per_second():
+    first_emails, second_emails = bulk_emails(3), bulk_emails(3)
+
+    assert len(set(first_emails) | set(second_emails)) == 6
+    assert report(items=100, elapsed=0.5, errors=1) == {
+        'items': 100, 'errors': 1, 'seconds': 0.5, 'items_per_second': 200
+    }
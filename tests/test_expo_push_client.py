@@ -0,0 +1,243 @@
+import json
+import asyncio
+from datetime import timedelta
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pytest import fixture, raises
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from utils.expo_push_client import ExpoPushClient
+from utils.push_broadcaster import PushBroadcaster, DONE_STATUS
+from server_exceptions.push_queue_full import PushQueueFullException
+from database.database import Base
+from database.threaded_session import ThreadedSession
+from database_models.user import User
+from database_models.google import Google
+from models.account_type import AccountType
+
+
+# Answers like Expo's push API, failing the first failures_left requests with a 503
+class FakeExpoHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        messages = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            if self.server.failures_left > 0:
+                self.server.failures_left -= 1
+                self.send_response(503)
+                self.end_headers()
+                return
+            self.server.batches.append(messages)
+        tickets = []
+        for message in messages:
+            if message['to'] == 'invalid_token':
+                tickets.append({'status': 'error', 'message': 'not a valid token',
+                                'details': {'error': 'DeviceNotRegistered'}})
+            else:
+                tickets.append({'status': 'ok', 'id': f"ticket-{message['body']}"})
+        body = json.dumps({'data': tickets}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+@fixture()
+def fake_expo():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeExpoHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures_left = 0
+    server.batches = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}/--/api/v2/push/send'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def message(body, to='expo12345token'):
+    return {'to': to, 'sound': 'default', 'title': 'Message by sender@mail.com', 'body': body}
+
+
+def test_messages_are_sent_in_batches_of_up_to_100(fake_expo):
+    push_client = ExpoPushClient(url=fake_expo.url, batch_linger=0.5)
+
+    async def send_messages():
+        message_ids = [push_client.enqueue(message(str(i))) for i in range(250)]
+        assert push_client.get_ticket(message_ids[0]) == {'status': 'queued'}
+        await push_client.close()
+        return message_ids
+
+    message_ids = asyncio.run(send_messages())
+
+    assert sorted(len(batch) for batch in fake_expo.batches) == [50, 100, 100]
+    assert push_client.get_ticket(message_ids[7]) == {'status': 'ok', 'id': 'ticket-7'}
+    assert push_client.metrics()['sent'] == 250
+
+
+def test_failed_requests_are_retried(fake_expo):
+    fake_expo.failures_left = 2
+    push_client = ExpoPushClient(url=fake_expo.url, retry_delay=0.01)
+
+    async def send_message():
+        message_id = push_client.enqueue(message('hello'))
+        await push_client.close()
+        return message_id
+
+    message_id = asyncio.run(send_message())
+
+    assert fake_expo.requests == 3
+    assert push_client.get_ticket(message_id) == {'status': 'ok', 'id': 'ticket-hello'}
+
+
+def test_messages_fail_after_the_last_retry(fake_expo):
+    fake_expo.failures_left = 10
+    push_client = ExpoPushClient(url=fake_expo.url, max_retries=1, retry_delay=0.01)
+
+    async def send_message():
+        message_id = push_client.enqueue(message('hello'))
+        await push_client.close()
+        return message_id
+
+    message_id = asyncio.run(send_message())
+
+    assert fake_expo.requests == 2
+    assert push_client.get_ticket(message_id)['status'] == 'error'
+    assert push_client.metrics()['failed'] == 1
+
+
+def test_tickets_rejected_by_expo_are_tracked(fake_expo):
+    push_client = ExpoPushClient(url=fake_expo.url)
+
+    async def send_messages():
+        message_ids = [push_client.enqueue(message('hello')),
+                       push_client.enqueue(message('hello', to='invalid_token'))]
+        await push_client.close()
+        return message_ids
+
+    valid_id, invalid_id = asyncio.run(send_messages())
+
+    assert push_client.get_ticket(valid_id)['status'] == 'ok'
+    assert push_client.get_ticket(invalid_id)['details']['error'] == 'DeviceNotRegistered'
+
+
+def test_enqueue_fails_when_the_queue_is_full(fake_expo):
+    push_client = ExpoPushClient(url=fake_expo.url, max_queue_size=1)
+
+    async def send_messages():
+        push_client.enqueue(message('first'))
+        with raises(PushQueueFullException):
+            push_client.enqueue(message('second'))
+        await push_client.close()
+
+    asyncio.run(send_messages())
+
+
+def test_send_posts_the_batch_right_away(fake_expo):
+    push_client = ExpoPushClient(url=fake_expo.url)
+
+    async def send_messages():
+        tickets = await push_client.send([message('hello'), message('bye', to='invalid_token')])
+        await push_client.close()
+        return tickets
+
+    tickets = asyncio.run(send_messages())
+
+    assert [ticket['status'] for ticket in tickets] == ['ok', 'error']
+    assert fake_expo.requests == 1
+    assert push_client.metrics()['sent'] == 1
+    assert push_client.metrics()['failed'] == 1
+
+
+def broadcast_sessions():
+    engine = create_engine('sqlite://', connect_args={"check_same_thread": False},
+                           poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(bind=engine, expire_on_commit=False)
+    db = sessions()
+    db.add_all([User(f'user{i}@mail.com', 'password', i == 0, f'token{i}', hashed_password='hash')
+                for i in range(250)])
+    # Accounts that share a token get a single message
+    db.add(Google('user0@gmail.com', False, 'token1'))
+    db.add(Google('user1@gmail.com', False, ''))
+    db.commit()
+    db.close()
+
+    def new_session():
+        return ThreadedSession(sessions())
+
+    async def new_read_session():
+        return new_session()
+    return new_read_session, new_session
+
+
+# Starts the broadcast and returns its progress once it finished
+async def run_broadcast(broadcaster, message, receivers=None, account_type=None):
+    job = await broadcaster.start(message, receivers, account_type)
+    await broadcaster.tasks[job['job_id']]
+    await broadcaster.client.close()
+    db = broadcaster.job_session_factory()
+    try:
+        return await broadcaster.get_job(db, job['job_id'])
+    finally:
+        await db.close()
+
+
+def test_broadcast_sends_a_message_per_distinct_token_in_batches(fake_expo):
+    broadcaster = PushBroadcaster(ExpoPushClient(url=fake_expo.url), *broadcast_sessions(),
+                                  resolve_batch_size=100, max_concurrent_batches=2)
+    receivers = [f'user{i}@mail.com' for i in range(250)]
+    receivers += ['user0@gmail.com', 'user1@gmail.com', 'user5@mail.com', 'missing@mail.com']
+
+    job = asyncio.run(run_broadcast(broadcaster, {'title': 'Message by admin', 'body': 'hello'},
+                                    receivers))
+
+    assert job['job_status'] == DONE_STATUS
+    assert job['finished_at'] is not None
+    # The blocked user0 is skipped and user0@gmail.com has the token of user1
+    assert job['receivers'] == 254
+    assert (job['tokens'], job['sent'], job['failed']) == (249, 249, 0)
+    assert sorted(len(batch) for batch in fake_expo.batches) == [49, 100, 100]
+    tokens = [message['to'] for batch in fake_expo.batches for message in batch]
+    assert len(set(tokens)) == len(tokens)
+
+
+def test_broadcast_to_every_user_of_an_account_type(fake_expo):
+    broadcaster = PushBroadcaster(ExpoPushClient(url=fake_expo.url), *broadcast_sessions())
+
+    job = asyncio.run(run_broadcast(broadcaster, {'title': 'Message by admin', 'body': 'hello'},
+                                    account_type=AccountType.google))
+
+    assert job['receivers'] is None
+    assert (job['tokens'], job['sent']) == (1, 1)
+    assert fake_expo.batches == [[{'title': 'Message by admin', 'body': 'hello', 'to': 'token1'}]]
+
+
+def test_broadcast_deletes_the_jobs_older_than_the_retention(fake_expo):
+    broadcaster = PushBroadcaster(ExpoPushClient(url=fake_expo.url), *broadcast_sessions(),
+                                  jobs_retention=timedelta(0))
+    message = {'title': 'Message by admin', 'body': 'hello'}
+
+    async def broadcast_twice():
+        first_job = await run_broadcast(broadcaster, message, ['user1@mail.com'])
+        second_job = await run_broadcast(broadcaster, message, ['user2@mail.com'])
+        db = broadcaster.job_session_factory()
+        try:
+            return [await broadcaster.get_job(db, job['job_id'])
+                    for job in (first_job, second_job)]
+        finally:
+            await db.close()
+
+    first_job, second_job = asyncio.run(broadcast_twice())
+
+    assert first_job is None
+    assert second_job['sent'] == 1
@@ -0,0 +1,45 @@
+import time
+import asyncio
+from unittest.mock import patch
+
+from utils.loop_monitor import LoopLagMonitor
+
+
+def block_the_loop():
+    time.sleep(0.3)
+
+
+@patch('utils.loop_monitor.logger')
+def test_blocked_loop_is_reported_with_its_stack(mock_logger):
+    monitor = LoopLagMonitor(interval=0.01, threshold_ms=100)
+
+    async def run_blocking_code():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        block_the_loop()
+        await asyncio.sleep(0.05)
+        await monitor.close()
+
+    asyncio.run(run_blocking_code())
+
+    assert monitor.blocks == 1
+    message = mock_logger.warning.call_args[0][0]
+    assert 'Event loop blocked' in message
+    assert 'block_the_loop' in message
+    assert monitor.percentiles()[99] >= 0.2
+
+
+@patch('utils.loop_monitor.logger')
+def test_idle_loop_is_not_reported(mock_logger):
+    monitor = LoopLagMonitor(interval=0.01, threshold_ms=100)
+
+    async def run_idle_loop():
+        monitor.start()
+        await asyncio.sleep(0.3)
+        await monitor.close()
+
+    asyncio.run(run_idle_loop())
+
+    assert monitor.blocks == 0
+    assert not mock_logger.warning.called
+    assert monitor.percentiles()[50] < 0.1
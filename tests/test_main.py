@@ -1,39 +1,95 @@
+import os
+import json
+import asyncio
+from datetime import datetime
 from fastapi.testclient import TestClient
-from main import app, get_db
-from sqlalchemy import create_engine
+from main import app, get_db, get_read_db
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from pytest import fixture
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
+from passlib.hash import bcrypt
 
-from database.database import Base
+from database.database import Base, get_async_url
 from configuration.status_messages import public_status_messages
+from utils.users_metrics_cache import users_metrics_cache
+from utils.account_cache import account_cache
+from utils.push_broadcaster import push_broadcaster
+from utils.expo_push_client import ExpoPushClient
+from benchmarks.fake_expo import start_fake_expo
+from utils.password_hasher import crypt_context
+from utils.request_metrics import QUERY_COUNT_HEADER
+from database.login_write_buffer import login_write_buffer
+from database.login_events import login_event_writer, login_rollup_worker
+from database.read_replica import read_replica
+from database_models.google import Google
+from database_models.user import User as DbUser
+from utils.tokens import create_tokens, decode_token, ADMIN_ROLE, USER_ROLE, ACCESS_TOKEN_TYPE,\
+    REFRESH_TOKEN_TYPE
 
 
 SQLITE_DATABASE_URL = "sqlite:///./test.db"
+SQLITE_REPLICA_FILE = "./test_replica.db"
+SQLITE_REPLICA_URL = f"sqlite:///{SQLITE_REPLICA_FILE}"
 
 engine = create_engine(
     SQLITE_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_url(SQLITE_DATABASE_URL))
+TestingSession = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                              bind=async_engine, class_=AsyncSession)
 
 
-def override_get_db():
+async def override_get_db():
+    db = TestingSession()
     try:
-        db = TestingSession()
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+login_event_writer.session_factory = TestingSession
 
 client = TestClient(app)
 
+ADMIN_HEADERS = {
+    'Authorization': f"Bearer {create_tokens('admin@mail.com', ADMIN_ROLE)['access_token']}"
+}
+
+
+# Sends the request and fails if it runs more than max_queries database queries, which are counted
+# by the query instrumentation of the engine. sqlite runs an extra query to read the rows updated
+# by some statements, since it does not support UPDATE ... RETURNING
+def assert_max_queries(max_queries, method, url, **kwargs):
+    with patch('utils.request_metrics.QUERY_DEBUG_HEADERS', True):
+        response = client.request(method, url, **kwargs)
+    queries = int(response.headers[QUERY_COUNT_HEADER])
+    assert queries <= max_queries,\
+        f'{method} {url} ran {queries} queries, expected at most {max_queries}'
+    return response
+
+
+# Runs the coroutine in the loop where the test client runs the app, which is where the writers are
+# bound. The loop is created like the test client does if there is none
+def run_in_client_loop(coroutine):
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coroutine)
+
 
 @fixture()
 def test_db():
     Base.metadata.create_all(bind=engine)
+    users_metrics_cache.clear()
+    run_in_client_loop(account_cache.clear())
     yield
+    run_in_client_loop(login_event_writer.flush())
     Base.metadata.drop_all(bind=engine)
 
 
@@ -44,6 +100,17 @@ def test_home(test_db):
     assert response.json() == public_status_messages.get_message('hello_users')
 
 
+def test_status_message_replies_are_pre_serialized(test_db):
+    response = client.get('/pong')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    assert response.content == public_status_messages.serialized_messages['pong']
+
+    response = client.post('/login/', json={'email': 'nobody@mail.com', 'password': 'password',
+                                            'expo_token': 'token'})
+    assert response.content == public_status_messages.serialized_messages['failed_login']
+
+
 def test_create_user(test_db):
     response = client.post(
         '/create/',
@@ -116,7 +183,7 @@ def test_users_list_returns_all_registered_emails(test_db):
         }
     )
 
-    response = client.get('/users_list/true')
+    response = client.get('/users_list/true', headers=ADMIN_HEADERS)
     assert response.status_code == 200
     data = response.json()
     actual_users = set(map(lambda x: x['email'], data['users']))
@@ -129,6 +196,87 @@ def test_users_list_returns_all_registered_emails(test_db):
     assert not actual_users ^ expected_users
 
 
+def create_users_for_list():
+    for email in ('c@mail.com', 'a@mail.com', 'e@mail.com'):
+        client.post(
+            '/create/',
+            json={
+                'email': email,
+                'password': 'secret_password',
+                'expo_token': 'expo12345token'
+            }
+        )
+    for email in ('b@gmail.com', 'd@gmail.com'):
+        client.post(
+            '/oauth_login',
+            json={
+                'email': email,
+                'expo_token': 'expo12345token'
+            }
+        )
+    client.post(
+        '/change_blocked_status',
+        headers=ADMIN_HEADERS,
+        json={
+            'modified_user': 'd@gmail.com',
+            'is_blocked': True
+        }
+    )
+
+
+def test_users_list_is_paginated_by_email(test_db):
+    create_users_for_list()
+
+    emails = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {'limit': 2}
+        if cursor is not None:
+            params['cursor'] = cursor
+        data = client.get('/users_list/true', headers=ADMIN_HEADERS, params=params).json()
+        assert len(data['users']) <= 2
+        emails += [user['email'] for user in data['users']]
+        pages += 1
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert emails == ['a@mail.com', 'b@gmail.com', 'c@mail.com', 'd@gmail.com', 'e@mail.com']
+
+
+def test_users_list_can_be_filtered(test_db):
+    create_users_for_list()
+
+    blocked_data = client.get('/users_list/true', headers=ADMIN_HEADERS,
+                              params={'is_blocked': True}).json()
+    google_data = client.get('/users_list/true', headers=ADMIN_HEADERS,
+                             params={'account_type': 'google'}).json()
+    prefix_data = client.get('/users_list/true', headers=ADMIN_HEADERS,
+                             params={'email_prefix': 'c@'}).json()
+
+    assert blocked_data['users'] == [{'email': 'd@gmail.com', 'is_blocked': True}]
+    assert [user['email'] for user in google_data['users']] == ['b@gmail.com', 'd@gmail.com']
+    assert [user['email'] for user in prefix_data['users']] == ['c@mail.com']
+
+
+def test_users_list_can_be_streamed(test_db):
+    create_users_for_list()
+
+    response = client.get('/users_list/true', headers=ADMIN_HEADERS,
+                          params={'stream': True, 'cursor': 'b@gmail.com'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert users == [
+        {'email': 'c@mail.com', 'is_blocked': False},
+        {'email': 'd@gmail.com', 'is_blocked': True},
+        {'email': 'e@mail.com', 'is_blocked': False},
+    ]
+
+
 def test_users_list_fails_if_user_is_not_an_admin(test_db):
     response = client.get('/users_list/false')
     assert response.status_code == 200
@@ -207,6 +355,373 @@ def test_oauth_login_fails_without_a_token(test_db):
     assert response_data['detail'][0]['msg'] == 'field required'
 
 
+def test_oauth_login_fails_for_blocked_user(test_db):
+    client.post(
+        '/oauth_login',
+        json={
+            'email': 'test_mail@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    )
+    client.post(
+        '/change_blocked_status',
+        headers=ADMIN_HEADERS,
+        json={
+            'modified_user': 'test_mail@gmail.com',
+            'is_blocked': True
+        }
+    )
+
+    response = client.post(
+        '/oauth_login',
+        json={
+            'email': 'test_mail@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'user is blocked'
+
+
+def test_oauth_login_fails_for_user_with_normal_account(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+
+    response = client.post(
+        '/oauth_login',
+        json={
+            'email': 'test@mail.com',
+            'expo_token': 'expo12345token'
+        }
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'has normal account'
+
+
+def test_login(test_db):
+    registration_data = client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    ).json()
+
+    response = client.post(
+        '/login/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo54321token'
+        }
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'ok'
+    assert response_data['message'] == 'correct username and password'
+    assert response_data['firebase_password'] == registration_data['firebase_password']
+
+
+def test_login_rehashes_outdated_password_hashes(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+    outdated_hash = bcrypt.using(rounds=4).hash('secret_password')
+    with engine.begin() as connection:
+        connection.execute(
+            update(DbUser).where(DbUser.email == 'test@mail.com')
+            .values(hashed_password=outdated_hash)
+        )
+
+    response_data = client.post(
+        '/login/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo54321token'
+        }
+    ).json()
+
+    with engine.connect() as connection:
+        hashed_password = connection.execute(
+            select(DbUser.hashed_password).where(DbUser.email == 'test@mail.com')
+        ).scalar()
+    assert response_data['status'] == 'ok'
+    assert hashed_password != outdated_hash
+    assert crypt_context.verify('secret_password', hashed_password)
+    assert not crypt_context.needs_update(hashed_password)
+
+
+def test_login_is_written_later_with_write_behind(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+
+    with patch.object(login_write_buffer, 'enabled', True),\
+         patch.object(login_write_buffer, 'session_factory', TestingSession):
+        response_data = client.post(
+            '/login/',
+            json={
+                'email': 'test@mail.com',
+                'password': 'secret_password',
+                'expo_token': 'expo54321token'
+            }
+        ).json()
+        with engine.connect() as connection:
+            buffered_token = connection.execute(select(DbUser.expo_token)).scalar()
+        run_in_client_loop(login_write_buffer.close())
+        with engine.connect() as connection:
+            written_token = connection.execute(select(DbUser.expo_token)).scalar()
+
+    assert response_data['status'] == 'ok'
+    assert buffered_token == 'expo12345token'
+    assert written_token == 'expo54321token'
+
+
+def test_login_returns_tokens(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+
+    response_data = client.post(
+        '/login/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    ).json()
+
+    claims = decode_token(response_data['access_token'], ACCESS_TOKEN_TYPE)
+    assert claims['sub'] == 'test@mail.com'
+    assert claims['role'] == USER_ROLE
+    assert decode_token(response_data['refresh_token'], REFRESH_TOKEN_TYPE) is not None
+
+
+def test_refresh_token(test_db):
+    tokens = client.post(
+        '/oauth_login',
+        json={
+            'email': 'test_mail@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    ).json()
+
+    response_data = client.post(
+        '/refresh_token',
+        json={'refresh_token': tokens['refresh_token']}
+    ).json()
+
+    assert response_data['status'] == 'ok'
+    assert decode_token(response_data['access_token'], ACCESS_TOKEN_TYPE)['sub'] ==\
+        'test_mail@gmail.com'
+
+
+def test_refresh_token_fails_with_an_access_token(test_db):
+    tokens = client.post(
+        '/oauth_login',
+        json={
+            'email': 'test_mail@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    ).json()
+
+    response_data = client.post(
+        '/refresh_token',
+        json={'refresh_token': tokens['access_token']}
+    ).json()
+
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'invalid token'
+
+
+def test_refresh_token_fails_for_blocked_user(test_db):
+    tokens = client.post(
+        '/oauth_login',
+        json={
+            'email': 'test_mail@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    ).json()
+    client.post(
+        '/change_blocked_status',
+        headers=ADMIN_HEADERS,
+        json={
+            'modified_user': 'test_mail@gmail.com',
+            'is_blocked': True
+        }
+    )
+
+    response_data = client.post(
+        '/refresh_token',
+        json={'refresh_token': tokens['refresh_token']}
+    ).json()
+
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'user is blocked'
+
+
+def test_admin_routes_fail_without_an_admin_token(test_db):
+    user_headers = {
+        'Authorization': f"Bearer {create_tokens('test@mail.com', USER_ROLE)['access_token']}"
+    }
+
+    for headers in ({}, user_headers, {'Authorization': 'Bearer invalid_token'}):
+        responses = [
+            client.get('/users_list/true', headers=headers),
+            client.get('/users_metrics', headers=headers),
+            client.post(
+                '/change_blocked_status',
+                headers=headers,
+                json={
+                    'modified_user': 'test@mail.com',
+                    'is_blocked': True
+                }
+            ),
+            client.post(
+                '/change_blocked_status_batch',
+                headers=headers,
+                json={
+                    'modified_users': ['test@mail.com'],
+                    'is_blocked': True
+                }
+            ),
+            client.post(
+                '/create_batch',
+                headers=headers,
+                json={'users': [{
+                    'email': 'test@mail.com',
+                    'password': 'secret_password',
+                    'expo_token': 'expo12345token'
+                }]}
+            ),
+            client.post(
+                '/admin_create/',
+                headers=headers,
+                json={
+                    'email': 'admin2@mail.com',
+                    'password': 'secret_password',
+                    'name': 'admin'
+                }
+            ),
+        ]
+        for response in responses:
+            assert response.status_code == 200
+            assert response.json()['message'] == 'user is not admin'
+
+
+def test_admin_login_returns_admin_tokens(test_db):
+    client.post(
+        '/admin_create/',
+        headers=ADMIN_HEADERS,
+        json={
+            'email': 'admin2@mail.com',
+            'password': 'secret_password',
+            'name': 'admin'
+        }
+    )
+
+    response_data = client.post(
+        '/admin_login/',
+        json={
+            'email': 'admin2@mail.com',
+            'password': 'secret_password'
+        }
+    ).json()
+
+    assert response_data['status'] == 'ok'
+    claims = decode_token(response_data['access_token'], ACCESS_TOKEN_TYPE)
+    assert claims['sub'] == 'admin2@mail.com'
+    assert claims['role'] == ADMIN_ROLE
+
+
+def test_login_fails_with_wrong_password(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+
+    response = client.post(
+        '/login/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'wrong_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'incorrect username or password'
+
+
+def test_login_fails_for_blocked_user(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+    client.post(
+        '/change_blocked_status',
+        headers=ADMIN_HEADERS,
+        json={
+            'modified_user': 'test@mail.com',
+            'is_blocked': True
+        }
+    )
+
+    response = client.post(
+        '/login/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'error'
+    assert response_data['message'] == 'user is blocked'
+
+
 def test_change_block_status_can_block_user(test_db):
     client.post(
         '/create/',
@@ -219,6 +734,7 @@ def test_change_block_status_can_block_user(test_db):
 
     response = client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'modified_user': 'test@mail.com',
             'is_blocked': True
@@ -245,6 +761,7 @@ def test_change_block_status_can_unblock_user(test_db):
 
     response = client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'modified_user': 'test@mail.com',
             'is_blocked': False
@@ -262,6 +779,7 @@ def test_change_block_status_can_unblock_user(test_db):
 def test_change_block_status_fails_with_missing_params(test_db):
     response = client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'modified_user': 'test@mail.com'
         }
@@ -272,6 +790,7 @@ def test_change_block_status_fails_with_missing_params(test_db):
 
     response = client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'is_blocked': False
         }
@@ -284,6 +803,7 @@ def test_change_block_status_fails_with_missing_params(test_db):
 def test_change_block_status_fails_with_non_existent_user(test_db):
     response = client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'modified_user': 'test@mail.com',
             'is_blocked': False
@@ -297,6 +817,101 @@ def test_change_block_status_fails_with_non_existent_user(test_db):
     assert data['message'] == 'user does not exist'
 
 
+def test_change_block_status_batch_returns_a_result_per_user(test_db):
+    for email in ('first@mail.com', 'second@mail.com'):
+        client.post('/create/', json={
+            'email': email,
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        })
+    client.post('/oauth_login', json={'email': 'google@mail.com', 'expo_token': 'token'})
+
+    # sqlite selects the rows of each table before updating them
+    response = assert_max_queries(5, 'POST', '/change_blocked_status_batch',
+                                  headers=ADMIN_HEADERS, json={
+        'modified_users': ['first@mail.com', 'google@mail.com', 'missing@mail.com',
+                           'first@mail.com'],
+        'is_blocked': True
+    })
+    data = response.json()
+
+    assert data['message'] == 'batch processed'
+    assert data['updated'] == 2
+    assert [(result['email'], result['message']) for result in data['results']] == [
+        ('first@mail.com', 'user updated'),
+        ('google@mail.com', 'user updated'),
+        ('missing@mail.com', 'user does not exist'),
+    ]
+    login_response = client.post('/login/', json={
+        'email': 'first@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    })
+    assert login_response.json()['status'] == 'error'
+    assert client.post('/login/', json={
+        'email': 'second@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    }).json()['status'] == 'ok'
+
+
+def test_create_batch_returns_a_result_per_user(test_db):
+    client.post('/create/', json={
+        'email': 'registered@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    })
+    client.post('/oauth_login', json={'email': 'google@mail.com', 'expo_token': 'token'})
+    users = [
+        {'email': email, 'password': 'secret_password', 'expo_token': 'expo12345token'}
+        for email in ('first@mail.com', 'registered@mail.com', 'google@mail.com',
+                      'first@mail.com', 'second@mail.com')
+    ]
+    users.append({'email': 'empty@mail.com', 'password': '', 'expo_token': 'expo12345token'})
+
+    response = client.post('/create_batch', headers=ADMIN_HEADERS, json={'users': users})
+    data = response.json()
+
+    assert data['message'] == 'batch processed'
+    assert data['created'] == 2
+    assert [result['message'] for result in data['results']] == [
+        'user successfully registered',
+        'user already registered',
+        'has google account',
+        'user already registered',
+        'user successfully registered',
+        'null value received',
+    ]
+    assert len(data['results'][0]['firebase_password']) == 50
+    assert client.post('/login/', json=users[4]).json()['status'] == 'ok'
+
+
+def test_create_batch_from_a_csv_file(test_db):
+    csv_file = ('email,password,expo_token\n'
+                'first@mail.com,secret_password,expo12345token\n'
+                'second@mail.com,secret_password,\n')
+
+    response = client.post('/create_batch_csv', headers=ADMIN_HEADERS,
+                           files={'file': ('users.csv', csv_file, 'text/csv')})
+
+    assert [result['message'] for result in response.json()['results']] == [
+        'user successfully registered',
+        'user successfully registered',
+    ]
+    assert client.post('/login/', json={
+        'email': 'second@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    }).json()['status'] == 'ok'
+
+
+def test_create_batch_from_a_csv_file_fails_without_the_columns(test_db):
+    response = client.post('/create_batch_csv', headers=ADMIN_HEADERS,
+                           files={'file': ('users.csv', 'email\nfirst@mail.com\n', 'text/csv')})
+
+    assert response.json() == public_status_messages.get_message('invalid_csv')
+
+
 def test_user_metrics(test_db):
     client.post(
         '/create/',
@@ -324,13 +939,14 @@ def test_user_metrics(test_db):
 
     client.post(
         '/change_blocked_status',
+        headers=ADMIN_HEADERS,
         json={
             'modified_user': 'test@mail.com',
             'is_blocked': True
         }
     )
 
-    response = client.get('/users_metrics')
+    response = client.get('/users_metrics', headers=ADMIN_HEADERS)
 
     data = response.json()
 
@@ -346,9 +962,91 @@ def test_user_metrics(test_db):
     assert data['last_logged_google_users'] == 1
 
 
-@patch('main.requests.post')
-def test_send_message(mock_expo_api, test_db):
-    mock_expo_api.return_value = MagicMock(status_code=200)
+def test_user_metrics_count_the_last_logins_without_login_events(test_db):
+    user = {'email': 'test@mail.com', 'password': 'secret_password', 'expo_token': 'token'}
+
+    with patch.object(login_event_writer, 'enabled', False):
+        client.post('/create/', json=user)
+        client.post('/login/', json=user)
+        client.post('/oauth_login', json={'email': 'test@gmail.com', 'expo_token': 'token'})
+        data = client.get('/users_metrics', headers=ADMIN_HEADERS).json()
+
+    assert data['last_logged_users'] == 1
+    assert data['last_logged_google_users'] == 1
+
+
+def test_user_metrics_are_updated_without_recomputing_them(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+    client.get('/users_metrics', headers=ADMIN_HEADERS)
+    refreshes = users_metrics_cache.refreshes
+
+    client.post(
+        '/oauth_login',
+        json={
+            'email': 'test2@gmail.com',
+            'expo_token': 'expo12345token'
+        }
+    )
+    for _ in range(2):
+        client.post(
+            '/change_blocked_status',
+            headers=ADMIN_HEADERS,
+            json={
+                'modified_user': 'test@mail.com',
+                'is_blocked': True
+            }
+        )
+
+    data = client.get('/users_metrics', headers=ADMIN_HEADERS).json()
+
+    assert users_metrics_cache.refreshes == refreshes
+    assert data['users_amount'] == 2
+    assert data['blocked_users'] == 1
+    assert data['non_blocked_users'] == 1
+    assert data['last_registered_users'] == 1
+    assert data['last_registered_google_users'] == 1
+    assert data['last_logged_google_users'] == 1
+
+
+def test_login_activity_reads_the_rollups(test_db):
+    for _ in range(2):
+        client.post(
+            '/oauth_login',
+            json={
+                'email': 'test@gmail.com',
+                'expo_token': 'expo12345token'
+            }
+        )
+    with patch.object(login_rollup_worker, 'session_factory', TestingSession):
+        run_in_client_loop(login_rollup_worker.run())
+
+    response = client.get('/login_activity', headers=ADMIN_HEADERS, params={'period': 'day'})
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert response_data['status'] == 'ok'
+    assert len(response_data['login_activity']) == 1
+    assert response_data['login_activity'][0]['account_table'] == 'Google'
+    assert response_data['login_activity'][0]['logins'] == 2
+    assert response_data['login_activity'][0]['logged_users'] == 1
+
+
+def test_login_activity_fails_if_user_is_not_an_admin(test_db):
+    response = client.get('/login_activity')
+
+    assert response.json() == public_status_messages.get_message('not_admin')
+
+
+@patch('main.push_client.enqueue')
+def test_send_message(mock_enqueue, test_db):
+    mock_enqueue.return_value = 'message-id'
 
     res = client.post(
         '/create/',
@@ -376,11 +1074,17 @@ def test_send_message(mock_expo_api, test_db):
     assert response.status_code == 200
     assert response_data['status'] == 'ok'
     assert 'message' in response_data
+    assert response_data['message_id'] == 'message-id'
+    mock_enqueue.assert_called_once_with({
+        'to': 'expo12345token',
+        'sound': 'default',
+        'title': 'Message by sender@mail.com',
+        'body': 'this is my first message, how are you?',
+    })
 
 
-@patch('main.requests.post')
-def test_send_message_fails_for_non_existent_receiver(mock_expo_api, test_db):
-    mock_expo_api.return_value = MagicMock(status_code=200)
+@patch('main.push_client.enqueue')
+def test_send_message_fails_for_non_existent_receiver(mock_enqueue, test_db):
     response = client.post(
         '/send_message',
         json={
@@ -396,6 +1100,161 @@ def test_send_message_fails_for_non_existent_receiver(mock_expo_api, test_db):
     assert response.status_code == 200
     assert response_data['status'] == 'error'
     assert response_data['message'] == 'user does not exist'
+    assert not mock_enqueue.called
+
+
+@patch('main.push_client.enqueue')
+def test_send_message_reads_the_buffered_expo_token_once_it_is_written(mock_enqueue, test_db):
+    mock_enqueue.return_value = 'message-id'
+    receiver = {'email': 'receiver@mail.com', 'password': 'secret_password',
+                'expo_token': 'first_token'}
+    message = {
+        'email': 'sender@mail.com',
+        'user_receiver_email': 'receiver@mail.com',
+        'message_body': 'hello'
+    }
+    client.post('/create/', json=receiver)
+
+    with patch.object(login_write_buffer, 'enabled', True):
+        client.post('/send_message', json=message)
+        client.post('/login/', json={**receiver, 'expo_token': 'second_token'})
+        # The login is still buffered, so the account is cached again with its previous token
+        client.post('/send_message', json=message)
+        run_in_client_loop(login_write_buffer.flush())
+        client.post('/send_message', json=message)
+
+    assert [call.args[0]['to'] for call in mock_enqueue.call_args_list] ==\
+        ['first_token', 'first_token', 'second_token']
+
+
+@patch('main.push_client.enqueue')
+def test_send_message_reads_cached_receivers_until_they_change(mock_enqueue, test_db):
+    mock_enqueue.return_value = 'message-id'
+    client.post('/create/', json={
+        'email': 'receiver@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'first_token'
+    })
+    message = {
+        'email': 'sender@mail.com',
+        'user_receiver_email': 'receiver@mail.com',
+        'message_body': 'hello'
+    }
+
+    assert_max_queries(1, 'POST', '/send_message', json=message)
+    assert_max_queries(0, 'POST', '/send_message', json=message)
+    client.post('/login/', json={
+        'email': 'receiver@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'second_token'
+    })
+    client.post('/send_message', json=message)
+    client.post('/log_out', json={'email': 'receiver@mail.com'})
+    response = client.post('/send_message', json=message)
+
+    assert [call.args[0]['to'] for call in mock_enqueue.call_args_list] ==\
+        ['first_token', 'first_token', 'second_token']
+    assert 'message_id' not in response.json()
+    assert account_cache.metrics()['hits'] >= 1
+
+
+@patch('main.push_client.enqueue')
+def test_send_message_keeps_cached_google_receivers_that_log_in_again(mock_enqueue, test_db):
+    mock_enqueue.return_value = 'message-id'
+    google_login = {'email': 'receiver@gmail.com', 'expo_token': 'first_token'}
+    message = {
+        'email': 'sender@mail.com',
+        'user_receiver_email': 'receiver@gmail.com',
+        'message_body': 'hello'
+    }
+    client.post('/oauth_login', json=google_login)
+    client.post('/send_message', json=message)
+
+    client.post('/oauth_login', json=google_login)
+    assert_max_queries(0, 'POST', '/send_message', json=message)
+    client.post('/oauth_login', json={**google_login, 'expo_token': 'second_token'})
+    client.post('/send_message', json=message)
+
+    assert [call.args[0]['to'] for call in mock_enqueue.call_args_list] ==\
+        ['first_token', 'first_token', 'second_token']
+
+
+def test_broadcast_message_sends_to_the_listed_users(test_db):
+    fake_expo = start_fake_expo()
+    for i, token in enumerate(('first_token', 'first_token', 'second_token')):
+        client.post('/create/', json={
+            'email': f'user{i}@mail.com',
+            'password': 'secret_password',
+            'expo_token': token
+        })
+
+    user_headers = {
+        'Authorization': f"Bearer {create_tokens('teacher@mail.com', USER_ROLE)['access_token']}"
+    }
+
+    with patch.object(push_broadcaster, 'client', ExpoPushClient(url=fake_expo.url)):
+        response = client.post('/broadcast_message', headers=user_headers, json={
+            'email': 'teacher@mail.com',
+            'message_body': 'the class is cancelled',
+            'user_receiver_emails': ['user0@mail.com', 'user1@mail.com', 'user2@mail.com',
+                                     'missing@mail.com']
+        })
+        job_id = response.json()['job_id']
+        run_in_client_loop(push_broadcaster.tasks[job_id])
+        run_in_client_loop(push_broadcaster.client.close())
+    fake_expo.shutdown()
+    job_data = client.get(f'/broadcast_job/{job_id}').json()
+
+    assert response.json()['message'] == 'broadcast started'
+    assert job_data['message'] == 'got broadcast job'
+    assert job_data['job_status'] == 'done'
+    assert (job_data['receivers'], job_data['tokens'], job_data['sent']) == (4, 2, 2)
+    assert fake_expo.received_messages == 2
+
+
+def test_broadcast_message_requires_an_access_token(test_db):
+    message = {
+        'email': 'teacher@mail.com',
+        'message_body': 'the class is cancelled',
+        'user_receiver_emails': ['user0@mail.com']
+    }
+
+    for headers in ({}, {'Authorization': 'Bearer invalid_token'}):
+        response = client.post('/broadcast_message', headers=headers, json=message)
+
+        assert response.json() == public_status_messages.get_message('invalid_token')
+
+
+def test_broadcast_message_fails_if_the_sender_is_not_the_owner_of_the_token(test_db):
+    user_headers = {
+        'Authorization': f"Bearer {create_tokens('student@mail.com', USER_ROLE)['access_token']}"
+    }
+    response = client.post('/broadcast_message', headers=user_headers, json={
+        'email': 'teacher@mail.com',
+        'message_body': 'the class is cancelled',
+        'user_receiver_emails': ['user0@mail.com']
+    })
+
+    assert response.status_code == 403
+    assert response.json() == public_status_messages.get_message('sender_is_not_token_owner')
+
+
+def test_broadcast_message_to_every_user_requires_an_admin(test_db):
+    user_headers = {
+        'Authorization': f"Bearer {create_tokens('teacher@mail.com', USER_ROLE)['access_token']}"
+    }
+    response = client.post('/broadcast_message', headers=user_headers, json={
+        'email': 'teacher@mail.com',
+        'message_body': 'the class is cancelled'
+    })
+
+    assert response.json() == public_status_messages.get_message('not_admin')
+
+
+def test_broadcast_job_fails_for_unknown_job(test_db):
+    response = client.get('/broadcast_job/unknown')
+
+    assert response.json() == public_status_messages.get_message('broadcast_job_does_not_exist')
 
 
 def test_log_out(test_db):
@@ -454,4 +1313,114 @@ def test_log_out_for_google_user(test_db):
     assert data['message'] == 'successful logout'
 
 
+def test_metrics_report_latency_per_route_and_stage(test_db):
+    client.post(
+        '/create/',
+        json={
+            'email': 'test@mail.com',
+            'password': 'secret_password',
+            'expo_token': 'expo12345token'
+        }
+    )
+
+    response = client.get('/metrics')
+    metrics = response.text
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'http_requests_total{method="POST",route="/create/",status="200"}' in metrics
+    assert 'http_request_duration_seconds_count{method="POST",route="/create/"}' in metrics
+    assert 'http_request_stage_duration_seconds_count{method="POST",route="/create/",' \
+           'stage="database"}' in metrics
+    assert 'http_request_stage_duration_seconds_count{method="POST",route="/create/",' \
+           'stage="password_hashing"}' in metrics
+    assert 'password_hashing_duration_seconds_count{operation="hash"}' in metrics
+
+
+def test_handlers_run_a_bounded_amount_of_queries(test_db):
+    assert_max_queries(2, 'POST', '/create/', json={
+        'email': 'test@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    })
+    assert_max_queries(2, 'POST', '/login/', json={
+        'email': 'test@mail.com',
+        'password': 'secret_password',
+        'expo_token': 'expo12345token'
+    })
+    assert_max_queries(2, 'POST', '/oauth_login', json={
+        'email': 'test@gmail.com',
+        'expo_token': 'expo12345token'
+    })
+    assert_max_queries(2, 'POST', '/oauth_login', json={
+        'email': 'test@gmail.com',
+        'expo_token': 'expo12345token'
+    })
+    for _ in range(2):
+        assert_max_queries(3, 'POST', '/change_blocked_status', headers=ADMIN_HEADERS, json={
+            'modified_user': 'test@gmail.com',
+            'is_blocked': True
+        })
+    assert_max_queries(3, 'POST', '/oauth_login', json={
+        'email': 'test@gmail.com',
+        'expo_token': 'expo12345token'
+    })
+    assert_max_queries(3, 'POST', '/oauth_login', json={
+        'email': 'test@mail.com',
+        'expo_token': 'expo12345token'
+    })
+    assert_max_queries(2, 'POST', '/log_out', json={'email': 'test@gmail.com'})
+    assert_max_queries(1, 'GET', '/users_list/true', headers=ADMIN_HEADERS)
+    response = assert_max_queries(3, 'GET', '/users_metrics', headers=ADMIN_HEADERS)
+
+    assert response.json()['users_amount'] == 2
+    assert float(response.headers['x-db-time-ms']) > 0
+
+
+def test_database_pool_status(test_db):
+    response = client.get('/database_pool_status')
+
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data['status'] == 'ok'
+    assert 'sync' in data['pools']
+
+
+def test_read_only_endpoints_use_the_read_replica(test_db):
+    create_users_for_list()
+    replica_engine = create_engine(SQLITE_REPLICA_URL, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=replica_engine)
+    with replica_engine.begin() as connection:
+        connection.execute(Google.__table__.insert(), [{
+            'email': 'replica@gmail.com',
+            'firebase_password': 'password',
+            'is_blocked': False,
+            'registration_date': datetime.now(),
+            'last_login_date': datetime.now(),
+        }])
+    replica_sessions = sessionmaker(expire_on_commit=False, class_=AsyncSession,
+                                    bind=create_async_engine(get_async_url(SQLITE_REPLICA_URL)))
+
+    try:
+        with patch.object(read_replica, 'read_session_factory', replica_sessions),\
+                patch.object(read_replica, 'next_check', 0),\
+                patch.object(read_replica, 'available', False):
+            replica_data = client.get('/users_list/true', headers=ADMIN_HEADERS).json()
+            message_data = client.post('/send_message', json={
+                'email': 'a@mail.com',
+                'user_receiver_email': 'a@mail.com',
+                'message_body': 'hello'
+            }).json()
+    finally:
+        replica_engine.dispose()
+        os.remove(SQLITE_REPLICA_FILE)
+
+    primary_data = client.get('/users_list/true', headers=ADMIN_HEADERS).json()
+    assert [user['email'] for user in replica_data['users']] == ['replica@gmail.com']
+    # The receivers are read from the primary, since they are cached
+    assert message_data['status'] == 'ok'
+    assert len(primary_data['users']) == 5
+
+
 app.dependency_overrides = {}
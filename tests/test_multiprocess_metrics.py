@@ -0,0 +1,49 @@
+import os
+import json
+import time
+import asyncio
+
+from utils.prometheus_registry import MetricsRegistry
+from utils.multiprocess_metrics import MultiprocessMetrics, clear_metrics_directory,\
+    metrics_file_path
+
+
+def new_registry(requests):
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'Amount of requests').inc(amount=requests)
+    registry.gauge('queue_depth', 'Queued operations', lambda: requests)
+    return registry
+
+
+def test_metrics_of_every_worker_are_rendered(tmp_path):
+    metrics = MultiprocessMetrics(new_registry(1), str(tmp_path), interval=60)
+    for pid, requests in ((1, 2), (2, 4)):
+        with open(metrics_file_path(str(tmp_path), pid), 'w') as metrics_file:
+            json.dump(new_registry(requests).snapshot(), metrics_file)
+    # The gauges of the worker that stopped writing its metrics are ignored
+    stale_date = time.time() - 1000
+    os.utime(metrics_file_path(str(tmp_path), 2), (stale_date, stale_date))
+
+    lines = metrics.render().splitlines()
+
+    assert 'requests_total 7' in lines
+    assert 'queue_depth 3' in lines
+
+
+def test_metrics_are_written_until_the_worker_is_closed(tmp_path):
+    metrics = MultiprocessMetrics(new_registry(1), str(tmp_path), interval=60)
+    path = metrics_file_path(str(tmp_path), os.getpid())
+
+    async def start_and_close():
+        metrics.start()
+        await asyncio.sleep(0.1)
+        with open(path) as metrics_file:
+            written_metrics = json.load(metrics_file)
+        await metrics.close()
+        return written_metrics
+
+    assert set(asyncio.run(start_and_close())) == {'requests_total', 'queue_depth'}
+    with open(path) as metrics_file:
+        assert set(json.load(metrics_file)) == {'requests_total'}
+    clear_metrics_directory(str(tmp_path))
+    assert os.listdir(tmp_path) == []
@@ -1,12 +1,48 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pytest import fixture
 from unittest.mock import patch, MagicMock
 from utils.newrelic_logger import NewrelicLogger
 
 
+class FakeLogApiHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((self.headers['Api-Key'], json.loads(body)))
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, *_args):
+        pass
+
+
+@fixture()
+def fake_log_api():
+    server = HTTPServer(('127.0.0.1', 0), FakeLogApiHandler)
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def sent_messages(mock_newrelic_api):
+    messages = []
+    for call in mock_newrelic_api.call_args_list:
+        for log in call.kwargs['json'][0]['logs']:
+            messages.append(log['message'])
+    return messages
+
+
 @patch('utils.newrelic_logger.requests.post')
 def test_info_log(mock_newrelic_api):
     mock_newrelic_api.return_value = MagicMock(status_code=200)
     logger = NewrelicLogger('newrelic-api-key')
     logger.info('This is an INFO level log')
+    logger.close()
+    assert sent_messages(mock_newrelic_api) == ['[INFO]: This is an INFO level log']
 
 
 @patch('utils.newrelic_logger.requests.post')
@@ -14,6 +50,8 @@ def test_debug_log(mock_newrelic_api):
     mock_newrelic_api.return_value = MagicMock(status_code=200)
     logger = NewrelicLogger('newrelic-api-key')
     logger.debug('This is an DEBUG level log')
+    logger.close()
+    assert not mock_newrelic_api.called
 
 
 @patch('utils.newrelic_logger.requests.post')
@@ -21,6 +59,8 @@ def test_warning_log(mock_newrelic_api):
     mock_newrelic_api.return_value = MagicMock(status_code=200)
     logger = NewrelicLogger('newrelic-api-key')
     logger.warning('This is an WARNING level log')
+    logger.close()
+    assert sent_messages(mock_newrelic_api) == ['[WARNING]: This is an WARNING level log']
 
 
 @patch('utils.newrelic_logger.requests.post')
@@ -28,3 +68,36 @@ def test_error_log(mock_newrelic_api):
     mock_newrelic_api.return_value = MagicMock(status_code=200)
     logger = NewrelicLogger('newrelic-api-key')
     logger.error('This is an ERROR level log')
+    logger.close()
+    assert sent_messages(mock_newrelic_api) == ['[ERROR]: This is an ERROR level log']
+
+
+def test_logs_are_sent_in_batches(fake_log_api):
+    api_url = f'http://127.0.0.1:{fake_log_api.server_port}/log/v1'
+    logger = NewrelicLogger('newrelic-api-key', api_url=api_url, batch_size=3,
+                            flush_interval=60)
+    for i in range(7):
+        logger.info(f'message {i}')
+    logger.close()
+
+    batch_sizes = [len(payload[0]['logs']) for _, payload in fake_log_api.received]
+    assert batch_sizes == [3, 3, 1]
+    assert all(api_key == 'newrelic-api-key' for api_key, _ in fake_log_api.received)
+    messages = [log['message'] for _, payload in fake_log_api.received
+                for log in payload[0]['logs']]
+    assert messages == [f'[INFO]: message {i}' for i in range(7)]
+    assert logger.failed_batches == 0
+
+
+@patch('utils.newrelic_logger.requests.post')
+def test_logs_are_dropped_when_the_queue_is_full(mock_newrelic_api):
+    sending = threading.Event()
+    mock_newrelic_api.side_effect = lambda *_args, **_kwargs: sending.wait() and\
+        MagicMock(status_code=200)
+    logger = NewrelicLogger('newrelic-api-key', batch_size=1, max_queue_size=2)
+    for i in range(10):
+        logger.info(f'message {i}')
+    assert logger.dropped_messages > 0
+    sending.set()
+    logger.close()
+    assert len(sent_messages(mock_newrelic_api)) + logger.dropped_messages == 10
@@ -0,0 +1,62 @@
+import asyncio
+
+from utils.password_hasher import PasswordHasher, build_crypt_context
+from server_exceptions.hashing_queue_full import HashingQueueFullException
+
+
+def test_hash_can_be_verified():
+    hasher = PasswordHasher(2, 10)
+
+    async def hash_and_verify():
+        hashed_password = await hasher.hash('secret_password')
+        return (await hasher.verify('secret_password', hashed_password),
+                await hasher.verify('wrong_password', hashed_password))
+
+    assert asyncio.run(hash_and_verify()) == (True, False)
+    assert hasher.metrics()['in_flight'] == 0
+    hasher.shutdown()
+
+
+def test_hashing_is_rejected_when_the_queue_is_full():
+    hasher = PasswordHasher(1, 1)
+
+    async def hash_many():
+        return await asyncio.gather(
+            *[hasher.hash('secret_password') for _ in range(4)],
+            return_exceptions=True
+        )
+
+    results = asyncio.run(hash_many())
+    rejected = [result for result in results if isinstance(result, HashingQueueFullException)]
+    assert len(rejected) == 2
+    assert hasher.metrics()['rejected'] == 2
+    hasher.shutdown()
+
+
+def test_hash_many_does_not_fill_the_queue():
+    hasher = PasswordHasher(1, 1)
+
+    hashed_passwords = asyncio.run(hasher.hash_many([f'password{i}' for i in range(4)]))
+
+    assert len(hashed_passwords) == 4
+    assert hasher.context.verify('password3', hashed_passwords[3])
+    assert hasher.metrics()['rejected'] == 0
+    hasher.shutdown()
+
+
+def test_hashes_with_other_settings_are_updated_on_verification():
+    old_context = build_crypt_context(['bcrypt'], bcrypt_rounds=4)
+    hasher = PasswordHasher(1, 10, context=build_crypt_context(['pbkdf2_sha256', 'bcrypt'],
+                                                               pbkdf2_rounds=1000))
+    old_hash = old_context.hash('secret_password')
+
+    async def verify():
+        return (await hasher.verify_and_update('secret_password', old_hash),
+                await hasher.verify_and_update('wrong_password', old_hash))
+
+    (is_valid, new_hash), wrong_password_result = asyncio.run(verify())
+    assert is_valid
+    assert new_hash.startswith('$pbkdf2-sha256$1000$')
+    assert wrong_password_result == (False, None)
+    assert asyncio.run(hasher.verify_and_update('secret_password', new_hash)) == (True, None)
+    hasher.shutdown()
@@ -0,0 +1,64 @@
+from utils.prometheus_registry import MetricsRegistry
+
+
+def test_counters_are_rendered_by_label_values():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Amount of requests', ('route', 'status'))
+
+    requests.inc('/login/', '200')
+    requests.inc('/login/', '200')
+    requests.inc('/say "hi"', '500', amount=3)
+
+    assert registry.render() == (
+        '# HELP requests_total Amount of requests\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{route="/login/",status="200"} 2\n'
+        'requests_total{route="/say \\"hi\\"",status="500"} 3\n'
+    )
+
+
+def test_histograms_have_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1))
+
+    latency.observe(0.05, '/')
+    latency.observe(0.1, '/')
+    latency.observe(0.5, '/')
+    latency.observe(2.5, '/')
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{route="/",le="0.1"} 2',
+        'latency_seconds_bucket{route="/",le="1"} 3',
+        'latency_seconds_bucket{route="/",le="+Inf"} 4',
+        'latency_seconds_sum{route="/"} 3.15',
+        'latency_seconds_count{route="/"} 4',
+    ]
+
+
+def test_gauges_are_read_when_rendered():
+    registry = MetricsRegistry()
+    values = [1]
+    registry.gauge('queue_depth', 'Queued operations', lambda: values[-1])
+    values.append(7)
+
+    assert registry.render().splitlines()[-1] == 'queue_depth 7'
+
+
+def test_snapshots_of_other_processes_are_added_up():
+    registry = MetricsRegistry()
+    other_registry = MetricsRegistry()
+    for metrics in (registry, other_registry):
+        metrics.counter('requests_total', 'Amount of requests', ('route',)).inc('/login/')
+        metrics.histogram('latency_seconds', 'Latency', (), buckets=(1,)).observe(0.5)
+        metrics.gauge('queue_depth', 'Queued operations', lambda: 2)
+    other_registry.metrics['requests_total'].inc('/create/')
+
+    lines = registry.render([other_registry.snapshot()]).splitlines()
+
+    assert 'requests_total{route="/login/"} 2' in lines
+    assert 'requests_total{route="/create/"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_sum 1' in lines
+    assert 'queue_depth 4' in lines
+    assert 'queue_depth' not in other_registry.snapshot(include_gauges=False)
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+from main import app, create_app
+from server import server_options, on_starting, UvloopWorker
+from configuration.status_messages import public_status_messages
+
+
+def test_create_app_builds_an_independent_app_with_every_route():
+    new_app = create_app()
+    assert new_app is not app
+    assert {route.path for route in new_app.routes} == {route.path for route in app.routes}
+    response = TestClient(new_app).get('/pong')
+    assert response.json() == public_status_messages.get_message('pong')
+
+
+def test_server_workers_use_uvloop_and_httptools():
+    options = server_options()
+    assert options['worker_class'] is UvloopWorker
+    assert UvloopWorker.CONFIG_KWARGS == {'loop': 'uvloop', 'http': 'httptools'}
+    assert options['workers'] >= 1
+
+
+@patch('server.multiprocessing')
+def test_server_runs_a_single_worker_without_a_jwt_secret_key(mock_multiprocessing):
+    server = SimpleNamespace(num_workers=2, log=Mock())
+    mock_multiprocessing.get_context.return_value.Process.return_value.exitcode = 0
+
+    with patch.dict('os.environ', {'JWT_SECRET_KEY': ''}):
+        on_starting(server)
+
+    assert server.num_workers == 1
+    server.log.warning.assert_called_once()
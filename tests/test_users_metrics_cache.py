@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from utils.users_metrics_cache import SlidingWindowCounter
+
+
+def test_sliding_window_counter_discards_old_events():
+    counter = SlidingWindowCounter(3600, 60)
+    date_now = datetime(2021, 11, 1, 12, 0, 30)
+
+    counter.add(date_now - timedelta(minutes=90))
+    counter.add(date_now - timedelta(minutes=30), 2)
+    counter.add(date_now)
+
+    assert counter.total(date_now) == 3
+    assert counter.total(date_now + timedelta(minutes=31)) == 1
+    assert counter.total(date_now + timedelta(minutes=61)) == 0
+
+
+def test_sliding_window_counter_reuses_buckets():
+    counter = SlidingWindowCounter(3600, 60)
+    date_now = datetime(2021, 11, 1, 12, 0, 30)
+
+    counter.add(date_now)
+    counter.add(date_now + timedelta(hours=1))
+    counter.add(date_now)
+
+    assert counter.total(date_now + timedelta(hours=1)) == 1
@@ -0,0 +1,164 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from database.accounts import find_account
+from utils.request_metrics import metrics_registry
+
+
+# Maximum amount of cached accounts, 0 disables the cache
+ACCOUNT_CACHE_SIZE = int(os.environ.get('ACCOUNT_CACHE_SIZE', 10000))
+# Seconds after which a cached account is read again from the database. It bounds how long other
+# workers, whose caches are not invalidated, can use an outdated account
+ACCOUNT_CACHE_TTL = float(os.environ.get('ACCOUNT_CACHE_TTL', 30))
+
+account_cache_requests = metrics_registry.counter(
+    'account_cache_requests_total', 'Account lookups by whether they were cached', ('result',))
+account_cache_evictions = metrics_registry.counter(
+    'account_cache_evictions_total', 'Cached accounts removed to make room for others')
+
+
+# Fields of an account that the hot lookups need. It is a tuple so that a shared backend can store
+# it as is
+CachedAccount = namedtuple('CachedAccount', ['table_name', 'is_blocked', 'expo_token'])
+
+
+# Storage of the account cache. The methods are coroutines so that a backend shared by the
+# workers (eg: a Redis compatible server) can implement them
+class AccountCacheBackend(ABC):
+    @abstractmethod
+    async def get(self, email):
+        pass
+
+    @abstractmethod
+    async def set(self, email, account):
+        pass
+
+    @abstractmethod
+    async def delete(self, email):
+        pass
+
+    @abstractmethod
+    async def clear(self):
+        pass
+
+    @abstractmethod
+    def size(self):
+        pass
+
+
+# Keeps the accounts in the memory of the worker, evicting the least recently used one when it is
+# full. Expired accounts are removed when they are read
+class LocalAccountCacheBackend(AccountCacheBackend):
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, email):
+        entry = self.entries.get(email)
+        if entry is None:
+            return None
+        account, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[email]
+            return None
+        self.entries.move_to_end(email)
+        return account
+
+    async def set(self, email, account):
+        self.entries[email] = (account, time.monotonic() + self.ttl)
+        self.entries.move_to_end(email)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            account_cache_evictions.inc()
+
+    async def delete(self, email):
+        self.entries.pop(email, None)
+
+    async def clear(self):
+        self.entries.clear()
+
+    def size(self):
+        return len(self.entries)
+
+
+# Caches the accounts read by find, which are invalidated by the handlers after they commit a
+# change of the blocked status or the expo token. Accounts that do not exist are not cached. A
+# lookup that was running while its account was invalidated does not fill the cache, since it could
+# have read the account before the change. For the same reason find has to receive a session of the
+# primary database, a replica could still have the account from before the change. The
+# invalidations are only counted for the emails that are being read, in running_lookups, which maps
+# each email to its amount of running lookups and of invalidations received while they run
+class AccountCache:
+    def __init__(self, backend=None, max_size=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL):
+        self.enabled = max_size > 0
+        self.backend = backend or LocalAccountCacheBackend(max_size, ttl)
+        self.running_lookups = {}
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the CachedAccount with the received email or None if it is not registered
+    async def find(self, db, email):
+        if not self.enabled:
+            return self.__cached_account(await find_account(db, email))
+        account = await self.backend.get(email)
+        if account is not None:
+            self.hits += 1
+            account_cache_requests.inc('hit')
+            return account
+        self.misses += 1
+        account_cache_requests.inc('miss')
+        lookups = self.running_lookups.setdefault(email, [0, 0])
+        lookups[0] += 1
+        invalidations = lookups[1]
+        try:
+            account = self.__cached_account(await find_account(db, email))
+        finally:
+            lookups[0] -= 1
+            if lookups[0] == 0:
+                del self.running_lookups[email]
+        if (account is not None) and (invalidations == lookups[1]):
+            await self.backend.set(email, account)
+        return account
+
+    async def invalidate(self, email):
+        lookups = self.running_lookups.get(email)
+        if lookups is not None:
+            lookups[1] += 1
+        if self.enabled:
+            await self.backend.delete(email)
+
+    # Invalidates the account after a login that did not read it, unless it is cached as not blocked
+    # and with the received expo token
+    async def invalidate_if_changed(self, email, expo_token):
+        account = await self.backend.get(email) if self.enabled else None
+        if (account is None) or account.is_blocked or (account.expo_token != expo_token):
+            await self.invalidate(email)
+
+    async def invalidate_many(self, emails):
+        for email in emails:
+            await self.invalidate(email)
+
+    async def clear(self):
+        for lookups in self.running_lookups.values():
+            lookups[1] += 1
+        await self.backend.clear()
+
+    def metrics(self):
+        return {
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': getattr(self.backend, 'evictions', 0),
+        }
+
+    def __cached_account(self, account):
+        if account is None:
+            return None
+        return CachedAccount(account.model.__tablename__, account.is_blocked, account.expo_token)
+
+
+account_cache = AccountCache()
@@ -0,0 +1,198 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+import httpx
+from server_exceptions.push_queue_full import PushQueueFullException
+from utils.logger import logger
+from utils.request_metrics import observe_outbound_request
+
+
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+# Expo accepts up to 100 messages per request
+EXPO_MAX_BATCH_SIZE = 100
+
+PUSH_QUEUE_SIZE = int(os.environ.get('PUSH_QUEUE_SIZE', 10000))
+PUSH_MAX_RETRIES = int(os.environ.get('PUSH_MAX_RETRIES', 3))
+PUSH_RETRY_DELAY = float(os.environ.get('PUSH_RETRY_DELAY', 0.5))
+# Seconds that the first message of a batch waits for more messages before the batch is sent
+PUSH_BATCH_LINGER = float(os.environ.get('PUSH_BATCH_LINGER', 0.05))
+PUSH_MAX_CONCURRENT_REQUESTS = int(os.environ.get('PUSH_MAX_CONCURRENT_REQUESTS', 4))
+PUSH_MAX_TRACKED_TICKETS = int(os.environ.get('PUSH_MAX_TRACKED_TICKETS', 10000))
+PUSH_REQUEST_TIMEOUT = float(os.environ.get('PUSH_REQUEST_TIMEOUT', 10))
+
+QUEUED_STATUS = 'queued'
+ERROR_STATUS = 'error'
+
+
+# Delivers push notifications through Expo's push API. The messages are put in a queue and a
+# background task sends them in batches using a shared HTTP client that keeps its connections
+# alive, retrying with exponential backoff. The ticket that Expo returns for every message is
+# kept, indexed by the id returned by enqueue, until max_tracked_tickets newer tickets are stored.
+# The tickets are only kept in the memory of the worker that enqueued the message, so with several
+# workers their tracking is best-effort: the other workers do not know the message
+class ExpoPushClient:
+    def __init__(self, url=EXPO_PUSH_URL, batch_size=EXPO_MAX_BATCH_SIZE,
+                 max_queue_size=PUSH_QUEUE_SIZE, max_retries=PUSH_MAX_RETRIES,
+                 retry_delay=PUSH_RETRY_DELAY, batch_linger=PUSH_BATCH_LINGER,
+                 max_concurrent_requests=PUSH_MAX_CONCURRENT_REQUESTS,
+                 max_tracked_tickets=PUSH_MAX_TRACKED_TICKETS):
+        self.url = url
+        self.batch_size = min(batch_size, EXPO_MAX_BATCH_SIZE)
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.batch_linger = batch_linger
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_tracked_tickets = max_tracked_tickets
+        self.tickets = OrderedDict()
+        self.sent_messages = 0
+        self.failed_messages = 0
+        self.loop = None
+        self.queue = None
+        self.worker = None
+        self.http_client = None
+        self.requests_semaphore = None
+        self.pending_batches = set()
+
+    # Adds the message to the delivery queue and returns the id that identifies its ticket,
+    # without waiting for it to be sent
+    def enqueue(self, message):
+        self.__start()
+        message_id = uuid.uuid4().hex
+        try:
+            self.queue.put_nowait((message_id, message))
+        except asyncio.QueueFull:
+            logger.warning("Push notifications queue is full, rejecting message")
+            raise PushQueueFullException
+        self.__track(message_id, {'status': QUEUED_STATUS})
+        return message_id
+
+    # Sends a batch of up to batch_size messages right away, without queueing them, and returns a
+    # ticket per message. The request counts towards the limit of concurrent requests to Expo
+    async def send(self, messages):
+        self.__start()
+        async with self.requests_semaphore:
+            tickets = await self.__post_with_retries(messages)
+        failed = sum(1 for ticket in tickets if ticket.get('status') == ERROR_STATUS)
+        self.failed_messages += failed
+        self.sent_messages += len(tickets) - failed
+        return tickets
+
+    # Returns the ticket of the message, which has the status queued until it is sent to Expo
+    def get_ticket(self, message_id):
+        return self.tickets.get(message_id)
+
+    def metrics(self):
+        return {
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'sending_batches': len(self.pending_batches),
+            'sent': self.sent_messages,
+            'failed': self.failed_messages,
+        }
+
+    # Sends the messages that are still queued and closes the HTTP client
+    async def close(self):
+        if self.worker is None or self.loop is not asyncio.get_running_loop():
+            return
+        await self.queue.join()
+        self.worker.cancel()
+        await asyncio.gather(self.worker, *self.pending_batches, return_exceptions=True)
+        await self.http_client.aclose()
+        self.worker = None
+
+    # The client is bound to the event loop in which it is first used, it is created again if it
+    # is used from another loop (eg: in the tests)
+    def __start(self):
+        loop = asyncio.get_running_loop()
+        if self.worker is not None and not self.worker.done() and self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.requests_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self.pending_batches = set()
+        self.http_client = httpx.AsyncClient(
+            timeout=PUSH_REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=self.max_concurrent_requests)
+        )
+        self.worker = loop.create_task(self.__deliver_messages())
+
+    def __track(self, message_id, ticket):
+        self.tickets[message_id] = ticket
+        self.tickets.move_to_end(message_id)
+        while len(self.tickets) > self.max_tracked_tickets:
+            self.tickets.popitem(last=False)
+
+    # Groups the queued messages in batches of up to batch_size messages and sends them, with up to
+    # max_concurrent_requests batches being sent at the same time
+    async def __deliver_messages(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + self.batch_linger
+            while len(batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.requests_semaphore.acquire()
+            sending_batch = self.loop.create_task(self.__send_batch(batch))
+            self.pending_batches.add(sending_batch)
+            sending_batch.add_done_callback(self.pending_batches.discard)
+
+    async def __send_batch(self, batch):
+        try:
+            tickets = await self.__post_with_retries([message for _, message in batch])
+            for (message_id, _), ticket in zip(batch, tickets):
+                self.__track(message_id, ticket)
+                if ticket.get('status') == ERROR_STATUS:
+                    self.failed_messages += 1
+                    logger.warning(f"Expo rejected push notification: {ticket}")
+                else:
+                    self.sent_messages += 1
+        finally:
+            self.requests_semaphore.release()
+            for _ in batch:
+                self.queue.task_done()
+
+    # Returns a ticket per message, if the batch could not be sent every ticket has the error
+    async def __post_with_retries(self, messages):
+        retry_delay = self.retry_delay
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+            start = time.perf_counter()
+            try:
+                response = await self.http_client.post(self.url, json=messages)
+            except httpx.HTTPError as e:
+                observe_outbound_request('expo', 'error', time.perf_counter() - start)
+                error = f'{type(e).__name__}: {e}'
+                continue
+            observe_outbound_request('expo', response.status_code, time.perf_counter() - start)
+            logger.info(f"Expo messaging response status code: {response.status_code}")
+            # Too many requests and server errors may succeed if they are retried
+            if response.status_code == 429 or response.status_code >= 500:
+                error = f'expo API responded with status code {response.status_code}'
+                continue
+            if response.status_code != 200:
+                error = f'expo API responded with status code {response.status_code}'
+                break
+            try:
+                tickets = response.json().get('data', [])
+            except ValueError:
+                error = 'expo API response is not valid json'
+                break
+            if len(tickets) == len(messages):
+                return tickets
+            error = 'expo API did not return a ticket for every message'
+            break
+        logger.warning(f"Error sending push notifications: {error}")
+        return [{'status': ERROR_STATUS, 'message': error} for _ in messages]
+
+
+push_client = ExpoPushClient()
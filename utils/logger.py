@@ -22,5 +22,10 @@ class Logger:
     def debug(self, message):
         self.logger.debug(message)
 
+    # Sends the messages that are still buffered, if the logger buffers them
+    def close(self):
+        if isinstance(self.logger, NewrelicLogger):
+            self.logger.close()
+
 
 logger = Logger(os.environ.get('NEWRELIC_API_KEY'))
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from utils.logger import logger
+from utils.request_metrics import metrics_registry, in_flight_requests
+
+
+LOOP_MONITOR = os.environ.get('LOOP_MONITOR', 'false').lower() == 'true'
+# Seconds between the measurements of the scheduling delay of the loop
+LOOP_MONITOR_INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', 0.1))
+# The loop is reported as blocked when it does not run the monitor for this amount of milliseconds
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', 100))
+# Amount of the last measurements used to compute the lag percentiles
+LOOP_LAG_SAMPLES = int(os.environ.get('LOOP_LAG_SAMPLES', 600))
+LAG_PERCENTILES = (50, 95, 99)
+
+event_loop_lag = metrics_registry.histogram(
+    'event_loop_lag_seconds', 'Delay between the scheduled and the actual run of a timer')
+event_loop_blocks = metrics_registry.counter(
+    'event_loop_blocks_total', 'Times that the event loop was blocked longer than the threshold')
+
+
+# Measures how late the event loop runs a timer that is scheduled every interval seconds, which is
+# the time that the loop was busy running other code. A watchdog thread checks that the timer keeps
+# running, and when the loop is blocked longer than the threshold it logs the stack of the loop's
+# thread and the requests that were being handled, once per block. The task only wakes up every
+# interval seconds, so its overhead is independent of the amount of requests
+class LoopLagMonitor:
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold_ms=LOOP_BLOCK_THRESHOLD_MS,
+                 samples=LOOP_LAG_SAMPLES):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.lags = deque(maxlen=samples)
+        self.blocks = 0
+        self.heartbeat = None
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.task.get_loop() is loop:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        self.task = loop.create_task(self.__measure_lag())
+        if self.watchdog is None or not self.watchdog.is_alive():
+            self.watchdog = threading.Thread(target=self.__watch, name='loop_watchdog',
+                                             daemon=True)
+            self.watchdog.start()
+
+    async def close(self):
+        self.stopped.set()
+        if self.task is not None and self.task.get_loop() is asyncio.get_running_loop():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    # Returns the percentiles of the last lags in seconds, indexed by percentile
+    def percentiles(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {percentile: 0 for percentile in LAG_PERCENTILES}
+        return {
+            percentile: lags[min(len(lags) - 1, len(lags) * percentile // 100)]
+            for percentile in LAG_PERCENTILES
+        }
+
+    async def __measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0, loop.time() - scheduled)
+            self.heartbeat = time.monotonic()
+            self.lags.append(lag)
+            event_loop_lag.observe(lag)
+
+    def __watch(self):
+        reported_heartbeat = None
+        while not self.stopped.wait(self.threshold / 2):
+            task = self.task
+            if task is None or task.done():
+                continue
+            heartbeat = self.heartbeat
+            blocked_time = time.monotonic() - heartbeat - self.interval
+            if blocked_time < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            self.blocks += 1
+            event_loop_blocks.inc()
+            self.__report_block(blocked_time)
+
+    def __report_block(self, blocked_time):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else 'unavailable'
+        requests = [f'{method} {path}' for method, path in list(in_flight_requests.values())]
+        logger.warning(f"Event loop blocked for more than {blocked_time * 1000:.0f} ms while "
+                       f"handling {requests or 'no requests'}, loop thread stack:\n{stack}")
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+for lag_percentile in LAG_PERCENTILES:
+    metrics_registry.gauge(
+        f'event_loop_lag_p{lag_percentile}_seconds',
+        f'Percentile {lag_percentile} of the last event loop lags',
+        lambda percentile=lag_percentile: loop_lag_monitor.percentiles()[percentile])
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import asyncio
+from utils.logger import logger
+from utils.request_metrics import metrics_registry
+
+
+# Directory in which every server worker writes its metrics, so that the worker that answers a
+# scrape can add up the metrics of all of them. The metrics are only the ones of the worker that
+# answers if it is not set
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+# Seconds between the writes of the metrics of a worker
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 5))
+# The gauges of a worker whose file was not written during this amount of intervals are ignored,
+# since the worker is not running anymore. Its counters and histograms are still added up
+STALE_INTERVALS = 3
+
+FILE_PREFIX = 'metrics_'
+FILE_SUFFIX = '.json'
+
+
+def metrics_file_path(directory, pid):
+    return os.path.join(directory, f'{FILE_PREFIX}{pid}{FILE_SUFFIX}')
+
+
+# Removes the files of the metrics of the workers of a previous run, whose counters would be added
+# to the ones of the new workers
+def clear_metrics_directory(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith(FILE_PREFIX):
+            os.remove(os.path.join(directory, name))
+
+
+# Writes the metrics of this process to its file in the directory every interval seconds, and
+# renders them added to the ones that the other processes wrote. The file is replaced atomically
+# so that the other processes never read it partially written
+class MultiprocessMetrics:
+    def __init__(self, registry=metrics_registry, directory=PROMETHEUS_MULTIPROC_DIR,
+                 interval=METRICS_WRITE_INTERVAL):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if self.directory is None:
+            return
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.task.get_loop() is loop:
+            return
+        self.task = loop.create_task(self.__write_periodically())
+
+    # The gauges of this process are removed from its file, its counters keep being added up
+    async def close(self):
+        if self.task is not None and self.task.get_loop() is asyncio.get_running_loop():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.write(include_gauges=False)
+        self.task = None
+
+    def write(self, include_gauges=True):
+        self.__write_snapshot(self.registry.snapshot(include_gauges))
+
+    def render(self):
+        if self.directory is None:
+            return self.registry.render()
+        return self.registry.render(self.__read_other_processes())
+
+    def __read_other_processes(self):
+        own_path = metrics_file_path(self.directory, os.getpid())
+        stale_before = time.time() - STALE_INTERVALS * self.interval
+        snapshots = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if (not name.startswith(FILE_PREFIX)) or (not name.endswith(FILE_SUFFIX)) or\
+                    (path == own_path):
+                continue
+            try:
+                modified_at = os.path.getmtime(path)
+                with open(path) as metrics_file:
+                    snapshot = json.load(metrics_file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Error reading the metrics of another worker from {name}: {e}")
+                continue
+            if modified_at < stale_before:
+                snapshot = {metric_name: values for metric_name, values in snapshot.items()
+                            if metric_name in self.registry.metrics and
+                            self.registry.metrics[metric_name].metric_type != 'gauge'}
+            snapshots.append(snapshot)
+        return snapshots
+
+    async def __write_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # The values are read in the loop, only the file is written in another thread
+                snapshot = self.registry.snapshot()
+                await loop.run_in_executor(None, self.__write_snapshot, snapshot)
+            except Exception as e:
+                logger.warning(f"Error writing the metrics of the worker: {e}")
+            await asyncio.sleep(self.interval)
+
+    def __write_snapshot(self, snapshot):
+        path = metrics_file_path(self.directory, os.getpid())
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as metrics_file:
+            json.dump(snapshot, metrics_file)
+        os.replace(temporary_path, path)
+
+
+multiprocess_metrics = MultiprocessMetrics()
@@ -1,12 +1,38 @@
+import os
+import time
+import queue
+import atexit
+import threading
 import requests
+from utils.request_metrics import observe_outbound_request
 
 
 API_URL = 'https://log-api.newrelic.com/log/v1'
 
+BATCH_SIZE = int(os.environ.get('NEWRELIC_LOG_BATCH_SIZE', 100))
+# Maximum amount of seconds that a message waits in the buffer before being sent
+FLUSH_INTERVAL = float(os.environ.get('NEWRELIC_LOG_FLUSH_INTERVAL', 1))
+MAX_QUEUE_SIZE = int(os.environ.get('NEWRELIC_LOG_QUEUE_SIZE', 10000))
+REQUEST_TIMEOUT = 5
 
+
+# Buffers the log messages in a bounded queue that is drained by a background thread, which
+# sends them in batches to NewRelic's log API so that logging never waits for an HTTP request.
+# If the queue is full the message is dropped and counted in dropped_messages
 class NewrelicLogger:
-    def __init__(self, api_key):
+    def __init__(self, api_key, api_url=API_URL, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_queue_size=MAX_QUEUE_SIZE):
         self.api_key = api_key
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped_messages = 0
+        self.failed_batches = 0
+        self.shipper = None
+        self.shipper_lock = threading.Lock()
+        self.closed = False
+        atexit.register(self.close)
 
     def info(self, message):
         info_message = f'[INFO]: {message}'
@@ -23,14 +49,87 @@ class NewrelicLogger:
     def debug(self, _message):
         pass
 
+    # Sends the buffered messages and stops the background thread, the messages logged after
+    # closing the logger are discarded
+    def close(self):
+        with self.shipper_lock:
+            if self.closed:
+                return
+            self.closed = True
+            shipper = self.shipper
+        if shipper is not None:
+            self.queue.put(None)
+            shipper.join()
+
     def __forward_log(self, message):
-        payload = {
+        if self.closed:
+            return
+        self.__start_shipper()
+        log = {
+            'timestamp': int(time.time() * 1000),
             'message': message,
         }
+        try:
+            self.queue.put_nowait(log)
+        except queue.Full:
+            self.dropped_messages += 1
+
+    def __start_shipper(self):
+        if self.shipper is not None:
+            return
+        with self.shipper_lock:
+            if self.shipper is None and not self.closed:
+                self.shipper = threading.Thread(
+                    target=self.__ship_logs,
+                    name='newrelic_logger',
+                    daemon=True
+                )
+                self.shipper.start()
+
+    # Groups the messages until the batch is full or the oldest message waited flush_interval
+    # seconds. A None in the queue indicates that the logger was closed
+    def __ship_logs(self):
+        is_closed = False
+        while not is_closed:
+            log = self.queue.get()
+            if log is None:
+                break
+            batch = [log]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    log = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if log is None:
+                    is_closed = True
+                    break
+                batch.append(log)
+            self.__send_batch(batch)
+
+    def __send_batch(self, batch):
+        payload = [{
+            'logs': batch,
+        }]
 
         headers = {
             'Api-Key': self.api_key,
             'Content-Type': 'application/json'
         }
 
-        requests.post(API_URL, json=payload, headers=headers)
+        # Any error is caught so that the background thread keeps running
+        start = time.perf_counter()
+        try:
+            response = requests.post(self.api_url, json=payload, headers=headers,
+                                     timeout=REQUEST_TIMEOUT)
+        except Exception:
+            observe_outbound_request('newrelic', 'error', time.perf_counter() - start)
+            self.failed_batches += 1
+        else:
+            observe_outbound_request('newrelic', response.status_code,
+                                     time.perf_counter() - start)
+            if response.status_code >= 300:
+                self.failed_batches += 1
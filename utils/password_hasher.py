@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from server_exceptions.hashing_queue_full import HashingQueueFullException
+from utils.logger import logger
+from utils.request_metrics import observe_password_hashing
+
+
+DEFAULT_QUEUE_LIMIT = 256
+
+# The first scheme is used for the new hashes, the hashes of the other schemes are still verified
+# and are replaced when their users log in
+PASSWORD_HASH_SCHEMES = os.environ.get('PASSWORD_HASH_SCHEMES',
+                                       'pbkdf2_sha256,bcrypt').split(',')
+PBKDF2_ROUNDS = int(os.environ.get('PBKDF2_ROUNDS', 29000))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+
+# Returns a CryptContext that considers outdated the hashes of schemes other than the first one
+# and the hashes with a different amount of rounds than the configured one
+def build_crypt_context(schemes=PASSWORD_HASH_SCHEMES, pbkdf2_rounds=PBKDF2_ROUNDS,
+                        bcrypt_rounds=BCRYPT_ROUNDS):
+    settings = {}
+    for scheme, rounds in (('pbkdf2_sha256', pbkdf2_rounds), ('bcrypt', bcrypt_rounds)):
+        for setting in ('default_rounds', 'min_rounds', 'max_rounds'):
+            settings[f'{scheme}__{setting}'] = rounds
+    return CryptContext(schemes=schemes, deprecated='auto', **settings)
+
+
+crypt_context = build_crypt_context()
+
+
+# Returns the result of the function and the seconds that it took
+def timed_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# Runs the password hashing and verification in a bounded pool of worker threads so that the
+# event loop is not blocked while they are computed. Threads are enough because hashlib and
+# bcrypt release the GIL while they compute the hashes, so the workers run in parallel in
+# different cores
+class PasswordHasher:
+    def __init__(self, max_workers, queue_limit, context=crypt_context):
+        self.context = context
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.rejected = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='password_hasher'
+        )
+
+    async def hash(self, password):
+        return await self.__run('hash', self.context.hash, password)
+
+    # Hashes the passwords in parallel, with at most max_workers of them in the pool at the same
+    # time so that a batch does not fill the queue that the logins use
+    async def hash_many(self, passwords):
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def hash_password(password):
+            async with semaphore:
+                return await self.hash(password)
+
+        return await asyncio.gather(*[hash_password(password) for password in passwords])
+
+    async def verify(self, password, hashed_password):
+        return await self.__run('verify', self.context.verify, password, hashed_password)
+
+    # Returns if the password is correct and, if the hash is outdated, the new hash of the password
+    # that should replace it, otherwise the new hash is None
+    async def verify_and_update(self, password, hashed_password):
+        return await self.__run('verify', self.context.verify_and_update, password,
+                                hashed_password)
+
+    # Amount of operations that are waiting for a free worker
+    def queue_depth(self):
+        return max(0, self.in_flight - self.max_workers)
+
+    def metrics(self):
+        return {
+            'max_workers': self.max_workers,
+            'queue_limit': self.queue_limit,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth(),
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    # The time that the function takes in the worker is recorded in the request metrics, without
+    # the time that it waited for a free worker
+    async def __run(self, operation, function, *args):
+        if self.queue_depth() >= self.queue_limit:
+            self.rejected += 1
+            logger.warning(f"Password hashing queue is full, rejecting request: {self.metrics()}")
+            raise HashingQueueFullException
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, seconds = await loop.run_in_executor(self.executor, timed_call, function,
+                                                         *args)
+            observe_password_hashing(operation, seconds)
+            return result
+        finally:
+            self.in_flight -= 1
+
+
+password_hasher = PasswordHasher(
+    int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1)),
+    int(os.environ.get('PASSWORD_HASHING_QUEUE_LIMIT', DEFAULT_QUEUE_LIMIT))
+)
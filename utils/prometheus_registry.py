@@ -0,0 +1,191 @@
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labelnames, labelvalues, extra_labels=()):
+    labels = [f'{name}="{escape_label_value(value)}"'
+              for name, value in (*zip(labelnames, labelvalues), *extra_labels)]
+    if not labels:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# Base of the metrics, which keep a value per combination of label values. The values can be
+# updated from any thread
+class Metric(ABC):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    # Renders the received values, indexed by label values, or the current ones if it is None
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self.samples(self.current_values() if values is None else values))
+        return lines
+
+    @abstractmethod
+    def current_values(self):
+        pass
+
+    @abstractmethod
+    def samples(self, values):
+        pass
+
+    # Adds the values of another process to the received ones
+    def merge(self, values, other_values):
+        merged = dict(values)
+        for labelvalues, value in other_values.items():
+            merged[labelvalues] = merged.get(labelvalues, 0) + value
+        return merged
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def current_values(self):
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self, values):
+        return [f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}'
+                for labelvalues, value in values.items()]
+
+
+# Its value is read when the metrics are rendered by calling function, which receives no arguments
+class CallbackGauge(Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def current_values(self):
+        return {(): self.function()}
+
+    def samples(self, values):
+        return [f'{self.name} {format_value(value)}' for value in values.values()]
+
+
+# Counts the observed values in cumulative buckets, whose upper bounds are buckets
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, *labelvalues):
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labelvalues)
+            if counts is None:
+                # The last position counts the values greater than every bucket, the other two
+                # keep the sum and the amount of observed values
+                counts = self.values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[bucket] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def current_values(self):
+        with self.lock:
+            return {labelvalues: list(counts) for labelvalues, counts in self.values.items()}
+
+    def samples(self, values):
+        samples = []
+        for labelvalues, counts in values.items():
+            cumulative_count = 0
+            for upper_bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative_count += count
+                labels = format_labels(self.labelnames, labelvalues,
+                                       (('le', format_value(float(upper_bound))),))
+                samples.append(f'{self.name}_bucket{labels} {cumulative_count}')
+            labels = format_labels(self.labelnames, labelvalues)
+            samples.append(f'{self.name}_sum{labels} {format_value(counts[-2])}')
+            samples.append(f'{self.name}_count{labels} {counts[-1]}')
+        return samples
+
+    def merge(self, values, other_values):
+        merged = dict(values)
+        for labelvalues, counts in other_values.items():
+            if labelvalues in merged:
+                counts = [count + other_count
+                          for count, other_count in zip(merged[labelvalues], counts)]
+            merged[labelvalues] = counts
+        return merged
+
+
+# Keeps the metrics and renders them in the Prometheus text exposition format
+class MetricsRegistry:
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function):
+        return self.register(CallbackGauge(name, documentation, function))
+
+    # Returns the values of the metrics in a json serializable dictionary indexed by metric name,
+    # which render can add to the values of another registry
+    def snapshot(self, include_gauges=True):
+        return {
+            metric.name: [[list(labelvalues), value]
+                          for labelvalues, value in metric.current_values().items()]
+            for metric in self.metrics.values()
+            if include_gauges or metric.metric_type != 'gauge'
+        }
+
+    # Renders the metrics adding the values of the received snapshots of other processes to the
+    # ones of this registry. The values of counters, histograms and gauges are added up
+    def render(self, snapshots=()):
+        lines = []
+        for metric in self.metrics.values():
+            values = metric.current_values()
+            for snapshot in snapshots:
+                other_values = snapshot.get(metric.name)
+                if other_values:
+                    values = metric.merge(values, {tuple(labelvalues): value
+                                                   for labelvalues, value in other_values})
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
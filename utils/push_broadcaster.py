@@ -0,0 +1,164 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete
+from utils.logger import logger
+from utils.expo_push_client import push_client, ERROR_STATUS, PUSH_MAX_CONCURRENT_REQUESTS
+from database.accounts import expo_tokens_statement
+from database.database import new_session
+from database.read_replica import read_replica
+from database_models.broadcast_job import BroadcastJob
+
+
+# Amount of emails of each IN (...) query that resolves the expo tokens of the receivers
+BROADCAST_RESOLVE_BATCH_SIZE = int(os.environ.get('BROADCAST_RESOLVE_BATCH_SIZE', 500))
+# Days that the progress of a broadcast is kept after it was started
+BROADCAST_JOBS_RETENTION = timedelta(days=int(os.environ.get('BROADCAST_JOBS_RETENTION_DAYS', 7)))
+
+QUEUED_STATUS = 'queued'
+RESOLVING_STATUS = 'resolving'
+SENDING_STATUS = 'sending'
+DONE_STATUS = 'done'
+FAILED_STATUS = 'failed'
+CANCELLED_STATUS = 'cancelled'
+
+
+def job_progress(job):
+    return {
+        'job_id': job.job_id,
+        'job_status': job.status,
+        'receivers': job.receivers,
+        'tokens': job.tokens,
+        'sent': job.sent,
+        'failed': job.failed,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
+
+
+# Sends a message to many accounts in a background task per broadcast. The expo tokens are read
+# first, in batches of resolve_batch_size emails, and the session is closed before sending so
+# that no connection is held while waiting for Expo. Each distinct token gets a message, and the
+# messages are sent in batches of up to 100 with up to max_concurrent_batches requests at the same
+# time. The progress of each job is written to the primary database with job_session_factory, so
+# it can be read from any server worker, while the task that sends it only lives in the worker
+# that started it
+class PushBroadcaster:
+    def __init__(self, client=push_client, session_factory=read_replica.session,
+                 job_session_factory=new_session,
+                 resolve_batch_size=BROADCAST_RESOLVE_BATCH_SIZE,
+                 max_concurrent_batches=PUSH_MAX_CONCURRENT_REQUESTS,
+                 jobs_retention=BROADCAST_JOBS_RETENTION):
+        self.client = client
+        self.session_factory = session_factory
+        self.job_session_factory = job_session_factory
+        self.resolve_batch_size = resolve_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.jobs_retention = jobs_retention
+        self.tasks = {}
+
+    # Starts sending the message, whose to field is set for each token, to the received emails or
+    # to every account of the account type if emails is None. Returns the progress of the job
+    # once it is stored, the jobs that are older than the retention are deleted at the same time
+    async def start(self, message, emails=None, account_type=None):
+        job = BroadcastJob(job_id=uuid.uuid4().hex, status=QUEUED_STATUS,
+                           receivers=len(emails) if emails is not None else None,
+                           tokens=0, sent=0, failed=0, created_at=datetime.now())
+        db = self.job_session_factory()
+        try:
+            await db.execute(delete(BroadcastJob).where(
+                BroadcastJob.created_at < job.created_at - self.jobs_retention))
+            db.add(job)
+            await db.commit()
+        finally:
+            await db.close()
+        self.tasks = {job_id: task for job_id, task in self.tasks.items() if not task.done()}
+        self.tasks[job.job_id] = asyncio.get_running_loop().create_task(
+            self.__run(job.job_id, message, emails, account_type))
+        return job_progress(job)
+
+    # Returns the progress of the job read with the received session, or None if it does not exist
+    async def get_job(self, db, job_id):
+        job = (await db.execute(
+            select(BroadcastJob).where(BroadcastJob.job_id == job_id)
+        )).scalars().first()
+        return job_progress(job) if job is not None else None
+
+    def running_jobs(self):
+        return sum(1 for task in self.tasks.values() if not task.done())
+
+    # Cancels the broadcasts that are still running, their jobs keep the progress that they made
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        tasks = [task for task in self.tasks.values()
+                 if not task.done() and task.get_loop() is loop]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __run(self, job_id, message, emails, account_type):
+        status = FAILED_STATUS
+        try:
+            await self.__update_job(job_id, status=RESOLVING_STATUS)
+            tokens = await self.__resolve_tokens(emails, account_type)
+            await self.__update_job(job_id, status=SENDING_STATUS, tokens=len(tokens))
+            await self.__send(job_id, [{**message, 'to': token} for token in tokens])
+            status = DONE_STATUS
+        except asyncio.CancelledError:
+            status = CANCELLED_STATUS
+            raise
+        except Exception as e:
+            logger.warning(f"Error sending push broadcast {job_id}: {e}")
+        finally:
+            try:
+                await self.__update_job(job_id, status=status, finished_at=datetime.now())
+            except Exception as e:
+                logger.warning(f"Error storing the status of push broadcast {job_id}: {e}")
+
+    async def __update_job(self, job_id, **values):
+        db = self.job_session_factory()
+        try:
+            await db.execute(
+                update(BroadcastJob).where(BroadcastJob.job_id == job_id).values(**values))
+            await db.commit()
+        finally:
+            await db.close()
+
+    # Returns the distinct expo tokens in the order in which they were read
+    async def __resolve_tokens(self, emails, account_type):
+        tokens = {}
+        db = await self.session_factory()
+        try:
+            if emails is None:
+                result = await db.stream(expo_tokens_statement(account_type=account_type))
+                async for rows in result.partitions(self.resolve_batch_size):
+                    tokens.update((row.expo_token, None) for row in rows)
+            else:
+                unique_emails = list(dict.fromkeys(emails))
+                for i in range(0, len(unique_emails), self.resolve_batch_size):
+                    rows = (await db.execute(expo_tokens_statement(
+                        unique_emails[i:i + self.resolve_batch_size], account_type
+                    ))).all()
+                    tokens.update((row.expo_token, None) for row in rows)
+        finally:
+            await db.close()
+        return list(tokens.keys())
+
+    # The counts are incremented in the database, since the batches finish in any order
+    async def __send(self, job_id, messages):
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+
+        async def send_batch(batch):
+            async with semaphore:
+                tickets = await self.client.send(batch)
+            failed = sum(1 for ticket in tickets if ticket.get('status') == ERROR_STATUS)
+            await self.__update_job(job_id, sent=BroadcastJob.sent + len(batch) - failed,
+                                    failed=BroadcastJob.failed + failed)
+
+        batch_size = self.client.batch_size
+        await asyncio.gather(*[send_batch(messages[i:i + batch_size])
+                               for i in range(0, len(messages), batch_size)])
+
+
+push_broadcaster = PushBroadcaster()
@@ -0,0 +1,129 @@
+import os
+import time
+from contextvars import ContextVar
+from utils.prometheus_registry import MetricsRegistry
+
+
+DB_STAGE = 'database'
+HASHING_STAGE = 'password_hashing'
+UNMATCHED_ROUTE = '<unmatched>'
+
+# If it is true the responses have headers with the amount of queries of the request and the time
+# that they took, which is meant for debugging and for the tests
+QUERY_DEBUG_HEADERS = os.environ.get('QUERY_DEBUG_HEADERS', 'false').lower() == 'true'
+QUERY_COUNT_HEADER = 'x-db-query-count'
+QUERY_TIME_HEADER = 'x-db-time-ms'
+
+metrics_registry = MetricsRegistry()
+
+http_requests = metrics_registry.counter(
+    'http_requests_total', 'Amount of handled requests', ('method', 'route', 'status'))
+http_request_duration = metrics_registry.histogram(
+    'http_request_duration_seconds', 'Time to handle a request', ('method', 'route'))
+http_request_stage_duration = metrics_registry.histogram(
+    'http_request_stage_duration_seconds',
+    'Time that a request spent in each stage (database queries, password hashing)',
+    ('method', 'route', 'stage'))
+db_query_duration = metrics_registry.histogram(
+    'database_query_duration_seconds', 'Time to execute a database query', ())
+password_hashing_duration = metrics_registry.histogram(
+    'password_hashing_duration_seconds', 'Time to hash or verify a password in a worker',
+    ('operation',))
+outbound_http_duration = metrics_registry.histogram(
+    'outbound_http_request_duration_seconds', 'Time of the requests to external services',
+    ('service', 'status'))
+
+
+# Amount of queries of a request and seconds that it spent in each stage
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.stage_times = {}
+
+    def add_stage_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0) + seconds
+
+
+# Stats of the request that is being handled in the current context
+request_stats = ContextVar('request_stats', default=None)
+# Method and path of the requests that are being handled, indexed by their stats
+in_flight_requests = {}
+
+
+def add_stage_time(stage, seconds):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.add_stage_time(stage, seconds)
+
+
+def observe_db_query(seconds):
+    db_query_duration.observe(seconds)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.add_stage_time(DB_STAGE, seconds)
+
+
+def observe_password_hashing(operation, seconds):
+    password_hashing_duration.observe(seconds, operation)
+    add_stage_time(HASHING_STAGE, seconds)
+
+
+def observe_outbound_request(service, status, seconds):
+    outbound_http_duration.observe(seconds, service, str(status))
+
+
+# ASGI middleware that counts the requests by route and status code, and records their latency and
+# the time that they spent in each stage. Routes are identified by their path template, so that
+# the amount of label values does not grow with the path parameters. The debug headers only count
+# the queries that ran before the response started
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        in_flight_requests[stats] = (scope['method'], scope['path'])
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if QUERY_DEBUG_HEADERS:
+                    db_time = stats.stage_times.get(DB_STAGE, 0) * 1000
+                    message = {**message, 'headers': [
+                        *message.get('headers', []),
+                        (QUERY_COUNT_HEADER.encode(), str(stats.queries).encode()),
+                        (QUERY_TIME_HEADER.encode(), f'{db_time:.3f}'.encode()),
+                    ]}
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            request_stats.reset(token)
+            del in_flight_requests[stats]
+            method = scope['method']
+            route = self.__route(scope)
+            http_requests.inc(method, route, str(status))
+            http_request_duration.observe(duration, method, route)
+            for stage, seconds in stats.stage_times.items():
+                http_request_stage_duration.observe(seconds, method, route, stage)
+
+    # The router stores the endpoint that handled the request in the scope
+    def __route(self, scope):
+        if self.routes is None:
+            self.routes = {
+                route.endpoint: route.path
+                for route in getattr(scope.get('app'), 'routes', ())
+                if hasattr(route, 'endpoint')
+            }
+        return self.routes.get(scope.get('endpoint'), UNMATCHED_ROUTE)
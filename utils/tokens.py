@@ -0,0 +1,57 @@
+import os
+import time
+import secrets
+from jose import jwt, JWTError
+from utils.logger import logger
+
+
+ACCESS_TOKEN_TYPE = 'access'
+REFRESH_TOKEN_TYPE = 'refresh'
+
+ADMIN_ROLE = 'admin'
+USER_ROLE = 'user'
+
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+ACCESS_TOKEN_EXPIRE_SECONDS = int(os.environ.get('ACCESS_TOKEN_EXPIRE_SECONDS', 15 * 60))
+REFRESH_TOKEN_EXPIRE_SECONDS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_SECONDS', 7 * 24 * 3600))
+
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+if not JWT_SECRET_KEY:
+    # The tokens are only valid in this process, every worker and service that verifies them has
+    # to share the same JWT_SECRET_KEY
+    logger.warning("JWT_SECRET_KEY is not set, using a random secret key")
+    JWT_SECRET_KEY = secrets.token_urlsafe(32)
+
+
+def create_token(email, role, token_type, expire_seconds):
+    issued_at = int(time.time())
+    claims = {
+        'sub': email,
+        'role': role,
+        'type': token_type,
+        'iat': issued_at,
+        'exp': issued_at + expire_seconds,
+    }
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+# Returns a short lived access token and a refresh token that allows to get a new access token
+def create_tokens(email, role):
+    return {
+        'access_token': create_token(email, role, ACCESS_TOKEN_TYPE, ACCESS_TOKEN_EXPIRE_SECONDS),
+        'refresh_token': create_token(email, role, REFRESH_TOKEN_TYPE,
+                                      REFRESH_TOKEN_EXPIRE_SECONDS),
+        'token_type': 'bearer',
+    }
+
+
+# Returns the claims of the token if its signature is valid, it has not expired and it has the
+# received type, otherwise it returns None
+def decode_token(token, token_type):
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return None
+    if claims.get('type') != token_type:
+        return None
+    return claims
@@ -0,0 +1,142 @@
+import os
+import time
+from datetime import datetime
+import database_models.user as db_user
+import database_models.google as db_google
+from database.users_metrics import fetch_users_activity, compute_users_metrics,\
+    REGISTRATION_WINDOW, LOGIN_WINDOW, REGISTERED_ACTIVITY, LOGGED_ACTIVITY
+from database.login_events import login_event_writer
+
+
+# Seconds after which the metrics are recomputed from the database, 0 disables the cache
+USERS_METRICS_CACHE_TTL = float(os.environ.get('USERS_METRICS_CACHE_TTL', 60))
+REGISTRATION_BUCKET_SECONDS = 15 * 60
+LOGIN_BUCKET_SECONDS = 60
+
+TABLE_NAMES = (db_user.User.__tablename__, db_google.Google.__tablename__)
+
+
+# Counts the events of the last window_seconds seconds in a ring buffer of buckets of
+# bucket_seconds seconds, the events older than that are discarded as the window slides
+class SlidingWindowCounter:
+    def __init__(self, window_seconds, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+        self.buckets_amount = int(window_seconds // bucket_seconds)
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * self.buckets_amount
+        self.bucket_ids = [None] * self.buckets_amount
+
+    def add(self, date, amount=1):
+        bucket_id = int(date.timestamp() // self.bucket_seconds)
+        position = bucket_id % self.buckets_amount
+        if self.bucket_ids[position] != bucket_id:
+            # The event is older than the window
+            if (self.bucket_ids[position] is not None) and (self.bucket_ids[position] > bucket_id):
+                return
+            self.bucket_ids[position] = bucket_id
+            self.counts[position] = 0
+        self.counts[position] += amount
+
+    def total(self, date_now):
+        current_bucket_id = int(date_now.timestamp() // self.bucket_seconds)
+        oldest_bucket_id = current_bucket_id - self.buckets_amount
+        return sum(
+            count for count, bucket_id in zip(self.counts, self.bucket_ids)
+            if (bucket_id is not None) and (oldest_bucket_id < bucket_id <= current_bucket_id)
+        )
+
+
+# Keeps the users metrics in memory so that a poll does not scan the account tables. The counters
+# are updated when accounts are registered, log in or are blocked, and the whole snapshot is
+# recomputed from the database once it is older than ttl seconds, after writing the buffered login
+# events. The logins are counted per event instead of per user until the next recomputation, which
+# fixes that drift
+class UsersMetricsCache:
+    def __init__(self, ttl=USERS_METRICS_CACHE_TTL, event_writer=login_event_writer):
+        self.ttl = ttl
+        self.event_writer = event_writer
+        self.refreshed_at = None
+        self.totals = {}
+        self.registered = {
+            table_name: SlidingWindowCounter(REGISTRATION_WINDOW.total_seconds(),
+                                             REGISTRATION_BUCKET_SECONDS)
+            for table_name in TABLE_NAMES
+        }
+        self.logged = {
+            table_name: SlidingWindowCounter(LOGIN_WINDOW.total_seconds(), LOGIN_BUCKET_SECONDS)
+            for table_name in TABLE_NAMES
+        }
+        self.hits = 0
+        self.refreshes = 0
+
+    # Returns the same fields that the /users_metrics endpoint answers
+    async def get(self, db):
+        if self.ttl <= 0:
+            await self.event_writer.flush()
+            return await compute_users_metrics(db, from_login_events=self.event_writer.enabled)
+        if self.__is_expired():
+            await self.refresh(db)
+        else:
+            self.hits += 1
+        return self.__snapshot(datetime.now())
+
+    async def refresh(self, db):
+        await self.event_writer.flush()
+        date_now = datetime.now()
+        totals, activity = await fetch_users_activity(db, date_now, self.event_writer.enabled)
+        for counter in (*self.registered.values(), *self.logged.values()):
+            counter.clear()
+        for row in activity:
+            if row.activity == REGISTERED_ACTIVITY:
+                self.registered[row.table_name].add(row.date)
+            elif row.activity == LOGGED_ACTIVITY:
+                self.logged[row.table_name].add(row.date)
+        self.totals = totals
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    # Discards the snapshot so that the next poll recomputes it
+    def clear(self):
+        self.refreshed_at = None
+        self.totals = {}
+
+    # A new account also counts as a login, since its last login date is its registration date
+    def record_registration(self, table_name, date=None):
+        if self.refreshed_at is None:
+            return
+        date = date or datetime.now()
+        self.totals[table_name]['accounts'] += 1
+        self.registered[table_name].add(date)
+        self.logged[table_name].add(date)
+
+    def record_login(self, table_name, date=None):
+        if self.refreshed_at is None:
+            return
+        self.logged[table_name].add(date or datetime.now())
+
+    def record_block_change(self, table_name, is_blocked):
+        if self.refreshed_at is None:
+            return
+        self.totals[table_name]['blocked'] += 1 if is_blocked else -1
+
+    def __is_expired(self):
+        return (self.refreshed_at is None) or (time.monotonic() - self.refreshed_at >= self.ttl)
+
+    def __snapshot(self, date_now):
+        users_table, google_table = TABLE_NAMES
+        users_amount = sum(totals['accounts'] for totals in self.totals.values())
+        blocked_users = sum(totals['blocked'] for totals in self.totals.values())
+        return {
+            "users_amount": users_amount,
+            "blocked_users": blocked_users,
+            "non_blocked_users": users_amount - blocked_users,
+            "last_registered_users": self.registered[users_table].total(date_now),
+            "last_logged_users": self.logged[users_table].total(date_now),
+            "last_registered_google_users": self.registered[google_table].total(date_now),
+            "last_logged_google_users": self.logged[google_table].total(date_now)
+        }
+
+
+users_metrics_cache = UsersMetricsCache()